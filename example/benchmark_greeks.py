@@ -0,0 +1,72 @@
+from schwab_api import Schwab, OptionChain
+from schwab_api.greeks import chain_greeks, option_price
+from dotenv import load_dotenv
+import json
+import numpy as np
+import os
+import time
+
+# Compares fetching an option chain with server-side greeks (greeks=True) against fetching the
+# lean chain (greeks=False) and computing the greeks locally with schwab_api.greeks.
+#
+# Run it from the repository root, with the package installed:
+#     pip install -e .[options] python-dotenv
+#     python example/benchmark_greeks.py
+
+load_dotenv()
+
+username = os.getenv("SCHWAB_USERNAME")
+password = os.getenv("SCHWAB_PASSWORD")
+totp_secret = os.getenv("SCHWAB_TOTP")
+ticker = os.getenv("SCHWAB_BENCHMARK_TICKER", "$RUT")
+repeat = 5
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+# 1. Local computation only, on a synthetic chain: no login needed.
+expirations = []
+for days in range(1, 365, 7):
+    chains = []
+    for strike in range(1500, 2500, 5):
+        legs = []
+        for option_type in "CP":
+            vol = 0.2 + 0.1 * abs(strike - 2000) / 500
+            price = float(option_price(2000, strike, days / 365, vol, option_type == "C", rate=0.05))
+            legs.append({"Sym": "RUT{}{}{}".format(days, option_type, strike), "Strk": str(strike), "OptionType": option_type,
+                         "Bid": str(round(max(price - 0.05, 0.01), 2)), "Ask": str(round(price + 0.05, 2))})
+        chains.append({"Legs": legs})
+    expirations.append({"ExpirationGroup": {"DaysUntil": str(days)}, "Chains": chains})
+synthetic = OptionChain({"Expirations": expirations, "UnderlyingData": {"Last": "2000"}})
+
+timings = [timed(chain_greeks, synthetic, rate=0.05)[1] for _ in range(repeat)]
+print(f"Local greeks for {len(synthetic)} synthetic contracts: {min(timings) * 1000:.1f} ms")
+
+if not username:
+    print("Set SCHWAB_USERNAME, SCHWAB_PASSWORD and SCHWAB_TOTP to compare with server-side greeks.")
+    raise SystemExit
+
+# 2. Server-side greeks against the lean chain plus local greeks.
+api = Schwab()
+print("Logging into Schwab")
+api.login(username=username, password=password, totp_secret=totp_secret)
+
+with_greeks, server_time = timed(api.get_options_chains_v2, ticker, greeks=True)
+lean, lean_time = timed(api.get_options_chains_v2, ticker, greeks=False)
+server_chain, server_parse = timed(OptionChain, with_greeks)
+lean_chain, lean_parse = timed(OptionChain, lean)
+local_time = min(timed(lean_chain.compute_greeks, rate=0.05)[1] for _ in range(repeat))
+
+print(f"{ticker}: {len(lean_chain)} contracts")
+print(f"greeks=True:  {len(json.dumps(with_greeks)) / 1e6:.2f} MB, fetch {server_time:.2f} s, parse {server_parse * 1000:.0f} ms")
+print(f"greeks=False: {len(json.dumps(lean)) / 1e6:.2f} MB, fetch {lean_time:.2f} s, parse {lean_parse * 1000:.0f} ms, "
+      f"local greeks {local_time * 1000:.1f} ms")
+
+# Both chains are sorted the same way, so the rows line up.
+for name in ("delta", "gamma", "theta", "vega"):
+    both = np.isfinite(server_chain.columns[name]) & np.isfinite(lean_chain.columns[name])
+    if both.any():
+        difference = np.abs(server_chain.columns[name][both] - lean_chain.columns[name][both])
+        print(f"{name}: median difference with the server {np.median(difference):.4g} over {both.sum()} contracts")
@@ -1,7 +1,6 @@
 from schwab_api import Schwab
 from dotenv import load_dotenv
 import os
-import pandas as pd
 import pprint
 
 load_dotenv()
@@ -22,40 +21,29 @@ logged_in = api.login(
 )
 
 # Get quotes for options.
-option_chain = api.get_options_chains_v2('$RUT') #try also with parameter greeks = True 
-
-# The json output is deeply nested so here is how you can work with it:
-# Normalizing the data into a pandas DataFrame
-df1 = pd.json_normalize(option_chain,['Expirations','Chains','Legs'],[['Expirations','ExpirationGroup']])
-# Normalizing Expirations.ExpirationGroup
-df2 = pd.json_normalize(df1['Expirations.ExpirationGroup'])
-# Dropping the column Expirations.ExpirationGroup in df1 and concatenating the two dataframes (side by side)
-df1.drop('Expirations.ExpirationGroup',axis=1, inplace=True)
-df = pd.concat([df1,df2],axis=1)
-# Converting strings to numbers when relevant. Keeping strings is conversion is not possible.
-df = df.apply(lambda col: pd.to_numeric(col, errors='coerce')).fillna(df)
+# as_chain=True parses the deeply nested json into an OptionChain with one numpy array per column.
+# The raw json is still available as option_chain.payload.
+option_chain = api.get_options_chains_v2('$RUT', as_chain=True) #try also with parameter greeks = True 
 
 # Let's isolate options with closest expiration date:
-closest_expiration_options = df[(df.DaysUntil==df.DaysUntil.min())]
+closest_expiration = option_chain.nearest_expiry()
 
-# Let's find the call and put options with closest strike price to current price:
-# First let's grab the current price. No need to use api.quote_v2(), it's already in chains
-current_price = float(option_chain['UnderlyingData']['Last'])
-# Finding the index of the closest strike prices
-ATM_call_index = abs(closest_expiration_options[closest_expiration_options.OptionType=="C"].Strk - current_price).idxmin()
-ATM_put_index = abs(closest_expiration_options[closest_expiration_options.OptionType=="P"].Strk - current_price).idxmin()
-# Grabbing the rows at those indexes 
-ATM_call_option = closest_expiration_options.iloc[ATM_call_index]
-ATM_put_option = closest_expiration_options.iloc[ATM_put_index]
+# Let's find the call and put options with closest strike price to current price.
+# No need to use api.quote_v2() for the current price, it's already in the chain (option_chain.underlying_price)
+ATM_call_option = option_chain.atm("C", closest_expiration)
+ATM_put_option = option_chain.atm("P", closest_expiration)
 print(f"Call and Put ATM options (At The Money) with the closest expiration:")
-print(f"Call: {ATM_call_option.Sym}         Ask: {ATM_call_option.Ask}      Bid: {ATM_call_option.Bid}")
-print(f"Put:  {ATM_put_option.Sym}         Ask: {ATM_put_option.Ask}      Bid: {ATM_put_option.Bid}")
+print(f"Call: {ATM_call_option['symbol']}         Ask: {ATM_call_option['ask']}      Bid: {ATM_call_option['bid']}")
+print(f"Put:  {ATM_put_option['symbol']}         Ask: {ATM_put_option['ask']}      Bid: {ATM_put_option['bid']}")
+
+# Options with a strike within 2% of the current price, as a pandas DataFrame:
+print(option_chain.near_strikes(0.02, closest_expiration).to_pandas())
 
 # Now let's place an at the money straddle for the closest expiration date
 # Preparing the parameters
 # Setting the straddle strategy code:
 strategy = 226 # for more codes, look at the comment section of option_trade_v2().
-symbols = [ATM_call_option.Sym,ATM_put_option.Sym]
+symbols = [ATM_call_option['symbol'],ATM_put_option['symbol']]
 instructions = ["BTO","BTO"] #Buy To Open. To close the position, it would be STC (Sell To Close)
 quantities = [1,1]
 # Note that the elements are paired. So the first symbol of the list will be associated with the first element of instructions and quantities.
@@ -63,7 +51,7 @@ account_info = api.get_account_info_v2()
 account_id = next(iter(account_info))
 order_type = 202 #net debit. 201 for net credit. You probably should avoid 49 market with options...
 # Let's set the limit price at the median between bid and ask.
-limit_price = (ATM_call_option.Ask + ATM_call_option.Bid + ATM_put_option.Ask + ATM_put_option.Bid) / 2
+limit_price = (ATM_call_option['ask'] + ATM_call_option['bid'] + ATM_put_option['ask'] + ATM_put_option['bid']) / 2
 # Let's place the trade:
 messages, success = api.option_trade_v2(
     strategy=strategy, 
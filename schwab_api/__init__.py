@@ -1,2 +1,18 @@
 from .schwab import Schwab
+from .async_schwab import AsyncSchwab
+from .browser_pool import BrowserPool
+from .metrics import Metrics
+from .option_chain import OptionChain
+from .option_chain_cache import OptionChainCache, AsyncOptionChainCache
+from .portfolio import PortfolioFrame
+from .quotes import QuoteCache
+from .scanner import ChainScanner, AsyncChainScanner
+from .retry import RetryPolicy, HedgePolicy
+from .scheduler import RequestScheduler
+from .session_pool import SessionPool, AsyncSessionPool
+from .session_store import SessionStore, FileSessionStore, SQLiteSessionStore
+from .throttle import TokenBucket, AdaptiveRateLimiter
+from .transaction_store import TransactionStore
+from .transport import Transport
+from .verified_ticket import VerifiedTicket
 from .totp_generator import generate_totp
\ No newline at end of file
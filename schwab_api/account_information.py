@@ -1,4 +1,37 @@
-class Account(dict):
+from collections.abc import Mapping
+
+
+class _Model(Mapping):
+    """
+    Fields are stored in __slots__, without a per-instance dict, but can also be read like a
+    dictionary: model["symbol"], model.get("symbol"), dict(model), model == {...}
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key in self.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def _as_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __repr__(self) -> str:
+        return str(self._as_dict())
+
+    def __str__(self) -> str:
+        return str(self._as_dict())
+
+
+class Account(_Model):
+    __slots__ = ("account_id", "positions", "market_value", "available_cash", "account_value", "cost_basis")
+
     def __init__(self, account_id, positions, market_value, available_cash, account_value, cost_basis):
         self.account_id = account_id
         self.positions = positions
@@ -7,23 +40,10 @@ class Account(dict):
         self.account_value = account_value
         self.cost_basis = cost_basis
 
-    def _as_dict(self):
-        return {
-            "account_id": self.account_id,
-            "positions": self.positions,
-            "market_value": self.market_value,
-            "available_cash": self.available_cash,
-            "account_value": self.account_value,
-            "cost_basis": self.cost_basis,
-        }
 
-    def __repr__(self) -> str:
-        return str(self._as_dict())
-        
-    def __str__(self) -> str:
-        return str(self._as_dict())
+class Position(_Model):
+    __slots__ = ("symbol", "description", "quantity", "cost", "market_value", "security_id")
 
-class Position(dict):
     def __init__(self, symbol, description, quantity, cost, market_value, security_id):
         self.symbol = symbol
         self.description = description
@@ -32,18 +52,12 @@ class Position(dict):
         self.market_value = market_value
         self.security_id = security_id
 
-    def _as_dict(self):
-        return {
-            "symbol": self.symbol,
-            "description": self.description,
-            "quantity": self.quantity,
-            "cost": self.cost,
-            "market_value": self.market_value,
-            "security_id": self.security_id
-        }
-
-    def __repr__(self) -> str:
-        return str(self._as_dict())
 
-    def __str__(self) -> str:
-        return str(self._as_dict())
\ No newline at end of file
+def _build(model, as_models, *fields):
+    """
+    Returns a model, or directly the dictionary returned by model._as_dict() without creating
+    the model first.
+    """
+    if as_models:
+        return model(*fields)
+    return dict(zip(model.__slots__, fields))
@@ -0,0 +1,693 @@
+import asyncio
+import json
+import time
+
+from . import urls
+from .authentication import SessionManager, _login_flight
+from .quotes import (
+    QUOTE_CHUNK_SIZE,
+    AsyncQuoteBatcher,
+    _chunks,
+    _dedupe_symbols,
+    _merge_quote_results,
+    quote_cache,
+    quote_symbol,
+)
+from .option_chain import OptionChain
+from .json_stream import aiter_array_items
+from .quote_stream import AsyncQuotePoller
+from .metrics import client_metrics, instrumented
+from .retry import hedge_policy, retry_policy
+from .scheduler import request_scheduler
+from .throttle import rate_limiter
+from .transport import Transport
+from .schwab import (
+    TransactionHistoryError,
+    _OPTION_INSTRUCTION_CODES,
+    _buy_sell_code_v2,
+    _cancel_order_v2_payload,
+    _format_limit_price,
+    _option_chains_v2_url,
+    _option_trade_v2_payload,
+    _orders_by_account,
+    _parse_account_info_v2,
+    _place_payload,
+    _placement_result,
+    _quote_v2_payload,
+    _trade_result,
+    _trade_v2_payload,
+    _transaction_history_v2_payload,
+    _verified_ticket,
+)
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class AsyncSchwab(SessionManager):
+    def __init__(self, session_cache=None, **kwargs):
+        """
+        The asyncio version of the Schwab class. Every v2 method is a coroutine and all of them
+        share a single pooled, non-blocking HTTP client, so one event loop can keep many
+        requests in flight at once:
+
+            async with AsyncSchwab() as api:
+                await api.login(username, password, totp_secret)
+                quotes, orders = await asyncio.gather(api.quote_v2(["PFE"]), api.orders_v2())
+
+        Requires httpx (pip install schwab-api[async]).
+
+        :type session_cache: str or SessionStore
+        :param session_cache: Path to an optional session file, used to save/restore credentials.
+            Paths ending in .db, .sqlite or .sqlite3 are stored in SQLite. Several processes can
+            share the same session_cache.
+
+        Accepts the same connection pooling keyword arguments as Schwab (transport,
+        pool_connections, pool_maxsize, http2, timeout), token caching (refresh_tokens),
+        login (browser_pool, warm_browser), quote (quote_batch_window, quote_cache),
+        throttling (rate_limit), retry (retry, hedge), scheduling (scheduler) and metrics
+        (metrics) keyword arguments as Schwab, except that pool_maxsize defaults to 100.
+        """
+        if httpx is None:
+            raise ImportError("AsyncSchwab requires httpx; install it with `pip install schwab-api[async]`")
+        self.headless = kwargs.get("headless", True)
+        self.browserType = kwargs.get("browserType", "firefox")
+        self.session_cache = session_cache
+        transport = kwargs.get("transport") or Transport(
+            pool_connections=kwargs.get("pool_connections", 10),
+            pool_maxsize=kwargs.get("pool_maxsize", 100),
+            http2=kwargs.get("http2", False),
+            timeout=kwargs.get("timeout", None)
+        )
+        self._async_token_lock = None
+        self._async_refresher = None
+        super(AsyncSchwab, self).__init__(
+            debug=kwargs.get("debug", False),
+            transport=transport,
+            refresh_tokens=kwargs.get("refresh_tokens", False),
+            browser_pool=kwargs.get("browser_pool"),
+            warm_browser=kwargs.get("warm_browser", False),
+            rate_limiter=rate_limiter(kwargs.get("rate_limit")),
+            retry_policy=retry_policy(kwargs.get("retry")),
+            hedge_policy=hedge_policy(kwargs.get("hedge")),
+            scheduler=request_scheduler(kwargs.get("scheduler")),
+            metrics=client_metrics(kwargs.get("metrics"))
+        )
+        quote_batch_window = kwargs.get("quote_batch_window")
+        self.quote_batcher = AsyncQuoteBatcher(self._quote_v2_batch, quote_batch_window) if quote_batch_window else None
+        self.quote_cache = quote_cache(kwargs.get("quote_cache"))
+        # background quote refreshes, kept so they aren't garbage collected
+        self._quote_refreshes = set()
+        self._quote_pollers = dict()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        """
+        Stops the background token refresher, closes the connection pools of the transport and
+        the browser pool if this client created it.
+        """
+        if self._async_refresher is not None:
+            self._async_refresher.cancel()
+        for task in self._quote_refreshes:
+            task.cancel()
+        for poller in self._quote_pollers.values():
+            poller.close()
+        await self.transport.aclose()
+        if self._owns_browser_pool:
+            self.browser_pool.close()
+
+    async def _async_request(self, method, url, **kwargs):
+        """
+        Non-blocking version of SessionManager._request().
+        """
+        retry = self.retry_policy.for_url(url) if self.retry_policy is not None else None
+        hedge = self.hedge_policy
+        if hedge is not None and (kwargs.get("stream") or not hedge.applies(url)):
+            hedge = None
+
+        async def attempt(timeout=None):
+            options = dict(kwargs, timeout=timeout) if timeout is not None else kwargs
+            if hedge is not None:
+                return await hedge.run_async(url, lambda: self._async_send(method, url, **options))
+            return await self._async_send(method, url, **options)
+
+        if retry is None:
+            return await attempt()
+        return await retry.run_async(url, attempt)
+
+    async def _async_send(self, method, url, **kwargs):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire_async(url)
+        if self.scheduler is not None:
+            async with self.scheduler.async_slot(url):
+                r = await self._transport_request_async(method, url, **kwargs)
+        else:
+            r = await self._transport_request_async(method, url, **kwargs)
+        if self.rate_limiter is not None:
+            self.rate_limiter.record(url, r.status_code, r.headers)
+        self._check_token_rejected(r, kwargs.get("headers"))
+        return r
+
+    async def _transport_request_async(self, method, url, **kwargs):
+        if self.metrics is None:
+            return await self.transport.async_request(method, url, **kwargs)
+        return await self.metrics.timed_async(
+            method, url, kwargs, lambda: self.transport.async_request(method, url, **kwargs))
+
+    async def check_auth(self):
+        r = await self._async_request("GET", urls.account_info_v2(), session=self.session)
+        if r.status_code != 200:
+            return False
+        return True
+
+    async def login(self, username, password, totp_secret, lazy=False):
+        """
+        Async version of Schwab.login(); see SessionManager.login() for the parameters.
+        """
+        if self._restore_session(username, password, totp_secret):
+            try:
+                if await self.update_token():
+                    return True
+            except:
+                if self.debug:
+                    print('DEBUG: update token failed, falling back to login')
+
+        if lazy:
+            return True
+        else:
+            # attempt to login
+            return await self._async_single_flight_login(self._async_login_and_save, time.monotonic())
+
+    async def update_token(self, token_type='api', login=True, force=False):
+        """
+        Async version of SessionManager.update_token(); tokens are cached per scope until
+        they are about to expire.
+        """
+        token = None if force else self._cached_token(token_type)
+        if token is not None:
+            self.headers['authorization'] = f"Bearer {token}"
+            return True
+
+        if self._async_token_lock is None:
+            self._async_token_lock = asyncio.Lock()
+        async with self._async_token_lock:
+            # Another coroutine may have refreshed the token while we were waiting.
+            token = None if force else self._cached_token(token_type)
+            if token is not None:
+                self.headers['authorization'] = f"Bearer {token}"
+                return True
+
+            with self._operation("update_token"):
+                started = time.monotonic()
+                r = await self._async_request("GET", urls.bearer_token(token_type), session=self.session)
+                if r.status_code >= 400:
+                    if login:
+                        if self.debug:
+                            print("DEBUG: session invalid; logging in again")
+                        return await self._async_single_flight_login(lambda: self._async_relogin(token_type), started)
+                    else:
+                        raise ValueError(f"Error updating Bearer token: {r.status_code} {r.text}")
+
+                self._store_token(token_type, r.json()['token'])
+        await self._async_save_session_cache()
+        if self.refresh_tokens and (self._async_refresher is None or self._async_refresher.done()):
+            self._async_refresher = asyncio.ensure_future(self._refresh_tokens_forever_async())
+        return True
+
+    async def _async_single_flight_login(self, login, since):
+        """
+        Async version of SessionManager._single_flight_login(); login is a coroutine function.
+        Waiting on a login started by another thread doesn't block the event loop.
+        """
+        flight = _login_flight(self._credentials_key())
+        future, leader = flight.join(since)
+        if not leader:
+            result = await asyncio.wrap_future(future)
+            self._adopt_login(flight)
+            return result
+        try:
+            result = await login()
+        except BaseException as e:
+            flight.finish(future, error=e)
+            raise
+        flight.finish(future, self)
+        return result
+
+    async def _async_relogin(self, token_type):
+        """
+        Async version of SessionManager._relogin(). Uses the session stored by another process
+        if there is a newer one, but doesn't wait on the store's lock since that would block
+        the event loop.
+        """
+        if self._reload_session_cache():
+            r = await self._async_request("GET", urls.bearer_token(token_type), session=self.session)
+            if r.status_code < 400:
+                self._store_token(token_type, r.json()['token'])
+                return True
+        return await self._async_login_and_save()
+
+    async def _async_login_and_save(self):
+        """
+        Async version of SessionManager._login_and_save().
+        """
+        result = await self._async_login()
+        await self._async_save_session_cache()
+        return result
+
+    async def _async_save_session_cache(self):
+        """
+        Saves the session from a worker thread: saving waits on the store's lock, which
+        another process may hold for a whole login, and that must not block the event loop.
+        """
+        if self.session_store is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._save_session_cache)
+
+    async def _refresh_tokens_forever_async(self):
+        while True:
+            token_type, delay = self._next_token_refresh()
+            if token_type is None:
+                return
+            await asyncio.sleep(delay)
+            try:
+                await self.update_token(token_type=token_type, login=False, force=True)
+            except Exception as e:
+                # Leave it to the next call to refresh the token (and log in if needed).
+                if self.debug:
+                    print(f"DEBUG: background token refresh failed: {e}")
+                self.tokens.pop(token_type, None)
+
+    async def _headers(self, token_type, **extra):
+        """
+        Refreshes the bearer token for token_type if needed and returns a private copy of the
+        headers for a single request.
+        """
+        await self.update_token(token_type=token_type)
+        return self._copy_headers(token_type, extra)
+
+    @instrumented
+    async def get_transaction_history_v2(self, account_id, time_frame="All"):
+        """
+        Async version of Schwab.get_transaction_history_v2().
+        """
+        data = _transaction_history_v2_payload(account_id, time_frame)
+        r = await self._async_request("POST", urls.transaction_history_v2(), json=data, headers=dict(self.headers))
+        if r.status_code != 200:
+            return [r.text], False
+        return json.loads(r.text)
+
+    async def iter_transaction_history_v2(self, account_id, time_frame="All"):
+        """
+        Async generator version of Schwab.iter_transaction_history_v2().
+        """
+        data = _transaction_history_v2_payload(account_id, time_frame)
+        r = await self._async_request("POST", urls.transaction_history_v2(), json=data, headers=dict(self.headers), stream=True)
+        try:
+            if r.status_code != 200:
+                await r.aread()
+                raise TransactionHistoryError("Could not get the transaction history: {}".format(r.text), r.status_code)
+            async for transaction in aiter_array_items(r.aiter_bytes(), "BrokerageTransactions"):
+                yield transaction
+        finally:
+            await r.aclose()
+
+    @instrumented
+    async def trade_v2(self,
+        ticker,
+        side,
+        qty,
+        account_id,
+        dry_run=True,
+        # The Fields below are experimental fields that should only be changed if you know what you're doing.
+        order_type=49,
+        duration=48,
+        limit_price=0,
+        stop_price=0,
+        primary_security_type=46,
+        valid_return_codes = {0,10},
+        affirm_order=False,
+        costBasis='FIFO'
+        ):
+        """
+        Async version of Schwab.trade_v2(); see its docstring for the parameters.
+
+        Returns messages (list of strings), is_success (boolean)
+        """
+        ticket = await self.verify_v2(
+            ticker, side, qty, account_id, order_type, duration, limit_price, stop_price,
+            primary_security_type, valid_return_codes, costBasis)
+        if dry_run or not ticket.success:
+            return ticket.messages, ticket.success
+        return await self.place(ticket, affirm_order)
+
+    @instrumented
+    async def verify_v2(self,
+        ticker,
+        side,
+        qty,
+        account_id,
+        order_type=49,
+        duration=48,
+        limit_price=0,
+        stop_price=0,
+        primary_security_type=46,
+        valid_return_codes = {0,10},
+        costBasis='FIFO'
+        ):
+        """
+        Async version of Schwab.verify_v2().
+
+        Returns a VerifiedTicket
+        """
+        buySellCode = _buy_sell_code_v2(side)
+        limit_price, limit_price_warning = _format_limit_price(limit_price)
+
+        data = _trade_v2_payload(
+            ticker, buySellCode, qty, account_id, order_type, duration,
+            limit_price, stop_price, primary_security_type, costBasis)
+
+        # Adding this header seems to be necessary.
+        headers = await self._headers('update', **{'schwab-resource-version': '1.0'})
+        r = await self._async_request("POST", urls.order_verification_v2(), json=data, headers=headers)
+        return _verified_ticket(data, r, valid_return_codes, limit_price_warning)
+
+    @instrumented
+    async def option_trade_v2(self,
+        strategy,
+        symbols,
+        instructions,
+        quantities,
+        account_id,
+        order_type,
+        dry_run=True,
+        duration=48,
+        limit_price=0,
+        stop_price=0,
+        valid_return_codes = {0,10},
+        affirm_order=False
+        ):
+        """
+        Async version of Schwab.option_trade_v2(); see its docstring for the parameters.
+
+        Returns messages (list of strings), is_success (boolean)
+        """
+        ticket = await self.verify_option_v2(
+            strategy, symbols, instructions, quantities, account_id, order_type, duration,
+            limit_price, stop_price, valid_return_codes)
+        if dry_run or not ticket.success:
+            return ticket.messages, ticket.success
+        return await self.place(ticket, affirm_order)
+
+    @instrumented
+    async def verify_option_v2(self,
+        strategy,
+        symbols,
+        instructions,
+        quantities,
+        account_id,
+        order_type,
+        duration=48,
+        limit_price=0,
+        stop_price=0,
+        valid_return_codes = {0,10}
+        ):
+        """
+        Async version of Schwab.verify_option_v2().
+
+        Returns a VerifiedTicket
+        """
+        if not (len(quantities) == len(symbols) and len(symbols) == len(instructions)):
+            raise ValueError("variables quantities, symbols and instructions must have the same length")
+
+        instruction_codes = [_OPTION_INSTRUCTION_CODES[i] for i in instructions]
+
+        data = _option_trade_v2_payload(
+            strategy, symbols, instruction_codes, quantities, account_id,
+            order_type, duration, limit_price, stop_price)
+
+        headers = await self._headers('update', **{'schwab-resource-version': '1.0'})
+        r = await self._async_request("POST", urls.order_verification_v2(), json=data, headers=headers)
+        return _verified_ticket(data, r, valid_return_codes)
+
+    @instrumented
+    async def place(self, ticket, affirm_order=False, valid_return_codes=None):
+        """
+        Async version of Schwab.place().
+
+        Returns messages (list of strings), is_success (boolean)
+        """
+        data = _place_payload(ticket, affirm_order)
+        headers = await self._headers('update', **{'schwab-resource-version': '1.0'})
+        r = await self._async_request("POST", urls.order_verification_v2(), json=data, headers=headers)
+        return _placement_result(r, ticket, valid_return_codes)
+
+    @instrumented
+    async def verify_many(self, orders, max_concurrency=8, **kwargs):
+        """
+        Async version of Schwab.verify_many(); max_concurrency limits the number of
+        verifications in flight at once.
+
+        Returns a list with, for each order, its VerifiedTicket or the exception raised while
+        verifying it.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def verify(order):
+            account_id, ticker, side, qty = order
+            async with semaphore:
+                return await self.verify_v2(ticker, side, qty, account_id, **kwargs)
+
+        return list(await asyncio.gather(*[verify(tuple(order)) for order in orders], return_exceptions=True))
+
+    @instrumented
+    async def trade_many(self, orders, max_concurrency=8, **kwargs):
+        """
+        Async version of Schwab.trade_many(); max_concurrency limits the number of orders in
+        flight at once. The orders of one account are still sent one after the other.
+        """
+        orders = [tuple(order) for order in orders]
+        results = [None] * len(orders)
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def trade_account(indexes):
+            for i in indexes:
+                async with semaphore:
+                    results[i] = await self._timed_trade(orders[i], start, kwargs)
+
+        await asyncio.gather(*[trade_account(indexes) for indexes in _orders_by_account(orders)])
+        return results
+
+    async def _timed_trade(self, order, start, kwargs):
+        account_id, ticker, side, qty = order
+        started = time.perf_counter()
+        try:
+            messages, success = await self.trade_v2(ticker, side, qty, account_id, **kwargs)
+            error = None
+        except Exception as e:
+            messages, success, error = [], False, repr(e)
+        return _trade_result(order, messages, success, error, started - start, time.perf_counter() - started)
+
+    @instrumented
+    async def cancel_order_v2(
+            self, account_id, order_id,
+            # The fields below are experimental and should only be changed if you know what
+            # you're doing.
+            instrument_type=46,
+            order_management_system=2,
+            ):
+        """
+        Async version of Schwab.cancel_order_v2(); see its docstring for the parameters.
+        """
+        data = _cancel_order_v2_payload(order_id, instrument_type, order_management_system)
+        extra = {"schwab-client-account": str(account_id), "schwab-resource-version": '2.0'}
+
+        headers = await self._headers('api', **extra)
+        r1 = await self._async_request("POST", urls.cancel_order_v2(), json=data, headers=headers)
+        if r1.status_code not in (200, 202):
+            return [r1.text], False
+
+        try:
+            response = json.loads(r1.text)
+            cancel_order_id = response['CancelOrderId']
+        except (json.decoder.JSONDecodeError, KeyError):
+            return [r1.text], False
+
+        data['ConfirmCancelOrderId'] = cancel_order_id
+        data['OrderProcessingControl'] = 2
+        headers = await self._headers('api', **extra)
+        r2 = await self._async_request("POST", urls.cancel_order_v2(), json=data, headers=headers)
+        if r2.status_code not in (200, 202):
+            return [r2.text], False
+        try:
+            response = json.loads(r2.text)
+            if response["CancelOperationSuccessful"]:
+                return response, True
+        except (json.decoder.JSONDecodeError, KeyError):
+            return [r2.text], False
+        return response, False
+
+    @instrumented
+    async def quote_v2(self, tickers, max_age=None):
+        """
+        Async version of Schwab.quote_v2(). With quote_batch_window, calls from concurrent
+        coroutines within that window are sent as a single request.
+        """
+        if self.quote_cache is None:
+            return await self._fetch_quotes(tickers)
+
+        symbols = _dedupe_symbols(tickers)
+        cached, missing, stale = self.quote_cache.lookup(symbols, max_age)
+        if stale:
+            self._refresh_quotes_later(stale)
+        if missing:
+            result = await self._fetch_quotes(missing)
+            if isinstance(result, tuple):
+                # Same error as without the cache, rather than quietly leaving symbols out
+                return result
+            else:
+                for quote in result:
+                    cached[quote_symbol(quote)] = quote
+        return [cached[symbol] for symbol in symbols if symbol in cached]
+
+    async def _fetch_quotes(self, tickers):
+        if self.quote_batcher is not None:
+            return await self.quote_batcher.quote(tickers)
+        return await self._quote_v2(tickers)
+
+    def _refresh_quotes_later(self, symbols):
+        task = asyncio.ensure_future(self._refresh_quotes(symbols))
+        self._quote_refreshes.add(task)
+        task.add_done_callback(self._quote_refreshes.discard)
+
+    async def _refresh_quotes(self, symbols):
+        try:
+            await self._quote_v2_batch(symbols)
+        finally:
+            self.quote_cache.refreshed(symbols)
+
+    async def _quote_v2(self, tickers):
+        data = _quote_v2_payload(tickers)
+
+        headers = await self._headers('update', **{'schwab-resource-version': '1.0'})
+        r = await self._async_request("POST", urls.ticker_quotes_v2(), json=data, headers=headers)
+        if r.status_code != 200:
+            return [r.text], False
+
+        response = json.loads(r.text)
+        if self.quote_cache is not None:
+            self.quote_cache.put(response["quotes"])
+        return response["quotes"]
+
+    @instrumented
+    async def quote_v2_batch(self, tickers, chunk_size=QUOTE_CHUNK_SIZE, max_concurrency=8, max_age=None):
+        """
+        Async version of Schwab.quote_v2_batch(); max_concurrency limits the number of
+        requests in flight at once.
+
+        Returns quotes (dict of symbol to quote), failures (dict of symbol to error message).
+        """
+        if self.quote_cache is None:
+            return await self._quote_v2_batch(tickers, chunk_size, max_concurrency)
+
+        cached, missing, stale = self.quote_cache.lookup(_dedupe_symbols(tickers), max_age)
+        if stale:
+            self._refresh_quotes_later(stale)
+        quotes, failures = await self._quote_v2_batch(missing, chunk_size, max_concurrency)
+        cached.update(quotes)
+        return cached, failures
+
+    async def _quote_v2_batch(self, tickers, chunk_size=QUOTE_CHUNK_SIZE, max_concurrency=8):
+        symbols = _dedupe_symbols(tickers)
+        chunks = _chunks(symbols, chunk_size)
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def quote_chunk(chunk):
+            async with semaphore:
+                return await self._quote_v2(chunk)
+
+        results = await asyncio.gather(*[quote_chunk(chunk) for chunk in chunks], return_exceptions=True)
+        return _merge_quote_results(chunks, results)
+
+    async def subscribe_quotes(self, symbols, interval=1.0, max_interval=None):
+        """
+        Async iterator version of Schwab.subscribe_quotes():
+
+            async for update in api.subscribe_quotes(["PFE", "AAPL"]):
+                print(update)
+        """
+        poller = self._quote_poller(interval, max_interval)
+        subscription = poller.subscribe(symbols)
+        try:
+            while True:
+                yield await subscription.get()
+        finally:
+            poller.unsubscribe(subscription)
+
+    def _quote_poller(self, interval, max_interval):
+        key = (interval, max_interval)
+        if key not in self._quote_pollers:
+            self._quote_pollers[key] = AsyncQuotePoller(self._quote_v2_batch, interval, max_interval)
+        return self._quote_pollers[key]
+
+    @instrumented
+    async def orders_v2(self, account_id=None):
+        """
+        Async version of Schwab.orders_v2().
+        """
+        extra = {'schwab-resource-version': '2.0'}
+        if account_id:
+            extra["schwab-client-account"] = str(account_id)
+        headers = await self._headers('api', **extra)
+        r = await self._async_request("GET", urls.orders_v2(), headers=headers)
+        if r.status_code != 200:
+            return [r.text], False
+
+        response = json.loads(r.text)
+        return response["Orders"]
+
+    @instrumented
+    async def get_account_info_v2(self, as_models=False, as_frame=False):
+        """
+        Async version of Schwab.get_account_info_v2().
+        """
+        headers = await self._headers('api')
+        r = await self._async_request("GET", urls.positions_v2(), headers=headers)
+        response = json.loads(r.text)
+        return _parse_account_info_v2(response, as_models, as_frame)
+
+    @instrumented
+    async def get_lot_info_v2(self, account_id, security_id):
+        """
+        Async version of Schwab.get_lot_info_v2(); see its docstring for the returned structure.
+        """
+        headers = await self._headers('api', **{"schwab-client-ids": str(account_id)})
+        r = await self._async_request(
+            "GET", urls.lot_details_v2(), params={
+                "isLong": "True", "itemissueid": security_id}, headers=headers)
+        is_success = r.status_code in [200, 207]
+        return is_success, (is_success and json.loads(r.text) or r.text)
+
+    @instrumented
+    async def get_options_chains_v2(self, ticker, greeks = False, as_chain = False):
+        """
+        Async version of Schwab.get_options_chains_v2().
+        Please do not abuse this API call. It is pulling all the option chains for a ticker.
+        """
+        full_url = _option_chains_v2_url(ticker, greeks)
+
+        headers = await self._headers('update', **{'schwab-resource-version': '1.0'})
+        r = await self._async_request("GET", full_url, headers=headers)
+        if r.status_code != 200:
+            return [r.text], False
+
+        response = json.loads(r.text)
+        if as_chain:
+            return OptionChain(response)
+        return response
@@ -3,9 +3,15 @@ import json
 import requests
 import pyotp
 import re
+import threading
+import time
 from . import urls
+from .session_store import session_store
+from .transport import Transport
 
 import asyncio
+from concurrent.futures import Future
+from contextlib import nullcontext
 from playwright.async_api import async_playwright, TimeoutError
 from playwright_stealth import stealth_async
 from playwright_stealth.stealth import StealthConfig
@@ -15,17 +21,168 @@ from requests.cookies import cookiejar_from_dict
 # Constants
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:{version}) Gecko/20100101 Firefox/"
 VIEWPORT = { 'width': 1920, 'height': 1080 }
+# The web interface's bearer tokens seem to be good for 1800s (30min)
+TOKEN_TTL = 1800
+# Tokens this close to expiring are refreshed before use
+TOKEN_REFRESH_MARGIN = 60
+# The background refresher renews tokens this long before they expire
+TOKEN_REFRESH_AHEAD = 300
+# After a failed login, wait this long before trying again, doubling with every further
+# failure up to LOGIN_BACKOFF_MAX
+LOGIN_BACKOFF = 5
+LOGIN_BACKOFF_MAX = 300
+
+class _LoginFlight:
+    """
+    Coordinates the logins of one set of credentials within the process: while a login is
+    running, everyone else who needs one waits for its result instead of starting their own,
+    and after failures new attempts are refused for a while.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Future of the login in progress, if any
+        self.pending = None
+        self.last_success = 0
+        self.cookies = None
+        self.headers = None
+        self.failures = 0
+        self.last_failure = 0
+
+    def join(self, since):
+        """
+        :returns: (future, leader) where leader is True if the caller must run the login and
+            then call finish(), and False if it should just wait on future
+        """
+        with self.lock:
+            if self.pending is not None:
+                return self.pending, False
+            if self.last_success > since:
+                # Someone logged in after the caller's session stopped working.
+                done = Future()
+                done.set_result(True)
+                return done, False
+            if self.failures:
+                backoff = min(LOGIN_BACKOFF * 2 ** (self.failures - 1), LOGIN_BACKOFF_MAX)
+                remaining = self.last_failure + backoff - time.monotonic()
+                if remaining > 0:
+                    raise Exception(f"Login failed {self.failures} time(s) in a row; not trying again for {remaining:.0f}s")
+            self.pending = Future()
+            return self.pending, True
+
+    def finish(self, future, manager=None, error=None):
+        with self.lock:
+            self.pending = None
+            if error is None:
+                self.failures = 0
+                self.last_success = time.monotonic()
+                self.cookies = manager.session.cookies.get_dict()
+                self.headers = dict(manager.headers)
+            elif isinstance(error, Exception):
+                # Interrupted logins (e.g. KeyboardInterrupt, cancelled tasks) don't count
+                self.failures += 1
+                self.last_failure = time.monotonic()
+        if error is None:
+            future.set_result(True)
+        else:
+            future.set_exception(error)
+
+_login_flights = {}
+_login_flights_lock = threading.Lock()
+
+def _login_flight(key):
+    with _login_flights_lock:
+        if key not in _login_flights:
+            _login_flights[key] = _LoginFlight()
+        return _login_flights[key]
+
+async def _async_new_login_page(browser):
+    """
+    Opens schwab.com in a new page (and context) of browser, ready for the login form to be filled.
+    """
+    user_agent = USER_AGENT + browser.version
+    page = await browser.new_page(
+        user_agent=user_agent,
+        viewport=VIEWPORT
+    )
+
+    config = StealthConfig()
+    config.navigator_languages = False
+    config.navigator_user_agent = False
+    config.navigator_vendor = False
+    await stealth_async(page, config)
+
+    await page.goto("https://www.schwab.com/")
+    return page
 
 class SessionManager:
-    def __init__(self, debug = False) -> None:
+    def __init__(self, debug = False, transport = None, refresh_tokens = False, browser_pool = None, warm_browser = False, rate_limiter = None, retry_policy = None, hedge_policy = None, scheduler = None, metrics = None) -> None:
         """
         This class is using asynchronous playwright mode.
 
         :type debug: boolean
         :param debug: Enable debug logging
+
+        :type transport: Transport
+        :param transport: The connection pools to send requests through. Pass the same
+            Transport to several instances to share their connections.
+
+        :type refresh_tokens: boolean
+        :param refresh_tokens: Renew cached bearer tokens in the background before they expire,
+            so calls never wait on a token refresh
+
+        :type browser_pool: BrowserPool
+        :param browser_pool: Log in using a browser that is already running instead of
+            launching one every time
+
+        :type warm_browser: boolean
+        :param warm_browser: Create a BrowserPool of size 1 for this instance if browser_pool
+            isn't set
+
+        :type rate_limiter: AdaptiveRateLimiter
+        :param rate_limiter: Throttle every request, backing off when the gateway answers
+            429 or 5xx
+
+        :type retry_policy: RetryPolicy
+        :param retry_policy: Retry the read-only requests that fail
+
+        :type hedge_policy: HedgePolicy
+        :param hedge_policy: Send a second copy of slow read-only requests
+
+        :type scheduler: RequestScheduler
+        :param scheduler: Send orders before quotes and bulk reads when the client is busy
+
+        :type metrics: Metrics
+        :param metrics: Measure every request and operation
         """
         self.headers = {}
         self.session = requests.Session()
+        self.transport = transport or Transport()
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.hedge_policy = hedge_policy
+        self.scheduler = scheduler
+        self.metrics = metrics
+        # Schwab and AsyncSchwab set session_cache before calling this
+        self.session_store = session_store(getattr(self, 'session_cache', None))
+
+        # bearer tokens by scope: token_type -> (token, expiry as time.monotonic())
+        self.tokens = {}
+        self._token_lock = threading.Lock()
+        self.refresh_tokens = refresh_tokens
+        self._refresher = None
+        self._stop_refresher = threading.Event()
+
+        self.browser_pool = browser_pool
+        self._owns_browser_pool = False
+        if browser_pool is None and warm_browser:
+            from .browser_pool import BrowserPool
+            self.browser_pool = BrowserPool(
+                headless=getattr(self, 'headless', True),
+                browserType=getattr(self, 'browserType', 'firefox')
+            )
+            self._owns_browser_pool = True
+        # (mode, seconds) for every login, see _record_login_timing
+        self.login_timings = []
         self.playwright = None
         self.browser = None
         self.page = None
@@ -40,7 +197,7 @@ class SessionManager:
         self.totp_secret_hash = None
 
     def check_auth(self):
-        r = self.session.get(urls.account_info_v2())
+        r = self._request("GET", urls.account_info_v2(), session=self.session)
         if r.status_code != 200:
             return False
         return True
@@ -48,6 +205,69 @@ class SessionManager:
     def get_session(self):
         return self.session
 
+    def _request(self, method, url, **kwargs):
+        """
+        Sends a request through the transport. Pass session=self.session to send (and update)
+        the session cookies; the v2 gateway calls only use the bearer token.
+
+        Read-only requests are retried and hedged according to retry_policy and hedge_policy.
+        """
+        retry = self.retry_policy.for_url(url) if self.retry_policy is not None else None
+        hedge = self.hedge_policy
+        if hedge is not None and (kwargs.get("stream") or not hedge.applies(url)):
+            hedge = None
+
+        def attempt(timeout=None):
+            options = dict(kwargs, timeout=timeout) if timeout is not None else kwargs
+            if hedge is not None:
+                return hedge.run(url, lambda: self._send(method, url, **options))
+            return self._send(method, url, **options)
+
+        if retry is None:
+            return attempt()
+        return retry.run(url, attempt)
+
+    def _send(self, method, url, **kwargs):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(url)
+        if self.scheduler is not None:
+            with self.scheduler.slot(url):
+                r = self._transport_request(method, url, **kwargs)
+        else:
+            r = self._transport_request(method, url, **kwargs)
+        if self.rate_limiter is not None:
+            self.rate_limiter.record(url, r.status_code, r.headers)
+        self._check_token_rejected(r, kwargs.get("headers"))
+        return r
+
+    def _transport_request(self, method, url, **kwargs):
+        if self.metrics is None:
+            return self.transport.request(method, url, **kwargs)
+        return self.metrics.timed(method, url, kwargs, lambda: self.transport.request(method, url, **kwargs))
+
+    def _operation(self, name):
+        """
+        Context manager measuring a block of code as an operation, if the client has metrics.
+        """
+        if self.metrics is None:
+            return nullcontext()
+        return self.metrics.operation(name)
+
+    def _check_token_rejected(self, r, headers):
+        if r.status_code == 401 and headers and 'authorization' in headers:
+            # The cached token was revoked before it expired; fetch new ones from now on.
+            self.tokens.clear()
+
+    def close(self):
+        """
+        Stops the background token refresher, closes the connection pools of the transport and
+        the browser pool if this client created it.
+        """
+        self._stop_refresher.set()
+        self.transport.close()
+        if self._owns_browser_pool:
+            self.browser_pool.close()
+
     def login(self, username, password, totp_secret, lazy=False):
         """
         Logs the user into the Schwab API using asynchronous Playwright, saving
@@ -69,6 +289,27 @@ class SessionManager:
         :returns: True if login was successful and no further action is needed or False
             if login requires additional steps (i.e. SMS - no longer supported)
         """
+        if self._restore_session(username, password, totp_secret):
+            try:
+                if self.update_token():
+                    return True
+            except:
+                if self.debug:
+                    print('DEBUG: update token failed, falling back to login')
+
+        if lazy:
+            return True
+        else:
+            # attempt to login
+            return self._single_flight_login(self._login_and_save, time.monotonic())
+
+    def _restore_session(self, username, password, totp_secret):
+        """
+        Stores the credentials and loads the cached session, if any.
+
+        :rtype: boolean
+        :returns: True if a cached session exists for these exact credentials
+        """
         # update credentials
         self.username = username or ""
         self.password = password or ""
@@ -80,49 +321,189 @@ class SessionManager:
         totp_secret_hash = hashlib.md5(self.totp_secret.encode('utf-8')).hexdigest()
 
         # attempt to load cached session
+        restored = False
         if self._load_session_cache():
             # check hashed credentials
             if self.username_hash == username_hash and self.password_hash == password_hash and self.totp_secret_hash == totp_secret_hash:
                 if self.debug:
                     print('DEBUG: hashed credentials okay')
-                try:
-                    if self.update_token():
-                        return True
-                except:
-                    if self.debug:
-                        print('DEBUG: update token failed, falling back to login')
+                restored = True
 
         # update hashed credentials
         self.username_hash = username_hash
         self.password_hash = password_hash
         self.totp_secret_hash = totp_secret_hash
+        return restored
 
-        if lazy:
-            return True
-        else:
-            # attempt to login
-            return asyncio.run(self._async_login())
+    def update_token(self, token_type='api', login=True, force=False):
+        """
+        Makes sure self.headers carries a valid bearer token for token_type. Tokens are cached
+        per scope and only requested again when they are about to expire.
 
-    def update_token(self, token_type='api', login=True):
-        r = self.session.get(f"https://client.schwab.com/api/auth/authorize/scope/{token_type}")
-        if not r.ok:
-            if login:
-                if self.debug:
-                    print("DEBUG: session invalid; logging in again")
-                result = asyncio.run(self._async_login())
-                return result
-            else:
-                raise ValueError(f"Error updating Bearer token: {r.reason}")
+        :type token_type: str
+        :param token_type: The token scope, 'api' or 'update'
 
-        token = json.loads(r.text)['token']
-        self.headers['authorization'] = f"Bearer {token}"
+        :type login: boolean
+        :param login: Log in again if the session is no longer valid
+
+        :type force: boolean
+        :param force: Request a new token even if the cached one is still valid
+        """
+        token = None if force else self._cached_token(token_type)
+        if token is not None:
+            self.headers['authorization'] = f"Bearer {token}"
+            return True
+
+        with self._token_lock:
+            # Another thread may have refreshed the token while we were waiting.
+            token = None if force else self._cached_token(token_type)
+            if token is not None:
+                self.headers['authorization'] = f"Bearer {token}"
+                return True
+
+            with self._operation("update_token"):
+                started = time.monotonic()
+                r = self._request("GET", urls.bearer_token(token_type), session=self.session)
+                if r.status_code >= 400:
+                    if login:
+                        if self.debug:
+                            print("DEBUG: session invalid; logging in again")
+                        return self._single_flight_login(lambda: self._relogin(token_type), started)
+                    else:
+                        raise ValueError(f"Error updating Bearer token: {r.status_code} {r.text}")
+
+                self._store_token(token_type, json.loads(r.text)['token'])
         self._save_session_cache()
+        if self.refresh_tokens:
+            self._start_token_refresher()
         return True
 
+    def _relogin(self, token_type):
+        """
+        Logs in again after the session expired. Processes sharing a session store take turns:
+        whoever gets the store's lock first logs in, and the others use the session it stored.
+        """
+        if self.session_store is None:
+            return self._login_and_save()
+
+        with self.session_store.lock():
+            if self._reload_session_cache():
+                r = self._request("GET", urls.bearer_token(token_type), session=self.session)
+                if r.status_code < 400:
+                    if self.debug:
+                        print("DEBUG: using the session stored by another process")
+                    self._store_token(token_type, json.loads(r.text)['token'])
+                    return True
+            return self._login_and_save()
+
+    def _login_and_save(self):
+        """
+        Logs in and stores the new session. The session is saved here, on the calling thread,
+        rather than during the login: with a BrowserPool the login runs on the pool's thread,
+        which can't take the store's lock while _relogin() holds it.
+        """
+        result = asyncio.run(self._async_login())
+        self._save_session_cache()
+        return result
+
+    def _single_flight_login(self, login, since):
+        """
+        Runs login() unless another login with the same credentials is already running or
+        finished after `since` (a time.monotonic() value), in which case its session is used.
+        """
+        flight = _login_flight(self._credentials_key())
+        future, leader = flight.join(since)
+        if not leader:
+            result = future.result()
+            self._adopt_login(flight)
+            return result
+        try:
+            result = login()
+        except BaseException as e:
+            flight.finish(future, error=e)
+            raise
+        flight.finish(future, self)
+        return result
+
+    def _credentials_key(self):
+        return (self.username_hash, self.password_hash, self.totp_secret_hash)
+
+    def _adopt_login(self, flight):
+        """
+        Uses the session from a login made by another instance with the same credentials.
+        """
+        if flight.cookies is not None and flight.cookies != self.session.cookies.get_dict():
+            self.session.cookies = cookiejar_from_dict(flight.cookies)
+            self.headers = dict(flight.headers)
+            self.tokens.clear()
+
+    def _cached_token(self, token_type, margin=TOKEN_REFRESH_MARGIN):
+        token, expires_at = self.tokens.get(token_type, (None, 0))
+        if token is not None and time.monotonic() < expires_at - margin:
+            return token
+        return None
+
+    def _store_token(self, token_type, token):
+        self.tokens[token_type] = (token, time.monotonic() + TOKEN_TTL)
+        self.headers['authorization'] = f"Bearer {token}"
+
+    def _headers(self, token_type, **extra):
+        """
+        Makes sure there is a valid bearer token for token_type and returns a private copy of
+        the headers for a single request with the extra headers added, so concurrent calls
+        using different token scopes or accounts don't overwrite each other's headers.
+        self.headers itself is left as is.
+        """
+        self.update_token(token_type=token_type)
+        return self._copy_headers(token_type, extra)
+
+    def _copy_headers(self, token_type, extra):
+        headers = dict(self.headers)
+        token = self.tokens.get(token_type, (None, 0))[0]
+        if token is not None:
+            headers['authorization'] = f"Bearer {token}"
+        headers.update(extra)
+        return headers
+
+    def _next_token_refresh(self):
+        """
+        Returns the scope of the token that expires first and how many seconds from now it
+        should be refreshed, or (None, None) if there are no tokens.
+        """
+        if not self.tokens:
+            return None, None
+        token_type, (_, expires_at) = min(self.tokens.items(), key=lambda item: item[1][1])
+        return token_type, max(0, expires_at - TOKEN_REFRESH_AHEAD - time.monotonic())
+
+    def _start_token_refresher(self):
+        if self._refresher is None or not self._refresher.is_alive():
+            self._stop_refresher.clear()
+            self._refresher = threading.Thread(target=self._refresh_tokens_forever, daemon=True)
+            self._refresher.start()
+
+    def _refresh_tokens_forever(self):
+        while not self._stop_refresher.is_set():
+            token_type, delay = self._next_token_refresh()
+            if token_type is None:
+                return
+            if self._stop_refresher.wait(delay):
+                return
+            try:
+                self.update_token(token_type=token_type, login=False, force=True)
+            except Exception as e:
+                # Leave it to the next call to refresh the token (and log in if needed).
+                if self.debug:
+                    print(f"DEBUG: background token refresh failed: {e}")
+                self.tokens.pop(token_type, None)
+
     async def _async_login(self):
         """
         Helper function to perform asynchronous login using Playwright
         """
+        if self.browser_pool is not None:
+            return await self.browser_pool.async_login(self)
+
+        start = time.perf_counter()
         self.playwright = await async_playwright().start()
         if self.browserType == "firefox":
             self.browser = await self.playwright.firefox.launch(
@@ -131,86 +512,101 @@ class SessionManager:
         else:
             raise ValueError("Only supported browserType is 'firefox'")
 
-        user_agent = USER_AGENT + self.browser.version
-        self.page = await self.browser.new_page(
-            user_agent=user_agent,
-            viewport=VIEWPORT
-        )
-
-        config = StealthConfig()
-        config.navigator_languages = False
-        config.navigator_user_agent = False
-        config.navigator_vendor = False
-        await stealth_async(self.page, config)
+        self.page = await _async_new_login_page(self.browser)
+        await self._async_fill_login(self.page)
+        await self._async_close_browser()
+        self._record_login_timing("cold", time.perf_counter() - start)
+        return True
 
-        await self.page.goto("https://www.schwab.com/")
-        await self.page.route(re.compile(r".*balancespositions*"), self._asyncCaptureAuthToken)
+    async def _async_fill_login(self, page):
+        """
+        Logs in on a page showing schwab.com (see _async_new_login_page) and keeps the
+        resulting cookies and headers.
+        """
+        await page.route(re.compile(r".*balancespositions*"), self._asyncCaptureAuthToken)
 
         login_frame = "schwablmslogin"
-        await self.page.wait_for_selector("#" + login_frame)
-        await self.page.frame(name=login_frame).select_option("select#landingPageOptions", index=3)
+        await page.wait_for_selector("#" + login_frame)
+        await page.frame(name=login_frame).select_option("select#landingPageOptions", index=3)
 
         # enter username
-        await self.page.frame(name=login_frame).click("[placeholder=\"Login ID\"]")
-        await self.page.frame(name=login_frame).fill("[placeholder=\"Login ID\"]", self.username)
+        await page.frame(name=login_frame).click("[placeholder=\"Login ID\"]")
+        await page.frame(name=login_frame).fill("[placeholder=\"Login ID\"]", self.username)
 
         # append otp to passsword
         totp = pyotp.TOTP(self.totp_secret)
         password = self.password + str(totp.now())
 
         # enter password
-        await self.page.frame(name=login_frame).press("[placeholder=\"Login ID\"]", "Tab")
-        await self.page.frame(name=login_frame).fill("[placeholder=\"Password\"]", password)
+        await page.frame(name=login_frame).press("[placeholder=\"Login ID\"]", "Tab")
+        await page.frame(name=login_frame).fill("[placeholder=\"Password\"]", password)
 
         try:
-            await self.page.frame(name=login_frame).press("[placeholder=\"Password\"]", "Enter")
-            await self.page.wait_for_url(re.compile(r"app/trade"), wait_until="domcontentloaded") # Making it more robust than specifying an exact url which may change.
+            await page.frame(name=login_frame).press("[placeholder=\"Password\"]", "Enter")
+            await page.wait_for_url(re.compile(r"app/trade"), wait_until="domcontentloaded") # Making it more robust than specifying an exact url which may change.
         except TimeoutError:
             raise Exception("Login was not successful; please check username and password")
 
-        await self.page.wait_for_selector("#_txtSymbol")
+        await page.wait_for_selector("#_txtSymbol")
+        await self._async_save_session(page)
 
-        await self._async_save_and_close_session()
-        return True
-
-    async def _async_save_and_close_session(self):
-        cookies = {cookie["name"]: cookie["value"] for cookie in await self.page.context.cookies()}
+    async def _async_save_session(self, page):
+        cookies = {cookie["name"]: cookie["value"] for cookie in await page.context.cookies()}
         self.session.cookies = cookiejar_from_dict(cookies)
+        # Tokens from the previous session are no longer valid.
+        self.tokens.clear()
+
+    async def _async_close_browser(self):
         await self.page.close()
         await self.browser.close()
         await self.playwright.stop()
-        self._save_session_cache()
+
+    def _record_login_timing(self, mode, seconds):
+        """
+        Keeps how long each login took, as (mode, seconds) where mode is "cold" for a freshly
+        launched browser and "warm" for a page from a BrowserPool.
+        """
+        self.login_timings.append((mode, seconds))
+        if self.debug:
+            print(f"DEBUG: {mode} login took {seconds:.2f}s")
 
     async def _asyncCaptureAuthToken(self, route):
         self.headers = await route.request.all_headers()
         await route.continue_()
 
     def _load_session_cache(self):
-        if self.session_cache:
+        if self.session_store is not None:
             try:
-                with open(self.session_cache) as f:
-                    data = f.read()
-                    session = json.loads(data)
-                    self.session.cookies = cookiejar_from_dict(session['cookies'])
-                    self.headers = session['headers']
-                    self.username_hash = session['username_hash']
-                    self.password_hash = session['password_hash']
-                    self.totp_secret_hash = session['totp_secret_hash']
-                    return True
+                session = self.session_store.load()
+                self.session.cookies = cookiejar_from_dict(session['cookies'])
+                self.headers = session['headers']
+                self.username_hash = session['username_hash']
+                self.password_hash = session['password_hash']
+                self.totp_secret_hash = session['totp_secret_hash']
+                # Cached tokens belong to the session we just replaced.
+                self.tokens.clear()
+                return True
             except:
                 # swallow exceptions
                 pass
 
         return False
 
+    def _reload_session_cache(self):
+        """
+        Loads the stored session if another process changed it since we last read or wrote it.
+        """
+        if self.session_store is not None and self.session_store.changed():
+            return self._load_session_cache()
+        return False
+
     def _save_session_cache(self):
-        if self.session_cache:
-            with open(self.session_cache, 'w') as f:
-                session = {
-                    'cookies': self.session.cookies.get_dict(),
-                    'headers': self.headers,
-                    'username_hash': self.username_hash,
-                    'password_hash': self.password_hash,
-                    'totp_secret_hash': self.totp_secret_hash
-                }
-                json.dump(session, f)
+        if self.session_store is not None:
+            # Only written if something actually changed.
+            self.session_store.save({
+                'cookies': self.session.cookies.get_dict(),
+                'headers': self.headers,
+                'username_hash': self.username_hash,
+                'password_hash': self.password_hash,
+                'totp_secret_hash': self.totp_secret_hash
+            })
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import time
+
+from playwright.async_api import async_playwright
+
+from .authentication import _async_new_login_page
+
+
+class BrowserPool:
+    def __init__(self, size=1, headless=True, browserType="firefox", max_page_age=600):
+        """
+        Keeps a launched browser and `size` pages already showing schwab.com, so that logging
+        in (or back in after the session expired) only has to fill in the login form.
+
+        Playwright objects belong to the event loop that created them, so the pool runs its
+        own event loop in a background thread; both Schwab and AsyncSchwab can use it:
+
+            pool = BrowserPool(size=2)
+            api = Schwab(browser_pool=pool)
+
+        A pool can be shared by any number of clients. Call close() when done with it.
+
+        :type size: int
+        :param size: Number of pages kept ready to log in
+
+        :type headless: boolean
+        :param headless: Run the browser headless
+
+        :type browserType: str
+        :param browserType: Only 'firefox' is supported
+
+        :type max_page_age: float
+        :param max_page_age: Pages that have been waiting longer than this many seconds are
+            reloaded before being used, since the login form may have gone stale
+        """
+        if browserType != "firefox":
+            raise ValueError("Only supported browserType is 'firefox'")
+        self.size = size
+        self.headless = headless
+        self.max_page_age = max_page_age
+
+        # Durations in seconds. "startup" is launching the browser until the first page is ready,
+        # "warm" is each login on a ready page. Cold logins (without a pool) are recorded in
+        # the login_timings of each client.
+        self.timings = {"startup": [], "warm": []}
+
+        self._playwright = None
+        self._browser = None
+        self._pages = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        # Launch the browser right away, without waiting for it
+        self._started = asyncio.run_coroutine_threadsafe(self._start(), self._loop)
+
+    def login(self, manager):
+        """
+        Logs manager (a Schwab or AsyncSchwab) in using one of the ready pages. Blocks until done.
+        """
+        return asyncio.run_coroutine_threadsafe(self._login(manager), self._loop).result()
+
+    async def async_login(self, manager):
+        """
+        Same as login(), but can be awaited from any event loop.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._login(manager), self._loop)
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        """
+        :rtype: dict
+        :returns: Count and average duration in seconds of the pool's startup and warm logins
+        """
+        return {
+            mode: {
+                "count": len(timings),
+                "average": sum(timings) / len(timings) if timings else None,
+            } for mode, timings in self.timings.items()
+        }
+
+    def close(self):
+        """
+        Closes the browser and stops the pool's event loop.
+        """
+        if not self._loop.is_running():
+            return
+        asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _start(self):
+        start = time.perf_counter()
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.firefox.launch(headless=self.headless)
+        self._pages = asyncio.Queue()
+        await self._add_page()
+        self.timings["startup"].append(time.perf_counter() - start)
+        for _ in range(self.size - 1):
+            await self._add_page()
+
+    async def _add_page(self):
+        page = await _async_new_login_page(self._browser)
+        self._pages.put_nowait((page, time.monotonic()))
+
+    async def _replenish(self):
+        if self._pages.qsize() < self.size:
+            try:
+                await self._add_page()
+            except Exception:
+                # The next login will open its own page.
+                pass
+
+    async def _login(self, manager):
+        await asyncio.wrap_future(self._started)
+        start = time.perf_counter()
+        if self._pages.empty():
+            # Every ready page is in use (or failed to load); don't wait for one.
+            page, ready_since = await _async_new_login_page(self._browser), time.monotonic()
+        else:
+            page, ready_since = self._pages.get_nowait()
+        try:
+            if time.monotonic() - ready_since > self.max_page_age:
+                await page.reload()
+            await manager._async_fill_login(page)
+        finally:
+            # Never reuse a page that was logged in; prepare a fresh one in the background.
+            await page.context.close()
+            asyncio.ensure_future(self._replenish())
+        elapsed = time.perf_counter() - start
+        self.timings["warm"].append(elapsed)
+        manager._record_login_timing("warm", elapsed)
+        return True
+
+    async def _stop(self):
+        if self._browser is not None:
+            await self._browser.close()
+        if self._playwright is not None:
+            await self._playwright.stop()
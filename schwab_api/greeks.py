@@ -0,0 +1,198 @@
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+MODELS = ("black_scholes", "black76")
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("greeks requires numpy; install it with `pip install schwab-api[options]`")
+
+
+def _norm_pdf(x):
+    return np.exp(-0.5 * x * x) / math.sqrt(2 * math.pi)
+
+
+def _norm_cdf(x):
+    # numpy has no erf; this is the Abramowitz & Stegun 26.2.17 approximation (error < 7.5e-8).
+    z = np.abs(x)
+    t = 1.0 / (1.0 + 0.2316419 * z)
+    poly = t * (0.319381530 + t * (-0.356563782 + t * (1.781477937 + t * (-1.821255978 + t * 1.330274429))))
+    upper = _norm_pdf(z) * poly
+    return np.where(x >= 0, 1.0 - upper, upper)
+
+
+def _carry(model, rate, dividend):
+    if model == "black_scholes":
+        return rate - dividend
+    if model == "black76":
+        # the underlying price is a forward, which costs nothing to carry
+        return 0.0
+    raise ValueError("model must be one of {}".format(", ".join(MODELS)))
+
+
+def _d1_d2(underlying, strike, t, vol, carry):
+    sqrt_t = np.sqrt(t)
+    d1 = (np.log(underlying / strike) + (carry + 0.5 * vol * vol) * t) / (vol * sqrt_t)
+    return d1, d1 - vol * sqrt_t
+
+
+def option_price(underlying, strike, t, vol, is_call, rate=0.0, dividend=0.0, model="black_scholes"):
+    """
+    Prices European options. Every argument can be a scalar or an array (broadcast together).
+
+    :param underlying: Spot price, or the forward price with model="black76"
+    :param strike: Strike price
+    :param t: Time to expiration in years
+    :param vol: Annualized volatility (0.2 for 20%)
+    :param is_call: True for calls, False for puts
+    :param rate: Continuously compounded risk-free rate
+    :param dividend: Continuous dividend yield (black_scholes only)
+    :param model: "black_scholes" or "black76"
+    """
+    _require_numpy()
+    underlying, strike, t, vol = (np.asarray(value, dtype=np.float64) for value in (underlying, strike, t, vol))
+    carry = _carry(model, rate, dividend)
+    d1, d2 = _d1_d2(underlying, strike, t, vol, carry)
+    growth = np.exp((carry - rate) * t)
+    discount = np.exp(-rate * t)
+    call = underlying * growth * _norm_cdf(d1) - strike * discount * _norm_cdf(d2)
+    put = strike * discount * _norm_cdf(-d2) - underlying * growth * _norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+
+def greeks(underlying, strike, t, vol, is_call, rate=0.0, dividend=0.0, model="black_scholes"):
+    """
+    Computes the greeks of European options; takes the same arguments as option_price().
+
+    :rtype: dict
+    :returns: Arrays of price, delta, gamma, theta (per calendar day) and vega (per 1 point
+        of volatility, i.e. 0.01)
+    """
+    _require_numpy()
+    underlying, strike, t, vol = (np.asarray(value, dtype=np.float64) for value in (underlying, strike, t, vol))
+    carry = _carry(model, rate, dividend)
+    d1, d2 = _d1_d2(underlying, strike, t, vol, carry)
+    growth = np.exp((carry - rate) * t)
+    discount = np.exp(-rate * t)
+    pdf_d1 = _norm_pdf(d1)
+    cdf_d1 = _norm_cdf(d1)
+    cdf_d2 = _norm_cdf(d2)
+    sqrt_t = np.sqrt(t)
+
+    call = underlying * growth * cdf_d1 - strike * discount * cdf_d2
+    # Not call - parity: far out of the money, that would lose the put's price in rounding errors
+    put = strike * discount * _norm_cdf(-d2) - underlying * growth * _norm_cdf(-d1)
+    decay = -underlying * growth * pdf_d1 * vol / (2 * sqrt_t)
+    call_theta = decay - (carry - rate) * underlying * growth * cdf_d1 - rate * strike * discount * cdf_d2
+    put_theta = decay + (carry - rate) * underlying * growth * (1 - cdf_d1) + rate * strike * discount * (1 - cdf_d2)
+    return {
+        "price": np.where(is_call, call, put),
+        "delta": np.where(is_call, growth * cdf_d1, growth * (cdf_d1 - 1)),
+        "gamma": growth * pdf_d1 / (underlying * vol * sqrt_t),
+        "theta": np.where(is_call, call_theta, put_theta) / 365,
+        "vega": underlying * growth * pdf_d1 * sqrt_t / 100,
+    }
+
+
+def implied_volatility(price, underlying, strike, t, is_call, rate=0.0, dividend=0.0, model="black_scholes",
+                       tol=1e-6, max_iter=50, max_vol=5.0):
+    """
+    Solves for the volatility of each option, with Newton steps that fall back to bisection
+    whenever they would leave the bracket of possible volatilities. An option is solved once
+    its model price is within tol of its price, relative to the price, or once the next
+    Newton step would move its volatility by less than tol.
+
+    :returns: Array of annualized volatilities (or a 0-d array for scalar arguments); NaN
+        where the price is missing, outside of the no-arbitrage bounds, or so close to them
+        that it says nothing about the volatility
+    """
+    _require_numpy()
+    price, underlying, strike, t = np.broadcast_arrays(*(np.asarray(value, dtype=np.float64) for value in (price, underlying, strike, t)))
+    shape = price.shape
+    price, underlying, strike, t = (np.atleast_1d(value) for value in (price, underlying, strike, t))
+    is_call = np.broadcast_to(np.atleast_1d(is_call), price.shape)
+    carry = _carry(model, rate, dividend)
+    growth = np.exp((carry - rate) * t)
+    discount = np.exp(-rate * t)
+    intrinsic = np.where(is_call, np.maximum(underlying * growth - strike * discount, 0), np.maximum(strike * discount - underlying * growth, 0))
+    upper_bound = np.where(is_call, underlying * growth, strike * discount)
+    valid = np.isfinite(price) & (price > intrinsic) & (price < upper_bound) & (t > 0)
+
+    # In the money, almost all of the price is intrinsic value, which says nothing about the
+    # volatility. Solve with the out of the money option of the same strike instead (put-call parity).
+    parity = underlying * growth - strike * discount
+    in_the_money = np.where(is_call, parity > 0, parity < 0)
+    time_value = np.where(in_the_money, np.where(is_call, price - parity, price + parity), price)
+    # Subtracting the parity loses about eps * price; a time value that small says nothing
+    valid &= time_value > 100 * np.finfo(np.float64).eps * price
+    price = time_value
+    is_call = is_call != in_the_money
+
+    low = np.full(price.shape, 1e-6)
+    high = np.full(price.shape, max_vol)
+    vol = np.full(price.shape, 0.3)
+    active = valid.copy()
+    for _ in range(max_iter):
+        indexes = np.flatnonzero(active)
+        if not len(indexes):
+            break
+        current = vol[indexes]
+        result = greeks(underlying[indexes], strike[indexes], t[indexes], current, is_call[indexes], rate, dividend, model)
+        model_price = result["price"]
+        error = model_price - price[indexes]
+        vega = result["vega"] * 100
+
+        # Check the current guess before stepping away from it
+        done = np.abs(error) <= tol * np.maximum(price[indexes], vega)
+        active[indexes[done]] = False
+        indexes, current, error, vega, model_price = (
+            value[~done] for value in (indexes, current, error, vega, model_price))
+
+        too_high = error > 0
+        high[indexes] = np.where(too_high, current, high[indexes])
+        low[indexes] = np.where(too_high, low[indexes], current)
+        # Newton step on the log of the price: far out of the money, the price changes by
+        # orders of magnitude with the volatility, and steps on the price itself would crawl.
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            step = current - (np.log(model_price) - np.log(price[indexes])) * model_price / vega
+        bisect = ~np.isfinite(step) | (step <= low[indexes]) | (step >= high[indexes])
+        vol[indexes] = np.where(bisect, (low[indexes] + high[indexes]) / 2, step)
+    return np.where(valid, vol, np.nan).reshape(shape)
+
+
+def chain_greeks(chain, rate=0.0, dividend=0.0, model="black_scholes", min_days=0.1):
+    """
+    Computes the implied volatility and greeks of every contract of an OptionChain (which can
+    be fetched with greeks=False) from its bid/ask midpoint and underlying_price.
+
+    :type chain: OptionChain
+    :param chain: The chain
+
+    :type min_days: float
+    :param min_days: Contracts expiring today are priced with this many days left
+
+    :rtype: dict
+    :returns: Arrays of implied_volatility, delta, gamma, theta and vega, in the order of
+        the chain's rows
+    """
+    _require_numpy()
+    price = (chain.bid + chain.ask) / 2
+    # Contracts of unknown type get NaN rather than being priced as puts
+    price = np.where(chain.option_type == "", np.nan, price)
+    t = np.maximum(chain.days_until, min_days) / 365.0
+    is_call = chain.option_type == "C"
+    vol = implied_volatility(price, chain.underlying_price, chain.strike, t, is_call, rate, dividend, model)
+    result = greeks(chain.underlying_price, chain.strike, t, vol, is_call, rate, dividend, model)
+    return {
+        "implied_volatility": vol,
+        "delta": result["delta"],
+        "gamma": result["gamma"],
+        "theta": result["theta"],
+        "vega": result["vega"],
+    }
@@ -0,0 +1,110 @@
+import codecs
+import json
+
+_WHITESPACE = " \t\n\r"
+
+
+class _ArrayItems:
+    """
+    Finds the array stored under `key` in a JSON document that arrives in chunks of bytes, and
+    decodes its items one at a time. Only the item being decoded (plus at most one chunk) is
+    kept in memory.
+    """
+    def __init__(self, key):
+        self.marker = json.dumps(key)
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.position = 0
+        self.in_array = False
+        self.done = False
+
+    def feed(self, chunk):
+        """
+        Adds a chunk of the document.
+
+        :returns: The items that are now complete
+        """
+        self.buffer = self.buffer[self.position:] + self.text.decode(chunk)
+        self.position = 0
+        items = []
+        if not self.in_array and not self._find_array():
+            return items
+        while not self.done:
+            position = self._skip(self.position, _WHITESPACE + ",")
+            if position >= len(self.buffer):
+                break
+            if self.buffer[position] == "]":
+                self.done = True
+                break
+            try:
+                item, end = self.decoder.raw_decode(self.buffer, position)
+            except json.JSONDecodeError:
+                # the item continues in the next chunk
+                break
+            if end == len(self.buffer) and not isinstance(item, (dict, list, str)):
+                # a number may continue in the next chunk
+                break
+            items.append(item)
+            self.position = end
+        return items
+
+    def close(self):
+        """
+        Checks that the whole array was read once the document ends.
+        """
+        if not self.in_array:
+            raise ValueError("The document ended without a {} array".format(self.marker))
+        if not self.done:
+            raise ValueError("The document ended before the end of the {} array".format(self.marker))
+
+    def _find_array(self):
+        index = self.buffer.find(self.marker)
+        if index < 0:
+            # keep enough to find a key cut in two by the chunks
+            self.position = max(0, len(self.buffer) - len(self.marker))
+            return False
+        position = self._skip(index + len(self.marker), _WHITESPACE + ":")
+        if position >= len(self.buffer):
+            self.position = index
+            return False
+        if self.buffer[position] != "[":
+            raise ValueError("{} is not an array".format(self.marker))
+        self.in_array = True
+        self.position = position + 1
+        return True
+
+    def _skip(self, position, characters):
+        while position < len(self.buffer) and self.buffer[position] in characters:
+            position += 1
+        return position
+
+
+def iter_array_items(chunks, key):
+    """
+    Yields the items of the array stored under key in a JSON object, reading the document from
+    an iterable of byte chunks without ever holding all of it.
+
+    Raises ValueError if the chunks end before the array does (e.g. a truncated download),
+    after yielding the items read until then.
+    """
+    parser = _ArrayItems(key)
+    for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
+        if parser.done:
+            return
+    parser.close()
+
+
+async def aiter_array_items(chunks, key):
+    """
+    Same as iter_array_items() for an async iterable of byte chunks.
+    """
+    parser = _ArrayItems(key)
+    async for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
+        if parser.done:
+            return
+    parser.close()
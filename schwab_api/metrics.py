@@ -0,0 +1,369 @@
+import asyncio
+import bisect
+import collections
+import contextvars
+import functools
+import http.server
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from . import urls
+
+
+# Upper bounds in seconds of the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Name of the innermost operation (e.g. "trade_v2") running in the current thread or task
+_current_operation = contextvars.ContextVar("schwab_operation", default=None)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # counts[i] is the number of values <= buckets[i] (and > buckets[i - 1]); the last one
+        # counts the values above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """
+        :returns: The upper bound of the bucket holding the q quantile (inf if above them all)
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    def __init__(self, on_request=None, on_response=None, tracing=False, buckets=LATENCY_BUCKETS):
+        """
+        Measures every request sent by the clients using it, per endpoint (the function of
+        urls.py the URL comes from), and every logical operation (trade_v2, verify_v2, place,
+        update_token, quote_v2, get_account_info_v2, ...):
+
+            metrics = Metrics()
+            api = Schwab(metrics=metrics)
+            ...
+            metrics.stats()["requests"]["order_verification_v2"]   # count, mean, p50, p95, p99
+            print(metrics.prometheus())
+
+        Kept per endpoint: a latency histogram, the number of responses per status code, the
+        errors (exceptions) and the bytes sent and received. Kept per operation: a latency
+        histogram.
+
+        Hooks are called with a dict describing the request: method, url, endpoint, operation
+        (the innermost operation sending it, or None), stream and bytes_out, plus seconds,
+        status_code, bytes_in and error for on_response. Exceptions raised by hooks are ignored.
+
+        With tracing, every operation is an OpenTelemetry span (e.g. "schwab.trade_v2") and
+        every request a child span of its operation. Requires opentelemetry-api
+        (pip install opentelemetry-api); configuring the exporter is up to the application.
+
+        :type on_request: callable
+        :param on_request: Called before each request is sent
+
+        :type on_response: callable
+        :param on_response: Called after each response (or failure)
+
+        :type tracing: boolean
+        :param tracing: Create OpenTelemetry spans
+
+        :type buckets: tuple
+        :param buckets: Upper bounds in seconds of the latency histogram buckets
+        """
+        self.buckets = tuple(buckets)
+        self._on_request = [on_request] if on_request else []
+        self._on_response = [on_response] if on_response else []
+        self._tracer = None
+        if tracing:
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                raise ImportError("tracing requires opentelemetry; install it with `pip install opentelemetry-api`")
+            self._tracer = trace.get_tracer("schwab_api")
+            self._client_kind = trace.SpanKind.CLIENT
+        self._lock = threading.Lock()
+        # endpoint -> _Histogram
+        self.requests = dict()
+        # operation -> _Histogram
+        self.operations = dict()
+        # (endpoint, status code) -> count
+        self.status_codes = collections.Counter()
+        # (endpoint, exception class name) -> count
+        self.errors = collections.Counter()
+        self.bytes_out = collections.Counter()
+        self.bytes_in = collections.Counter()
+
+    def on_request(self, callback):
+        """
+        Adds a hook called before each request. Can be used as a decorator.
+        """
+        self._on_request.append(callback)
+        return callback
+
+    def on_response(self, callback):
+        """
+        Adds a hook called after each response (or failure). Can be used as a decorator.
+        """
+        self._on_response.append(callback)
+        return callback
+
+    @contextmanager
+    def operation(self, name):
+        """
+        Context manager measuring one logical operation; the requests sent inside it are
+        attributed to it.
+        """
+        token = _current_operation.set(name)
+        start = time.perf_counter()
+        span = self._tracer.start_as_current_span("schwab." + name) if self._tracer else nullcontext()
+        try:
+            with span:
+                yield
+        finally:
+            _current_operation.reset(token)
+            self._observe(self.operations, name, time.perf_counter() - start)
+
+    def timed(self, method, url, kwargs, send):
+        """
+        Returns send(), the response to a request, measured as one request to url.
+        """
+        event = self._start(method, url, kwargs)
+        with self._span(event) as span:
+            start = time.perf_counter()
+            try:
+                r = send()
+            except Exception as e:
+                self._finish(event, span, start, None, e)
+                raise
+            self._finish(event, span, start, r, None)
+        return r
+
+    async def timed_async(self, method, url, kwargs, send):
+        """
+        Same as timed() for a coroutine function send.
+        """
+        event = self._start(method, url, kwargs)
+        with self._span(event) as span:
+            start = time.perf_counter()
+            try:
+                r = await send()
+            except Exception as e:
+                self._finish(event, span, start, None, e)
+                raise
+            self._finish(event, span, start, r, None)
+        return r
+
+    def stats(self):
+        """
+        :returns: dict with, under "requests", the latency statistics (count, mean and
+            approximate p50, p95, p99 in seconds), status codes, errors and bytes of each
+            endpoint, and under "operations" the latency statistics of each operation
+        """
+        with self._lock:
+            requests = {}
+            for endpoint, histogram in self.requests.items():
+                requests[endpoint] = dict(
+                    histogram.stats(),
+                    status_codes={status: count for (name, status), count in self.status_codes.items() if name == endpoint},
+                    errors={error: count for (name, error), count in self.errors.items() if name == endpoint},
+                    bytes_out=self.bytes_out[endpoint],
+                    bytes_in=self.bytes_in[endpoint],
+                )
+            operations = {name: histogram.stats() for name, histogram in self.operations.items()}
+        return {"requests": requests, "operations": operations}
+
+    def prometheus(self):
+        """
+        :returns: The metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            _histogram_lines(lines, "schwab_request_duration_seconds", "Duration of the requests to each endpoint", "endpoint", self.requests)
+            _counter_lines(lines, "schwab_responses_total", "Responses by endpoint and status code", ("endpoint", "status"), self.status_codes)
+            _counter_lines(lines, "schwab_request_errors_total", "Requests that failed without a response", ("endpoint", "error"), self.errors)
+            _counter_lines(lines, "schwab_request_bytes_total", "Bytes sent in request bodies", ("endpoint",), self.bytes_out)
+            _counter_lines(lines, "schwab_response_bytes_total", "Bytes received in response bodies", ("endpoint",), self.bytes_in)
+            _histogram_lines(lines, "schwab_operation_duration_seconds", "Duration of each operation, including its requests", "operation", self.operations)
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port=9464, addr=""):
+        """
+        Serves prometheus() over HTTP (any path) from a background thread.
+
+        :returns: The http.server.HTTPServer; call shutdown() on it to stop serving
+        """
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((addr, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def _start(self, method, url, kwargs):
+        event = {
+            "method": method,
+            "url": url,
+            "endpoint": urls.endpoint_name(url),
+            "operation": _current_operation.get(),
+            "bytes_out": _body_size(kwargs),
+            "stream": kwargs.get("stream", False),
+        }
+        _call_hooks(self._on_request, event)
+        return event
+
+    def _span(self, event):
+        if self._tracer is None:
+            return nullcontext()
+        return self._tracer.start_as_current_span(
+            "HTTP {} {}".format(event["method"], event["endpoint"]),
+            kind=self._client_kind,
+            attributes={"http.method": event["method"], "schwab.endpoint": event["endpoint"]},
+        )
+
+    def _finish(self, event, span, start, r, error):
+        event["seconds"] = time.perf_counter() - start
+        event["status_code"] = r.status_code if r is not None else None
+        event["bytes_in"] = _response_size(r, event["stream"]) if r is not None else 0
+        event["error"] = error
+        endpoint = event["endpoint"]
+        self._observe(self.requests, endpoint, event["seconds"])
+        with self._lock:
+            if r is not None:
+                self.status_codes[(endpoint, r.status_code)] += 1
+            else:
+                self.errors[(endpoint, type(error).__name__)] += 1
+            self.bytes_out[endpoint] += event["bytes_out"]
+            self.bytes_in[endpoint] += event["bytes_in"]
+        if span is not None:
+            if r is not None:
+                span.set_attribute("http.status_code", r.status_code)
+            else:
+                span.record_exception(error)
+        _call_hooks(self._on_response, event)
+
+    def _observe(self, histograms, name, seconds):
+        with self._lock:
+            if name not in histograms:
+                histograms[name] = _Histogram(self.buckets)
+            histograms[name].observe(seconds)
+
+
+def instrumented(function):
+    """
+    Decorator measuring a client method as an operation named after it, when the client has
+    metrics.
+    """
+    name = function.__name__
+    if asyncio.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def wrapper(self, *args, **kwargs):
+            if self.metrics is None:
+                return await function(self, *args, **kwargs)
+            with self.metrics.operation(name):
+                return await function(self, *args, **kwargs)
+    else:
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            if self.metrics is None:
+                return function(self, *args, **kwargs)
+            with self.metrics.operation(name):
+                return function(self, *args, **kwargs)
+    return wrapper
+
+
+def _call_hooks(hooks, event):
+    for hook in hooks:
+        try:
+            hook(event)
+        except Exception:
+            # Measuring must never break a request (e.g. an order that was just placed)
+            pass
+
+
+def _body_size(kwargs):
+    if kwargs.get("json") is not None:
+        return len(json.dumps(kwargs["json"]).encode("utf-8"))
+    data = kwargs.get("data") or kwargs.get("content")
+    if isinstance(data, str):
+        return len(data.encode("utf-8"))
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    return 0
+
+
+def _response_size(r, stream):
+    length = r.headers.get("content-length")
+    if length is not None:
+        return int(length)
+    # Streamed bodies haven't been read yet, and reading them here would defeat streaming.
+    return 0 if stream else len(r.content)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _histogram_lines(lines, metric, help, label, histograms):
+    lines.append("# HELP {} {}".format(metric, help))
+    lines.append("# TYPE {} histogram".format(metric))
+    for name, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            lines.append('{}_bucket{{{}="{}",le="{}"}} {}'.format(metric, label, _label(name), le, cumulative))
+        lines.append('{}_sum{{{}="{}"}} {}'.format(metric, label, _label(name), histogram.sum))
+        lines.append('{}_count{{{}="{}"}} {}'.format(metric, label, _label(name), histogram.count))
+
+
+def _counter_lines(lines, metric, help, labels, counter):
+    lines.append("# HELP {} {}".format(metric, help))
+    lines.append("# TYPE {} counter".format(metric))
+    for key, count in sorted(counter.items(), key=lambda item: str(item[0])):
+        values = key if isinstance(key, tuple) else (key,)
+        label_text = ",".join('{}="{}"'.format(label, _label(value)) for label, value in zip(labels, values))
+        lines.append("{}{{{}}} {}".format(metric, label_text, count))
+
+
+def client_metrics(metrics):
+    """
+    Builds the Metrics of a client from its metrics argument: a Metrics or True for a new one.
+    """
+    if metrics is None or metrics is False or isinstance(metrics, Metrics):
+        return metrics or None
+    return Metrics()
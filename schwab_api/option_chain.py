@@ -0,0 +1,272 @@
+import math
+
+from .greeks import chain_greeks
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Column name -> keys of a leg in the get_options_chains_v2 payload. The greeks are only
+# there when requested with greeks=True; missing values are NaN.
+_NUMERIC_FIELDS = {
+    "strike": ("Strk",),
+    "bid": ("Bid",),
+    "ask": ("Ask",),
+    "delta": ("Delta", "Dlt"),
+    "gamma": ("Gamma", "Gma"),
+    "theta": ("Theta", "Tht"),
+    "vega": ("Vega", "Vga"),
+    "rho": ("Rho",),
+    "implied_volatility": ("ImplVol", "ImpliedVolatility", "IV"),
+}
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        # Schwab sends "--" (or nothing) for missing values
+        return math.nan
+
+
+def _occ_key(symbol):
+    return "".join(str(symbol).split())
+
+
+def parse_expiration(expiration):
+    """
+    Parses the legs of one entry of the Expirations of a get_options_chains_v2 response.
+
+    :returns: dict of column name to array, plus the original legs under "legs"
+    """
+    group = expiration.get("ExpirationGroup", {})
+    days_until = _to_float(group.get("DaysUntil"))
+    days_until = -1 if math.isnan(days_until) else int(days_until)
+
+    legs = []
+    symbols = []
+    types = []
+    numbers = {name: [] for name in _NUMERIC_FIELDS}
+    for chain in expiration.get("Chains", []):
+        for leg in chain.get("Legs", []):
+            legs.append(leg)
+            symbols.append(leg.get("Sym"))
+            # None would become 'N' in a U1 array
+            types.append(leg.get("OptionType") or "")
+            for name, keys in _NUMERIC_FIELDS.items():
+                value = None
+                for key in keys:
+                    if key in leg:
+                        value = leg[key]
+                        break
+                numbers[name].append(_to_float(value))
+
+    block = {
+        "symbol": np.array(symbols, dtype=object),
+        "option_type": np.array(types, dtype="U1"),
+        "days_until": np.full(len(legs), days_until, dtype=np.int64),
+        "legs": np.empty(len(legs), dtype=object),
+    }
+    block["legs"][:] = legs
+    for name, values in numbers.items():
+        block[name] = np.array(values, dtype=np.float64)
+    return block
+
+
+class OptionChain:
+    def __init__(self, payload, blocks=None):
+        """
+        The response of get_options_chains_v2 parsed once into NumPy columns:
+
+            chain = api.get_options_chains_v2('$RUT', as_chain=True)
+            days = chain.nearest_expiry()
+            call = chain.atm('C', days)
+            near = chain.near_strikes(0.02, days)
+
+        Columns (all arrays of the same length, sorted by days_until, option_type and strike):
+            symbol, option_type ('C', 'P' or '' if missing), days_until, strike, bid, ask, delta, gamma,
+            theta, vega, rho, implied_volatility, expiration (index into expiration_groups)
+
+        Requires numpy (pip install schwab-api[options]).
+
+        :type payload: dict
+        :param payload: The JSON returned by get_options_chains_v2
+
+        :type blocks: list
+        :param blocks: The result of parse_expiration() for each of payload's Expirations, if
+            already known (see OptionChainCache)
+        """
+        if np is None:
+            raise ImportError("OptionChain requires numpy; install it with `pip install schwab-api[options]`")
+        self.payload = payload
+        self.underlying_price = _to_float(payload.get("UnderlyingData", {}).get("Last"))
+        expirations = payload.get("Expirations", [])
+        self.expiration_groups = [expiration.get("ExpirationGroup", {}) for expiration in expirations]
+        if blocks is None:
+            blocks = [parse_expiration(expiration) for expiration in expirations]
+
+        # an empty block gives the columns their types when there are no expirations
+        blocks = blocks or [parse_expiration({})]
+        columns = {name: np.concatenate([block[name] for block in blocks]) for name in blocks[0]}
+        legs = columns.pop("legs")
+        columns["expiration"] = np.concatenate(
+            [np.full(len(block["legs"]), i, dtype=np.int64) for i, block in enumerate(blocks)]
+        )
+
+        order = np.lexsort((columns["strike"], columns["option_type"], columns["days_until"]))
+        self._set_columns({name: column[order] for name, column in columns.items()})
+        self._legs = legs[order]
+
+    @classmethod
+    def _from_columns(cls, parent, columns, legs):
+        chain = cls.__new__(cls)
+        chain.payload = parent.payload
+        chain.underlying_price = parent.underlying_price
+        chain.expiration_groups = parent.expiration_groups
+        chain._set_columns(columns)
+        chain._legs = legs
+        return chain
+
+    def _set_columns(self, columns):
+        self.columns = columns
+        for name, column in columns.items():
+            setattr(self, name, column)
+        # (days_until, option_type) -> (start, stop). Rows are sorted by these two first, so
+        # each group is contiguous and sorted by strike.
+        self._groups = dict()
+        if len(self.days_until):
+            changes = (self.days_until[1:] != self.days_until[:-1]) | (self.option_type[1:] != self.option_type[:-1])
+            bounds = np.concatenate(([0], np.flatnonzero(changes) + 1, [len(self.days_until)]))
+            for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+                self._groups[(int(self.days_until[start]), str(self.option_type[start]))] = (start, stop)
+        self._symbol_index = None
+
+    def __len__(self):
+        return len(self.strike)
+
+    def expirations(self):
+        """
+        :returns: Sorted array of the distinct days_until in the chain
+        """
+        return np.unique(self.days_until)
+
+    def nearest_expiry(self, min_days=0):
+        """
+        :returns: The smallest days_until that is at least min_days, or None
+        """
+        i = np.searchsorted(self.days_until, min_days, side="left")
+        return int(self.days_until[i]) if i < len(self.days_until) else None
+
+    def expiry(self, days):
+        """
+        :returns: An OptionChain with the contracts expiring in `days` days
+        """
+        start = np.searchsorted(self.days_until, days, side="left")
+        stop = np.searchsorted(self.days_until, days, side="right")
+        return self.take(slice(start, stop))
+
+    def strikes_between(self, low, high, days=None, option_type=None):
+        """
+        :returns: An OptionChain with the contracts whose strike is between low and high
+            (inclusive), optionally only for one expiry and/or option type
+        """
+        rows = []
+        for (group_days, group_type), (start, stop) in self._groups.items():
+            if days is not None and group_days != days:
+                continue
+            if option_type is not None and group_type != option_type:
+                continue
+            strikes = self.strike[start:stop]
+            first = start + np.searchsorted(strikes, low, side="left")
+            last = start + np.searchsorted(strikes, high, side="right")
+            rows.append(np.arange(first, last))
+        return self.take(np.concatenate(rows) if rows else np.array([], dtype=np.int64))
+
+    def near_strikes(self, pct, days=None, option_type=None, spot=None):
+        """
+        :returns: An OptionChain with the contracts whose strike is within pct (0.05 for 5%)
+            of spot, which defaults to the underlying's last price
+        """
+        spot = self.underlying_price if spot is None else spot
+        return self.strikes_between(spot * (1 - pct), spot * (1 + pct), days, option_type)
+
+    def atm(self, option_type, days=None, spot=None):
+        """
+        :returns: The contract (see row()) of the given type whose strike is closest to spot,
+            for the nearest expiry unless days is given, or None
+        """
+        days = self.nearest_expiry() if days is None else days
+        spot = self.underlying_price if spot is None else spot
+        if (days, option_type) not in self._groups:
+            return None
+        start, stop = self._groups[(days, option_type)]
+        i = start + np.searchsorted(self.strike[start:stop], spot)
+        candidates = [j for j in (i - 1, i) if start <= j < stop]
+        return self.row(min(candidates, key=lambda j: abs(self.strike[j] - spot)))
+
+    def contract(self, symbol):
+        """
+        :returns: The contract (see row()) with this OCC symbol, or None. Whitespace in the
+            symbol is ignored.
+        """
+        if self._symbol_index is None:
+            keys = np.array([_occ_key(symbol) for symbol in self.symbol], dtype=object)
+            order = np.argsort(keys, kind="stable")
+            self._symbol_index = (keys[order], order)
+        keys, order = self._symbol_index
+        key = _occ_key(symbol)
+        i = np.searchsorted(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return self.row(order[i])
+        return None
+
+    def row(self, i):
+        """
+        :returns: Dictionary with the value of each column for row i, plus the original leg
+            from the payload under "leg"
+        """
+        contract = {name: column[i].item() if hasattr(column[i], "item") else column[i] for name, column in self.columns.items()}
+        contract["leg"] = self._legs[i]
+        return contract
+
+    def take(self, rows):
+        """
+        :returns: An OptionChain with only the given rows (a slice, index array or boolean
+            mask), e.g. chain.take(chain.delta > 0.3)
+        """
+        if not isinstance(rows, slice):
+            rows = np.asarray(rows)
+            if rows.dtype != bool:
+                # keep the rows sorted so the indexes stay valid
+                rows = np.sort(rows)
+        columns = {name: column[rows] for name, column in self.columns.items()}
+        return OptionChain._from_columns(self, columns, self._legs[rows])
+
+    def copy(self):
+        """
+        :returns: An OptionChain sharing this one's arrays, whose columns can be replaced
+            (e.g. by compute_greeks()) without affecting this one
+        """
+        return OptionChain._from_columns(self, dict(self.columns), self._legs)
+
+    def compute_greeks(self, rate=0.0, dividend=0.0, model="black_scholes"):
+        """
+        Fills the implied_volatility, delta, gamma, theta and vega columns from the bid/ask
+        midpoints, so the chain can be fetched without greeks. See greeks.chain_greeks() for
+        the arguments and units.
+
+        :returns: self
+        """
+        for name, column in chain_greeks(self, rate, dividend, model).items():
+            self.columns[name] = column
+            setattr(self, name, column)
+        return self
+
+    def to_pandas(self):
+        """
+        :returns: A pandas DataFrame with one column per array
+        """
+        import pandas as pd
+        return pd.DataFrame(self.columns)
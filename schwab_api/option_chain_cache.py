@@ -0,0 +1,205 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from .option_chain import OptionChain, parse_expiration
+
+
+def _hash(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class _Snapshot:
+    def __init__(self, payload, fetched_at, expirations):
+        self.payload = payload
+        # time.time() when it was fetched, so snapshots on disk keep their age
+        self.fetched_at = fetched_at
+        # expiration key -> (hash of the expiration, parsed block, legs by symbol)
+        self.expirations = expirations
+        self.chain = OptionChain(payload, [expirations[key][1] for key in _expiration_keys(payload)])
+        # Callers get copies of the chain sharing these arrays, so they must stay as they are
+        for column in self.chain.columns.values():
+            column.flags.writeable = False
+
+
+def _expiration_keys(payload):
+    return [_hash(expiration.get("ExpirationGroup", {})) for expiration in payload.get("Expirations", [])]
+
+
+class OptionChainCache:
+    def __init__(self, fetch, ttl=60, snapshot_dir=None):
+        """
+        Keeps the latest option chain of each (ticker, greeks) and only re-parses the
+        expirations that changed when refreshing it:
+
+            cache = OptionChainCache(api.get_options_chains_v2, ttl=60)
+            chain = cache.get('$RUT')
+            chain, update = cache.refresh('$RUT')
+
+        Schwab only returns whole chains, so every refresh still downloads all of it; what is
+        saved is parsing the unchanged expirations into an OptionChain again, and the caller
+        only has to look at what changed.
+
+        Every call returns its own copy of the chain, so one caller's compute_greeks() doesn't
+        change what the next one gets. The copies share read-only arrays.
+
+        :type fetch: callable
+        :param fetch: get_options_chains_v2 of a Schwab instance (or any function taking
+            ticker and greeks and returning the same JSON)
+
+        :type ttl: float
+        :param ttl: Seconds for which get() returns the cached chain without refreshing it
+
+        :type snapshot_dir: str
+        :param snapshot_dir: If set, each chain is also saved there as gzipped JSON and loaded
+            back on the first get() after a restart
+        """
+        self.fetch = fetch
+        self.ttl = ttl
+        self.snapshot_dir = snapshot_dir
+        self.hits = 0
+        self.misses = 0
+        # Expirations parsed again because they changed, and reused from the previous snapshot
+        self.parsed = 0
+        self.reused = 0
+        self._snapshots = dict()
+        self._lock = threading.Lock()
+        self._key_locks = dict()
+
+    def get(self, ticker, greeks=False, max_age=None):
+        """
+        :returns: The OptionChain of ticker, refreshed first if it is older than max_age
+            (defaults to ttl) seconds
+        """
+        max_age = self.ttl if max_age is None else max_age
+        key = (ticker, greeks)
+        with self._key_lock(key):
+            snapshot = self._snapshot(key)
+            if snapshot is not None and time.time() - snapshot.fetched_at <= max_age:
+                self.hits += 1
+                return snapshot.chain.copy()
+            self.misses += 1
+            return self._refresh(key, self.fetch(ticker, greeks))[0]
+
+    def refresh(self, ticker, greeks=False):
+        """
+        Fetches the chain again.
+
+        :returns: The new OptionChain, and a dictionary describing what changed:
+            added, changed and removed (lists of ExpirationGroup) and legs (list of the legs
+            that are new or different in the changed expirations)
+        """
+        key = (ticker, greeks)
+        with self._key_lock(key):
+            self._snapshot(key)
+            return self._refresh(key, self.fetch(ticker, greeks))
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "parsed": self.parsed, "reused": self.reused}
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _snapshot(self, key):
+        if key not in self._snapshots and self.snapshot_dir is not None:
+            snapshot = self._load(key)
+            if snapshot is not None:
+                self._snapshots[key] = snapshot
+        return self._snapshots.get(key)
+
+    def _refresh(self, key, payload):
+        if isinstance(payload, tuple):
+            # get_options_chains_v2 returns ([response text], False) on errors
+            raise Exception("Could not get the option chain of {}: {}".format(key[0], payload[0][0]))
+        previous = self._snapshots.get(key)
+        old = previous.expirations if previous is not None else dict()
+        expirations = dict()
+        update = {"added": [], "changed": [], "removed": [], "legs": []}
+        for expiration_key, expiration in zip(_expiration_keys(payload), payload.get("Expirations", [])):
+            digest = _hash(expiration)
+            group = expiration.get("ExpirationGroup", {})
+            if expiration_key in old and old[expiration_key][0] == digest:
+                expirations[expiration_key] = old[expiration_key]
+                self.reused += 1
+                continue
+            block = parse_expiration(expiration)
+            legs = {leg.get("Sym"): leg for leg in block["legs"]}
+            expirations[expiration_key] = (digest, block, legs)
+            self.parsed += 1
+            if expiration_key in old:
+                update["changed"].append(group)
+                old_legs = old[expiration_key][2]
+                update["legs"].extend(leg for symbol, leg in legs.items() if old_legs.get(symbol) != leg)
+            else:
+                update["added"].append(group)
+                update["legs"].extend(legs.values())
+        if previous is not None:
+            update["removed"] = [
+                group for expiration_key, group in zip(_expiration_keys(previous.payload), previous.chain.expiration_groups)
+                if expiration_key not in expirations
+            ]
+
+        snapshot = _Snapshot(payload, time.time(), expirations)
+        self._snapshots[key] = snapshot
+        if self.snapshot_dir is not None:
+            self._save(key, snapshot)
+        return snapshot.chain.copy(), update
+
+    def _path(self, key):
+        ticker, greeks = key
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', ticker) + ('-greeks' if greeks else '')
+        return os.path.join(self.snapshot_dir, name + '.json.gz')
+
+    def _load(self, key):
+        # A missing, corrupt or incomplete snapshot is a miss.
+        try:
+            with gzip.open(self._path(key), 'rt') as f:
+                data = json.load(f)
+            payload = data["payload"]
+            expirations = dict()
+            for expiration_key, expiration in zip(_expiration_keys(payload), payload.get("Expirations", [])):
+                block = parse_expiration(expiration)
+                expirations[expiration_key] = (_hash(expiration), block, {leg.get("Sym"): leg for leg in block["legs"]})
+            return _Snapshot(payload, float(data["fetched_at"]), expirations)
+        except (ValueError, OSError, KeyError, TypeError, AttributeError):
+            return None
+
+    def _save(self, key, snapshot):
+        # Same as FileSessionStore: write to a temporary file and move it into place.
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.snapshot_dir, prefix='.chain-', suffix='.tmp')
+        try:
+            # Chains compress well even at the fastest level, which keeps refreshes cheap.
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=1) as f:
+                f.write(json.dumps({"fetched_at": snapshot.fetched_at, "payload": snapshot.payload}).encode('utf-8'))
+            os.replace(tmp_path, self._path(key))
+        except:
+            os.unlink(tmp_path)
+            raise
+
+
+class AsyncOptionChainCache(OptionChainCache):
+    """
+    Same as OptionChainCache, where fetch is a coroutine function such as
+    AsyncSchwab.get_options_chains_v2; get() and refresh() must be awaited.
+    """
+    async def get(self, ticker, greeks=False, max_age=None):
+        max_age = self.ttl if max_age is None else max_age
+        key = (ticker, greeks)
+        snapshot = self._snapshot(key)
+        if snapshot is not None and time.time() - snapshot.fetched_at <= max_age:
+            self.hits += 1
+            return snapshot.chain.copy()
+        self.misses += 1
+        return self._refresh(key, await self.fetch(ticker, greeks))[0]
+
+    async def refresh(self, ticker, greeks=False):
+        key = (ticker, greeks)
+        self._snapshot(key)
+        return self._refresh(key, await self.fetch(ticker, greeks))
@@ -0,0 +1,201 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+_ACCOUNT_FIELDS = ("market_value", "available_cash", "account_value", "cost_basis")
+_POSITION_FIELDS = ("symbol", "description", "quantity", "cost", "market_value", "security_id")
+_GROUPS = ("account", "symbol")
+
+
+def _ids(values):
+    # Security ids are numbers in the v2 API, but keep whatever Schwab sent otherwise
+    try:
+        return np.array(values, dtype=np.int64)
+    except (TypeError, ValueError, OverflowError):
+        return np.array(values, dtype=object)
+
+
+class PortfolioFrame:
+    def __init__(self, account_info):
+        """
+        The positions of all accounts as parallel NumPy arrays (one row per position), so
+        that roll-ups across accounts don't need a loop:
+
+            frame = api.get_account_info_v2(as_frame=True)
+            frame.totals("market_value", by="symbol")   # exposure per symbol across accounts
+            frame.unrealized_pnl                        # market_value - cost, per position
+            frame.concentration()                       # share of the portfolio per symbol
+
+        Columns: account, symbol, description, quantity, cost, market_value, security_id.
+        account and symbol also have codes (account_codes, symbol_codes) into their sorted
+        unique values (accounts, symbols), which are used to group rows.
+
+        The account totals are in account_market_value, account_available_cash,
+        account_account_value and account_cost_basis, in the order of accounts.
+
+        Requires numpy (pip install schwab-api[options]).
+
+        :type account_info: dict
+        :param account_info: The result of get_account_info() or get_account_info_v2()
+        """
+        self._load(
+            (
+                account_id,
+                [account[field] for field in _ACCOUNT_FIELDS],
+                [[position[field] for field in _POSITION_FIELDS] for position in account["positions"]],
+            )
+            for account_id, account in account_info.items()
+        )
+
+    @classmethod
+    def _from_records(cls, records):
+        """
+        :param records: Iterable of (account id, account fields, list of position fields), with
+            the fields in the order of Account and Position
+        """
+        frame = cls.__new__(cls)
+        frame._load(records)
+        return frame
+
+    def _load(self, records):
+        if np is None:
+            raise ImportError("PortfolioFrame requires numpy; install it with `pip install schwab-api[options]`")
+        account_ids = []
+        account_fields = []
+        rows = []
+        accounts = []
+        for account_id, fields, positions in records:
+            account_ids.append(int(account_id))
+            account_fields.append(fields)
+            rows.extend(positions)
+            accounts.extend([int(account_id)] * len(positions))
+
+        columns = list(zip(*rows)) or [()] * len(_POSITION_FIELDS)
+        self.columns = {
+            "account": np.array(accounts, dtype=np.int64),
+            "symbol": np.array(columns[0], dtype=object),
+            "description": np.array(columns[1], dtype=object),
+            "quantity": np.array(columns[2], dtype=np.float64),
+            "cost": np.array(columns[3], dtype=np.float64),
+            "market_value": np.array(columns[4], dtype=np.float64),
+            "security_id": _ids(columns[5]),
+        }
+        for name, column in self.columns.items():
+            setattr(self, name, column)
+
+        # accounts without positions still count in the account totals
+        self.accounts = np.array(account_ids, dtype=np.int64)
+        totals = np.array(account_fields, dtype=np.float64).reshape(len(account_ids), len(_ACCOUNT_FIELDS))
+        order = np.argsort(self.accounts, kind="stable")
+        self.accounts = self.accounts[order]
+        for i, field in enumerate(_ACCOUNT_FIELDS):
+            setattr(self, "account_" + field, totals[order, i])
+
+        self.account_codes = np.searchsorted(self.accounts, self.account).astype(np.int32)
+        self.symbols, self.symbol_codes = np.unique(self.symbol.astype(str), return_inverse=True)
+        self.symbols = self.symbols.astype(object)
+        self.symbol_codes = self.symbol_codes.astype(np.int32)
+        # group -> (rows sorted by group, start of each group in it), built on first use
+        self._indexes = dict()
+
+    def __len__(self):
+        return len(self.symbol)
+
+    @property
+    def unrealized_pnl(self):
+        return self.market_value - self.cost
+
+    def _group(self, by):
+        if by not in _GROUPS:
+            raise ValueError("by must be one of {}".format(", ".join(_GROUPS)))
+        if by == "account":
+            return self.accounts, self.account_codes
+        return self.symbols, self.symbol_codes
+
+    def _index(self, by):
+        if by not in self._indexes:
+            labels, codes = self._group(by)
+            rows = np.argsort(codes, kind="stable")
+            starts = np.searchsorted(codes[rows], np.arange(len(labels) + 1))
+            self._indexes[by] = (rows, starts)
+        return self._indexes[by]
+
+    def group_sums(self, column="market_value", by="symbol"):
+        """
+        :returns: (labels, sums): the sorted accounts or symbols and the sum of column for each
+        """
+        labels, codes = self._group(by)
+        values = self.unrealized_pnl if column == "unrealized_pnl" else self.columns[column]
+        return labels, np.bincount(codes, weights=values, minlength=len(labels))
+
+    def totals(self, column="market_value", by="symbol"):
+        """
+        Sums column (quantity, cost, market_value or unrealized_pnl) per account or symbol.
+
+        :returns: dict of account id or symbol to total
+        """
+        labels, sums = self.group_sums(column, by)
+        return dict(zip(labels.tolist(), sums.tolist()))
+
+    def concentration(self, by="symbol"):
+        """
+        :returns: dict of symbol (or account) to its share of the total market value of the
+            positions, largest first
+        """
+        labels, sums = self.group_sums("market_value", by)
+        total = sums.sum()
+        shares = sums / total if total else np.zeros(len(sums))
+        order = np.argsort(-shares, kind="stable")
+        return dict(zip(labels[order].tolist(), shares[order].tolist()))
+
+    def rows(self, account=None, symbol=None):
+        """
+        :returns: Indexes (sorted) of the positions in account and/or of symbol, to use with
+            take() or directly on the columns
+        """
+        selected = None
+        for by, label in (("account", account), ("symbol", symbol)):
+            if label is None:
+                continue
+            labels, _ = self._group(by)
+            if by == "account":
+                label = int(label)
+            position = np.searchsorted(labels, label)
+            if position == len(labels) or labels[position] != label:
+                return np.empty(0, dtype=np.intp)
+            rows, starts = self._index(by)
+            group = rows[starts[position]:starts[position + 1]]
+            selected = group if selected is None else np.intersect1d(selected, group)
+        if selected is None:
+            return np.arange(len(self))
+        return np.sort(selected)
+
+    def take(self, rows):
+        """
+        :returns: dict of column name to the values of rows (indexes or a boolean mask)
+        """
+        return {name: column[rows] for name, column in self.columns.items()}
+
+    def to_pandas(self):
+        """
+        :returns: A pandas DataFrame over the columns. The numeric columns are not copied;
+            account and symbol are categoricals built from the group codes.
+        """
+        import pandas as pd
+        columns = dict(self.columns)
+        columns["account"] = pd.Categorical.from_codes(self.account_codes, categories=self.accounts)
+        columns["symbol"] = pd.Categorical.from_codes(self.symbol_codes, categories=self.symbols)
+        return pd.DataFrame(columns, copy=False)
+
+    def to_arrow(self):
+        """
+        :returns: A pyarrow Table over the columns. The numeric columns share the NumPy
+            buffers; account and symbol are dictionary arrays built from the group codes.
+        """
+        import pyarrow as pa
+        columns = {name: pa.array(column) for name, column in self.columns.items()}
+        columns["account"] = pa.DictionaryArray.from_arrays(pa.array(self.account_codes), pa.array(self.accounts))
+        columns["symbol"] = pa.DictionaryArray.from_arrays(pa.array(self.symbol_codes), pa.array(self.symbols.tolist()))
+        return pa.table(columns)
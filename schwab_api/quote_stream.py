@@ -0,0 +1,308 @@
+import asyncio
+import threading
+
+from .quotes import _dedupe_symbols
+from .retry import RETRY_EXCEPTIONS
+
+
+class _QuotesUnavailable(Exception):
+    """
+    Every symbol of a poll failed (fetch reports gateway errors as failures, not exceptions).
+    """
+
+
+def _changed_fields(old, new):
+    """
+    Returns the fields of quote new that differ from old, keeping the nesting of the quote.
+    """
+    if old is None:
+        return new
+    changes = dict()
+    for key, value in new.items():
+        previous = old.get(key)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            nested = _changed_fields(previous, value)
+            if nested:
+                changes[key] = nested
+        elif key not in old or value != previous:
+            changes[key] = value
+    return changes
+
+
+def _merge_changes(pending, changes):
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(pending.get(key), dict):
+            _merge_changes(pending[key], value)
+        else:
+            pending[key] = value
+
+
+class QuoteSubscription:
+    """
+    One consumer of a QuotePoller. Updates that arrive while the consumer is busy are merged
+    into a single pending update, so a slow consumer always gets the latest values and never
+    makes the poller (or the other consumers) wait.
+    """
+    def __init__(self, symbols):
+        self.symbols = symbols
+        self._wanted = set(symbols)
+        # Number of updates merged into a pending one because the consumer was behind
+        self.conflated = 0
+        self._pending = dict()
+        self._error = None
+        self._ready = threading.Condition()
+
+    @property
+    def behind(self):
+        return bool(self._pending)
+
+    def get(self):
+        """
+        Blocks until there is an update.
+
+        :returns: dict of symbol to the fields of its quote that changed
+        """
+        with self._ready:
+            while not self._pending and self._error is None:
+                self._ready.wait()
+            return self._take()
+
+    def _publish(self, changes, error=None):
+        with self._ready:
+            self._merge(changes, error)
+            self._ready.notify_all()
+
+    def _merge(self, changes, error):
+        if error is not None:
+            self._error = error
+            return
+        changes = {symbol: fields for symbol, fields in changes.items() if symbol in self._wanted}
+        if not changes:
+            return
+        if self._pending:
+            self.conflated += 1
+        for symbol, fields in changes.items():
+            if symbol in self._pending:
+                _merge_changes(self._pending[symbol], fields)
+            else:
+                self._pending[symbol] = _copy_fields(fields)
+
+    def _take(self):
+        if self._error is not None and not self._pending:
+            raise self._error
+        pending, self._pending = self._pending, dict()
+        return pending
+
+
+class AsyncQuoteSubscription(QuoteSubscription):
+    def __init__(self, symbols):
+        super(AsyncQuoteSubscription, self).__init__(symbols)
+        self._ready = asyncio.Event()
+
+    async def get(self):
+        while not self._pending and self._error is None:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._take()
+
+    def _publish(self, changes, error=None):
+        self._merge(changes, error)
+        self._ready.set()
+
+
+class QuotePoller:
+    def __init__(self, fetch, interval=1.0, max_interval=None, max_errors=5):
+        """
+        Polls the quotes of every symbol its subscribers want with one batched fetch per round,
+        and hands each subscriber only the fields that changed for its symbols.
+
+        The cadence adapts: it starts at `interval` and slows down (up to `max_interval`) while
+        nothing changes, while every subscriber is still behind on the previous update, or
+        while polls fail. A poll fails when fetch raises or when no symbol got a quote. After
+        max_errors failed polls in a row (or an unexpected exception), the error is raised to
+        every subscriber and the poller stops.
+
+        :type fetch: callable
+        :param fetch: Takes a list of symbols and returns (quotes, failures) like
+            Schwab.quote_v2_batch
+
+        :type interval: float
+        :param interval: Seconds between polls while quotes are changing
+
+        :type max_interval: float
+        :param max_interval: Longest delay between polls. Defaults to 4 times interval.
+
+        :type max_errors: int
+        :param max_errors: Number of failed polls in a row after which subscribers get the error
+        """
+        self.fetch = fetch
+        self.interval = interval
+        self.max_interval = max_interval or interval * 4
+        self.max_errors = max_errors
+        self.polls = 0
+        self.errors = 0
+        self._subscribers = []
+        # latest known quote for each symbol
+        self._last = dict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._closed = False
+
+    def subscribe(self, symbols):
+        subscription = self._subscription(_dedupe_symbols(symbols))
+        with self._lock:
+            self._subscribers.append(subscription)
+            # Start with the quotes we already have; the others come with the next poll.
+            subscription._publish({symbol: self._last[symbol] for symbol in subscription.symbols if symbol in self._last})
+            self._start()
+        self._wakeup.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def symbols(self):
+        symbols = dict()
+        for subscription in self._subscribers:
+            symbols.update(dict.fromkeys(subscription.symbols))
+        return list(symbols)
+
+    def _subscription(self, symbols):
+        return QuoteSubscription(symbols)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        delay = self.interval
+        while True:
+            with self._lock:
+                if not self._subscribers or self._closed:
+                    self._thread = None
+                    return
+                symbols = self.symbols()
+            try:
+                quotes, failures = _check_result(self.fetch(symbols))
+            except Exception as e:
+                if self._give_up(e):
+                    continue
+                delay = self._next_delay(delay, False)
+            else:
+                self.errors = 0
+                delay = self._next_delay(delay, self._publish(quotes, failures))
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def close(self):
+        """
+        Stops polling. The thread exits once its current fetch (if any) returns.
+        """
+        with self._lock:
+            self._closed = True
+        self._wakeup.set()
+
+    def _publish(self, quotes, failures):
+        """
+        Sends the changes to the subscribers.
+
+        :returns: True if any quote changed
+        """
+        self.polls += 1
+        changes = dict()
+        for symbol, quote in quotes.items():
+            fields = _changed_fields(self._last.get(symbol), quote)
+            if fields:
+                changes[symbol] = fields
+                self._last[symbol] = quote
+        if changes:
+            for subscription in list(self._subscribers):
+                subscription._publish(changes)
+        return bool(changes)
+
+    def _give_up(self, error):
+        """
+        Counts a failed poll.
+
+        :returns: True if the subscribers were given the error, False to poll again later
+        """
+        self.errors += 1
+        if self.errors < self.max_errors and isinstance(error, RETRY_EXCEPTIONS + (_QuotesUnavailable,)):
+            return False
+        self.errors = 0
+        self._publish_error(error)
+        return True
+
+    def _publish_error(self, error):
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for subscription in subscribers:
+            subscription._publish(None, error)
+
+    def _next_delay(self, delay, changed):
+        subscribers = list(self._subscribers)
+        if subscribers and all(subscription.behind for subscription in subscribers):
+            # Nobody has caught up with the last update; polling faster would only be merged away.
+            return min(delay * 2, self.max_interval)
+        if changed:
+            return self.interval
+        return min(delay * 1.5, self.max_interval)
+
+
+class AsyncQuotePoller(QuotePoller):
+    """
+    Same as QuotePoller, as a task on the running event loop; fetch is a coroutine function.
+    """
+    def __init__(self, fetch, interval=1.0, max_interval=None, max_errors=5):
+        super(AsyncQuotePoller, self).__init__(fetch, interval, max_interval, max_errors)
+        self._task = None
+        self._wakeup = None
+
+    def subscribe(self, symbols):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return super(AsyncQuotePoller, self).subscribe(symbols)
+
+    def _subscription(self, symbols):
+        return AsyncQuoteSubscription(symbols)
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run_async())
+
+    async def _run_async(self):
+        delay = self.interval
+        while self._subscribers:
+            try:
+                quotes, failures = _check_result(await self.fetch(self.symbols()))
+            except Exception as e:
+                if self._give_up(e):
+                    continue
+                delay = self._next_delay(delay, False)
+            else:
+                self.errors = 0
+                delay = self._next_delay(delay, self._publish(quotes, failures))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+def _check_result(result):
+    quotes, failures = result
+    if failures and not quotes:
+        raise _QuotesUnavailable("Could not get quotes: {}".format(next(iter(failures.values()))))
+    return quotes, failures
+
+
+def _copy_fields(fields):
+    return {key: _copy_fields(value) if isinstance(value, dict) else value for key, value in fields.items()}
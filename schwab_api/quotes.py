@@ -0,0 +1,305 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# Number of symbols sent in each quote_v2 request by quote_v2_batch. The gateway's exact limit
+# isn't documented; keeping requests small also lets the chunks be fetched in parallel.
+QUOTE_CHUNK_SIZE = 50
+
+# Failure of a symbol the gateway answered for without returning a quote
+NO_QUOTE = "No quote returned"
+
+
+def quote_symbol(quote):
+    """
+    Returns the symbol of one entry of the list returned by quote_v2.
+    """
+    return quote.get("symbol", quote.get("Symbol"))
+
+
+def _dedupe_symbols(tickers):
+    """
+    Normalizes the symbols and removes duplicates, keeping their order.
+    """
+    symbols = dict()
+    for ticker in tickers:
+        symbols[ticker.strip().upper()] = None
+    return list(symbols)
+
+
+def _chunks(symbols, chunk_size):
+    return [symbols[i:i + chunk_size] for i in range(0, len(symbols), chunk_size)]
+
+
+def _merge_quote_results(chunks, results):
+    """
+    Merges the result of quote_v2 for each chunk into a single dictionary keyed by symbol.
+
+    :returns: quotes (dict of symbol to quote), failures (dict of symbol to error message)
+    """
+    quotes = dict()
+    failures = dict()
+    for chunk, result in zip(chunks, results):
+        if isinstance(result, BaseException):
+            error = repr(result)
+        elif isinstance(result, tuple):
+            # quote_v2 returns ([response text], False) on errors
+            error = result[0][0]
+        else:
+            error = None
+            for quote in result:
+                quotes[quote_symbol(quote)] = quote
+        for symbol in chunk:
+            if error is not None:
+                failures[symbol] = error
+            elif symbol not in quotes:
+                failures[symbol] = NO_QUOTE
+    return quotes, failures
+
+
+def _quotes_for(symbols, quotes, failures):
+    """
+    Picks the quotes of symbols out of a merged result, in the format returned by quote_v2:
+    ([error], False) if their request failed, and the (possibly empty) list of quotes
+    otherwise, as when quote_v2 sends the request itself.
+    """
+    found = [quotes[symbol] for symbol in symbols if symbol in quotes]
+    if symbols and not found:
+        error = failures.get(symbols[0], NO_QUOTE)
+        if error != NO_QUOTE:
+            return [error], False
+    return found
+
+
+class QuoteCache:
+    def __init__(self, max_age=1.0, max_entries=10000, max_bytes=16 * 1024 * 1024, stale_while_revalidate=0):
+        """
+        In-memory cache of the quotes returned by quote_v2, evicting the least recently used
+        symbols first. Safe to share between threads and between clients.
+
+        :type max_age: float
+        :param max_age: Default age in seconds after which a quote is fetched again. Can be
+            overridden on each call.
+
+        :type max_entries: int
+        :param max_entries: Maximum number of symbols kept
+
+        :type max_bytes: int
+        :param max_bytes: Approximate maximum memory used by the quotes (measured as the size of
+            their JSON)
+
+        :type stale_while_revalidate: float
+        :param stale_while_revalidate: For this many seconds after a quote expires, keep returning
+            it right away while a fresh one is fetched in the background
+        """
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale_while_revalidate = stale_while_revalidate
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        # symbol -> (quote, monotonic time it was fetched, size)
+        self._entries = OrderedDict()
+        # symbols with a background refresh in flight
+        self._refreshing = set()
+
+    def lookup(self, symbols, max_age=None):
+        """
+        :returns: cached (dict of symbol to quote), missing (list of symbols to fetch now) and
+            stale (list of symbols returned stale that should be refreshed in the background;
+            call refreshed() once done). With max_age=0, every symbol is missing.
+        """
+        if max_age is None:
+            max_age = self.max_age
+        # max_age=0 asks for fresh quotes, so none are returned stale either
+        stale_while_revalidate = self.stale_while_revalidate if max_age > 0 else 0
+        now = time.monotonic()
+        cached = dict()
+        missing = []
+        stale = []
+        with self._lock:
+            for symbol in symbols:
+                entry = self._entries.get(symbol)
+                age = now - entry[1] if entry is not None else None
+                if entry is None or max_age <= 0 or age > max_age + stale_while_revalidate:
+                    self.misses += 1
+                    missing.append(symbol)
+                    continue
+                if age <= max_age:
+                    self.hits += 1
+                else:
+                    self.stale_hits += 1
+                    if symbol not in self._refreshing:
+                        self._refreshing.add(symbol)
+                        stale.append(symbol)
+                cached[symbol] = entry[0]
+                self._entries.move_to_end(symbol)
+        return cached, missing, stale
+
+    def put(self, quotes):
+        """
+        Stores quotes (a list returned by quote_v2).
+        """
+        now = time.monotonic()
+        with self._lock:
+            for quote in quotes:
+                symbol = quote_symbol(quote)
+                size = len(json.dumps(quote))
+                old = self._entries.pop(symbol, None)
+                if old is not None:
+                    self.bytes -= old[2]
+                self._entries[symbol] = (quote, now, size)
+                self.bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+                _, (_, _, size) = self._entries.popitem(last=False)
+                self.bytes -= size
+                self.evictions += 1
+
+    def refreshed(self, symbols):
+        with self._lock:
+            self._refreshing.difference_update(symbols)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """
+        :rtype: dict
+        :returns: Hit, stale hit, miss and eviction counts, and the number and size of the cached quotes
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+            }
+
+
+def quote_cache(cache):
+    """
+    Returns the QuoteCache for the quote_cache argument of Schwab: None, a QuoteCache, or the
+    default max_age in seconds of a new one. None, False and 0 mean no cache.
+    """
+    if not cache or isinstance(cache, QuoteCache):
+        return cache or None
+    return QuoteCache(max_age=cache)
+
+
+class _QuoteBatch:
+    def __init__(self, done):
+        # ordered set of the symbols requested so far
+        self.symbols = dict()
+        self.done = done
+        self.quotes = None
+        self.failures = None
+        self.error = None
+
+
+class QuoteBatcher:
+    def __init__(self, fetch, window=0.005, max_batch_size=500):
+        """
+        Coalesces the quote requests of concurrent callers: the symbols requested within
+        `window` seconds of the first request are fetched together, and each caller gets back
+        only the quotes it asked for.
+
+        :type fetch: callable
+        :param fetch: Takes a list of symbols and returns (quotes, failures) like
+            Schwab.quote_v2_batch
+
+        :type window: float
+        :param window: How long to collect requests before sending them, in seconds
+
+        :type max_batch_size: int
+        :param max_batch_size: Send the batch early once it has this many symbols
+        """
+        self.fetch = fetch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        # Number of quote() calls and of batches they were coalesced into
+        self.requests = 0
+        self.batches = 0
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def quote(self, tickers):
+        """
+        Returns the quotes for tickers, in the same format as quote_v2.
+        """
+        symbols = _dedupe_symbols(tickers)
+        with self._lock:
+            self.requests += 1
+            batch = self._batch
+            if batch is None:
+                batch = self._batch = _QuoteBatch(threading.Event())
+                timer = threading.Timer(self.window, self._flush, args=(batch,))
+                timer.daemon = True
+                timer.start()
+            batch.symbols.update(dict.fromkeys(symbols))
+            full = len(batch.symbols) >= self.max_batch_size
+        if full:
+            self._flush(batch)
+        batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return _quotes_for(symbols, batch.quotes, batch.failures)
+
+    def _flush(self, batch):
+        with self._lock:
+            if self._batch is not batch:
+                # already sent because it was full
+                return
+            self._batch = None
+            self.batches += 1
+        try:
+            batch.quotes, batch.failures = self.fetch(list(batch.symbols))
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+
+class AsyncQuoteBatcher(QuoteBatcher):
+    """
+    Same as QuoteBatcher, for coroutines: fetch is a coroutine function and quote() must be
+    awaited. All callers must share one event loop.
+    """
+    async def quote(self, tickers):
+        symbols = _dedupe_symbols(tickers)
+        self.requests += 1
+        batch = self._batch
+        if batch is None:
+            batch = self._batch = _QuoteBatch(asyncio.Event())
+            asyncio.get_running_loop().call_later(self.window, self._schedule_flush, batch)
+        batch.symbols.update(dict.fromkeys(symbols))
+        if len(batch.symbols) >= self.max_batch_size:
+            self._schedule_flush(batch)
+        await batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return _quotes_for(symbols, batch.quotes, batch.failures)
+
+    def _schedule_flush(self, batch):
+        if self._batch is not batch:
+            return
+        self._batch = None
+        self.batches += 1
+        asyncio.ensure_future(self._flush_async(batch))
+
+    async def _flush_async(self, batch):
+        try:
+            batch.quotes, batch.failures = await self.fetch(list(batch.symbols))
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
@@ -0,0 +1,332 @@
+import asyncio
+import collections
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from . import urls
+from .throttle import THROTTLE_STATUS_CODES, _retry_after
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+# Endpoints that only read, so sending a request again (or twice at once) is harmless
+READ_ENDPOINTS = frozenset({
+    "bearer_token", "account_info_v2", "positions_v2", "ticker_quotes_v2", "orders_v2",
+    "transaction_history_v2", "lot_details_v2", "option_chains_v2", "positions_data",
+})
+# Read endpoints hedged by default: the small ones, where a duplicate request costs little
+HEDGE_ENDPOINTS = frozenset({
+    "account_info_v2", "positions_v2", "ticker_quotes_v2", "orders_v2", "lot_details_v2",
+})
+
+# Errors after which the request may not have reached the gateway at all
+RETRY_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+if httpx is not None:
+    RETRY_EXCEPTIONS += (httpx.TransportError,)
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=3, backoff=0.25, max_backoff=4, timeout=None,
+                 status_codes=THROTTLE_STATUS_CODES, endpoints=None):
+        """
+        Retries the read-only requests (see READ_ENDPOINTS) that fail with a connection error,
+        a timeout or one of status_codes. Before attempt n+1, waits a random time between 0
+        and backoff * 2 ** n seconds (at most max_backoff), or longer if the gateway asked
+        for it with Retry-After:
+
+            api = Schwab(retry=RetryPolicy(timeout=5, endpoints={
+                "ticker_quotes_v2": RetryPolicy(max_attempts=5, timeout=1),
+                "transaction_history_v2": None,
+            }))
+
+        Orders are never retried, since sending them again could place them twice.
+
+        :type max_attempts: int
+        :param max_attempts: Number of attempts, including the first one
+
+        :type backoff: float
+        :param backoff: Maximum wait in seconds before the second attempt
+
+        :type max_backoff: float
+        :param max_backoff: Maximum wait in seconds before any attempt
+
+        :type timeout: float
+        :param timeout: Timeout in seconds for each attempt. Defaults to the transport's.
+
+        :type status_codes: set
+        :param status_codes: Status codes worth another attempt
+
+        :type endpoints: dict
+        :param endpoints: Policy for specific read endpoints (the functions of urls.py), or
+            None to never retry them. The other read endpoints use this policy.
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1, got {}".format(max_attempts))
+        writes = sorted(name for name, policy in (endpoints or {}).items()
+                        if policy is not None and name not in READ_ENDPOINTS)
+        if writes:
+            raise ValueError("Only read endpoints can be retried, not {}".format(", ".join(writes)))
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.status_codes = status_codes
+        self.endpoints = dict(endpoints or {})
+        # endpoint -> number of attempts after the first one
+        self.retries = collections.Counter()
+        self._lock = threading.Lock()
+
+    def for_url(self, url):
+        """
+        :returns: The policy for requests to url, or None if they shouldn't be retried
+        """
+        name = urls.endpoint_name(url)
+        if name not in READ_ENDPOINTS:
+            return None
+        return self.endpoints.get(name, self)
+
+    def run(self, url, send):
+        """
+        Calls send(timeout) until it returns a response worth keeping or attempts run out.
+        """
+        for attempt in range(self.max_attempts):
+            r = None
+            try:
+                r = send(self.timeout)
+            except RETRY_EXCEPTIONS:
+                if attempt == self.max_attempts - 1:
+                    raise
+            else:
+                if attempt == self.max_attempts - 1 or r.status_code not in self.status_codes:
+                    return r
+                r.close()
+            self._count(url)
+            time.sleep(self._delay(attempt, r))
+
+    async def run_async(self, url, send):
+        """
+        Same as run() for a coroutine function send.
+        """
+        for attempt in range(self.max_attempts):
+            r = None
+            try:
+                r = await send(self.timeout)
+            except RETRY_EXCEPTIONS:
+                if attempt == self.max_attempts - 1:
+                    raise
+            else:
+                if attempt == self.max_attempts - 1 or r.status_code not in self.status_codes:
+                    return r
+                await r.aclose()
+            self._count(url)
+            await asyncio.sleep(self._delay(attempt, r))
+
+    def _delay(self, attempt, r):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if r is not None:
+            delay = max(delay, _retry_after(r.headers))
+        return delay
+
+    def _count(self, url):
+        with self._lock:
+            self.retries[urls.endpoint_name(url)] += 1
+
+
+class HedgePolicy:
+    def __init__(self, quantile=0.95, min_delay=0.05, max_delay=2, min_samples=20, window=200,
+                 endpoints=HEDGE_ENDPOINTS, max_workers=16):
+        """
+        Cuts the tail latency of read-only requests: when a request takes longer than most
+        recent requests to the same endpoint (its `quantile` latency), an identical request is
+        sent and whichever answers first is used. The other one is dropped.
+
+            api = Schwab(hedge=HedgePolicy(quantile=0.95))
+            api.hedge_policy.stats()   # latency quantile, hedged requests and hedge wins
+
+        :type quantile: float
+        :param quantile: Latency quantile after which the second request is sent
+
+        :type min_delay: float
+        :param min_delay: Never send the second request sooner than this many seconds
+
+        :type max_delay: float
+        :param max_delay: Never wait longer than this many seconds to send it
+
+        :type min_samples: int
+        :param min_samples: Don't hedge an endpoint until this many of its latencies are known
+
+        :type window: int
+        :param window: Number of recent latencies kept per endpoint
+
+        :type endpoints: set
+        :param endpoints: Endpoints (functions of urls.py) to hedge. Must only read.
+
+        :type max_workers: int
+        :param max_workers: Threads sending the requests of Schwab (AsyncSchwab doesn't need any)
+        """
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.endpoints = frozenset(endpoints) & READ_ENDPOINTS
+        self.max_workers = max_workers
+        # endpoint -> recent latencies in seconds
+        self._latencies = dict()
+        self.hedged = collections.Counter()
+        self.hedge_wins = collections.Counter()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def applies(self, url):
+        return urls.endpoint_name(url) in self.endpoints
+
+    def delay(self, endpoint):
+        """
+        :returns: Seconds after which to hedge a request to endpoint, or None to not hedge it yet
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(endpoint, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        latency = latencies[int(self.quantile * (len(latencies) - 1))]
+        return min(self.max_delay, max(self.min_delay, latency))
+
+    def stats(self):
+        """
+        :returns: dict of endpoint to its hedging delay, number of hedged requests and number
+            of times the second request answered first
+        """
+        with self._lock:
+            endpoints = list(self._latencies)
+        return {
+            endpoint: {
+                "delay": self.delay(endpoint),
+                "hedged": self.hedged[endpoint],
+                "hedge_wins": self.hedge_wins[endpoint],
+            } for endpoint in endpoints
+        }
+
+    def run(self, url, send):
+        """
+        Returns the response of send(), calling it a second time in parallel if the first
+        call is slow.
+        """
+        endpoint = urls.endpoint_name(url)
+        delay = self.delay(endpoint)
+        if delay is None:
+            return self._timed(endpoint, send)
+
+        executor = self._get_executor()
+        first = executor.submit(self._timed, endpoint, send)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        second = executor.submit(self._timed, endpoint, send)
+        done, pending = wait([first, second], return_when=FIRST_COMPLETED)
+        winner = first if first in done else second
+        if winner.exception() is not None and pending:
+            # the other request may still succeed
+            winner = pending.pop()
+            wait([winner])
+        self._count(endpoint, winner is second)
+        loser = second if winner is first else first
+        loser.add_done_callback(_close_response)
+        return winner.result()
+
+    async def run_async(self, url, send):
+        """
+        Same as run() for a coroutine function send.
+        """
+        endpoint = urls.endpoint_name(url)
+        delay = self.delay(endpoint)
+        if delay is None:
+            return await self._timed_async(endpoint, send)
+
+        first = asyncio.ensure_future(self._timed_async(endpoint, send))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        second = asyncio.ensure_future(self._timed_async(endpoint, send))
+        try:
+            done, pending = await asyncio.wait({first, second}, return_when=asyncio.FIRST_COMPLETED)
+            winner = first if first in done else second
+            if winner.exception() is not None and pending:
+                winner = pending.pop()
+                await asyncio.wait({winner})
+        finally:
+            for task in (first, second):
+                if not task.done():
+                    task.cancel()
+        self._count(endpoint, winner is second)
+        loser = second if winner is first else first
+        if loser.done() and not loser.cancelled():
+            # don't warn about an exception nobody looked at
+            loser.exception()
+        return winner.result()
+
+    def _timed(self, endpoint, send):
+        start = time.monotonic()
+        r = send()
+        self._record(endpoint, time.monotonic() - start)
+        return r
+
+    async def _timed_async(self, endpoint, send):
+        start = time.monotonic()
+        r = await send()
+        self._record(endpoint, time.monotonic() - start)
+        return r
+
+    def _record(self, endpoint, seconds):
+        with self._lock:
+            if endpoint not in self._latencies:
+                self._latencies[endpoint] = collections.deque(maxlen=self.window)
+            self._latencies[endpoint].append(seconds)
+
+    def _count(self, endpoint, hedge_won):
+        with self._lock:
+            self.hedged[endpoint] += 1
+            if hedge_won:
+                self.hedge_wins[endpoint] += 1
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def retry_policy(retry):
+    """
+    Builds the RetryPolicy of a client from its retry argument: a RetryPolicy, True for the
+    default one or a number of attempts. None, False and 0 mean no retries.
+    """
+    if not retry or isinstance(retry, RetryPolicy):
+        return retry or None
+    if retry is True:
+        return RetryPolicy()
+    return RetryPolicy(max_attempts=retry)
+
+
+def hedge_policy(hedge):
+    """
+    Builds the HedgePolicy of a client from its hedge argument: a HedgePolicy or True for the
+    default one.
+    """
+    if hedge is None or hedge is False or isinstance(hedge, HedgePolicy):
+        return hedge or None
+    return HedgePolicy()
@@ -0,0 +1,160 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .option_chain import OptionChain
+from .throttle import TokenBucket
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def max_spread(spread):
+    """
+    Filter for contracts whose ask - bid is at most spread.
+    """
+    return lambda chain: (chain.ask - chain.bid) <= spread
+
+
+def delta_between(low, high):
+    """
+    Filter for contracts whose absolute delta is between low and high.
+    """
+    return lambda chain: (np.abs(chain.delta) >= low) & (np.abs(chain.delta) <= high)
+
+
+def days_between(low, high):
+    """
+    Filter for contracts expiring in low to high days.
+    """
+    return lambda chain: (chain.days_until >= low) & (chain.days_until <= high)
+
+
+def all_of(*filters):
+    """
+    Filter for contracts matching every one of filters.
+    """
+    def combined(chain):
+        mask = np.ones(len(chain), dtype=bool)
+        for f in filters:
+            mask &= f(chain)
+        return mask
+    return combined
+
+
+class ChainScanner:
+    def __init__(self, api, max_workers=8, rate=5, greeks=False, compute_greeks=False, rate_limiter=None):
+        """
+        Fetches the option chains of many tickers at once and runs a vectorized filter on
+        each of them as soon as it arrives:
+
+            scanner = ChainScanner(api, compute_greeks=True)
+            for ticker, matches in scanner.scan(tickers, all_of(max_spread(0.10), delta_between(0.2, 0.4))):
+                print(ticker, matches.symbol)
+
+        A filter takes an OptionChain and returns a boolean NumPy array with one value per
+        contract. max_spread, delta_between, days_between and all_of build common ones.
+
+        :type api: Schwab
+        :param api: A logged in Schwab
+
+        :type max_workers: int
+        :param max_workers: Maximum number of chains requested at once
+
+        :type rate: float
+        :param rate: Maximum number of chains requested per second
+
+        :type greeks: boolean
+        :param greeks: Ask Schwab for the greeks
+
+        :type compute_greeks: boolean
+        :param compute_greeks: Compute the greeks locally (see OptionChain.compute_greeks)
+            instead, which keeps the responses small
+
+        :type rate_limiter: TokenBucket
+        :param rate_limiter: Share a rate limit with other scanners. If set, rate is ignored.
+        """
+        if np is None:
+            raise ImportError("ChainScanner requires numpy; install it with `pip install schwab-api[options]`")
+        self.api = api
+        self.max_workers = max_workers
+        self.greeks = greeks
+        self.compute_greeks = compute_greeks
+        self.rate_limiter = rate_limiter or TokenBucket(rate)
+        # ticker -> error message of the chains that couldn't be fetched during the last scan
+        self.errors = dict()
+
+    def scan(self, tickers, filter=None):
+        """
+        Generator yielding (ticker, OptionChain of the matching contracts) for each ticker,
+        in the order the chains arrive. Tickers without any match are skipped; the ones that
+        failed are in errors.
+        """
+        self.errors = dict()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._scan_one, ticker, filter): ticker for ticker in tickers}
+            try:
+                for future in as_completed(futures):
+                    result = self._result(futures[future], future)
+                    if result is not None:
+                        yield result
+            finally:
+                # The caller stopped early; don't fetch the remaining chains.
+                for future in futures:
+                    future.cancel()
+
+    def _scan_one(self, ticker, filter):
+        self.rate_limiter.acquire()
+        return self._match(self.api.get_options_chains_v2(ticker, greeks=self.greeks), filter)
+
+    def _match(self, response, filter):
+        if isinstance(response, tuple):
+            # get_options_chains_v2 returns ([response text], False) on errors
+            raise Exception(response[0][0])
+        chain = OptionChain(response)
+        if self.compute_greeks:
+            chain.compute_greeks()
+        return chain.take(filter(chain)) if filter is not None else chain
+
+    def _result(self, ticker, future):
+        try:
+            matches = future.result()
+        except Exception as e:
+            self.errors[ticker] = repr(e)
+            return None
+        if not len(matches):
+            return None
+        return ticker, matches
+
+
+class AsyncChainScanner(ChainScanner):
+    """
+    Same as ChainScanner for an AsyncSchwab; max_workers is the number of requests in flight
+    and scan() is an async generator:
+
+        async for ticker, matches in scanner.scan(tickers, max_spread(0.10)):
+            ...
+    """
+    async def scan(self, tickers, filter=None):
+        self.errors = dict()
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def scan_one(ticker):
+            async with semaphore:
+                await self.rate_limiter.acquire_async()
+                response = await self.api.get_options_chains_v2(ticker, greeks=self.greeks)
+            return self._match(response, filter)
+
+        tasks = {asyncio.ensure_future(scan_one(ticker)): ticker for ticker in tickers}
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = self._result(tasks[task], task)
+                    if result is not None:
+                        yield result
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,228 @@
+import asyncio
+import collections
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+from . import urls
+
+
+# Priority classes, most urgent first
+ORDERS = "orders"
+ORDER_STATUS = "order_status"
+QUOTES = "quotes"
+BULK = "bulk"
+PRIORITY_CLASSES = (ORDERS, ORDER_STATUS, QUOTES, BULK)
+
+# endpoint (function of urls.py) -> priority class. The others (e.g. bearer_token, which
+# every class needs) are never queued.
+ENDPOINT_CLASSES = {
+    "order_verification_v2": ORDERS,
+    "cancel_order_v2": ORDERS,
+    "order_verification": ORDERS,
+    "order_confirmation": ORDERS,
+    "orders_v2": ORDER_STATUS,
+    "ticker_quotes_v2": QUOTES,
+    "option_chains_v2": BULK,
+    "transaction_history_v2": BULK,
+    "positions_v2": BULK,
+    "account_info_v2": BULK,
+    "lot_details_v2": BULK,
+    "positions_data": BULK,
+}
+
+# Maximum requests in flight per class. Together, order status, quotes and bulk reads could
+# fill all 8 slots; the scheduler's reserved slots are what keeps room for orders.
+DEFAULT_LIMITS = {ORDERS: 8, ORDER_STATUS: 4, QUOTES: 4, BULK: 2}
+
+
+class _Waiter:
+    def __init__(self, priority_class):
+        self.priority_class = priority_class
+        self.granted = False
+        self.event = threading.Event()
+
+    def wake(self):
+        self.event.set()
+
+
+class _AsyncWaiter:
+    def __init__(self, priority_class):
+        self.priority_class = priority_class
+        self.granted = False
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+
+    def wake(self):
+        # The slot may be released from another thread (or event loop)
+        self.loop.call_soon_threadsafe(_set_result, self.future)
+
+
+def _set_result(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class RequestScheduler:
+    def __init__(self, max_concurrency=8, limits=None, reserved=1):
+        """
+        Decides which requests of a client go first when it is busy. Requests are sorted into
+        priority classes by endpoint:
+            orders - verifying, placing and cancelling orders
+            order_status - orders_v2
+            quotes - quote_v2 and quote_v2_batch
+            bulk - option chains, transaction history, positions and lots
+
+        At most max_concurrency requests are in flight at once, and at most limits[class] of
+        each class. `reserved` of the slots can only be used by orders, so however busy
+        polling order status, quotes and positions keeps the client, orders don't wait behind
+        them. When a slot frees up, it goes to the oldest waiting request of the most urgent
+        class:
+
+            api = Schwab(scheduler=RequestScheduler(max_concurrency=8, limits={"quotes": 2}))
+            api.scheduler.stats()   # requests in flight and waiting per class
+
+        Requests that aren't in any class (e.g. token refreshes) are never queued. A streamed
+        request holds its slot until its headers arrive, not while its body is read.
+
+        :type max_concurrency: int
+        :param max_concurrency: Maximum number of requests in flight, all classes together
+
+        :type limits: dict
+        :param limits: Maximum number of requests in flight per class (see DEFAULT_LIMITS)
+
+        :type reserved: int
+        :param reserved: Number of slots the other classes can't use, kept for orders
+        """
+        unknown = set(limits or {}) - set(PRIORITY_CLASSES)
+        if unknown:
+            raise ValueError("Unknown priority classes: {}".format(", ".join(sorted(unknown))))
+        if not 0 <= reserved < max_concurrency:
+            raise ValueError("reserved must be between 0 and max_concurrency - 1, got {}".format(reserved))
+        self.max_concurrency = max_concurrency
+        self.reserved = reserved
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        if any(limit < 1 for limit in self.limits.values()):
+            raise ValueError("Every priority class needs a limit of at least 1: {}".format(self.limits))
+        self._running = {priority_class: 0 for priority_class in PRIORITY_CLASSES}
+        self._queues = {priority_class: collections.deque() for priority_class in PRIORITY_CLASSES}
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def priority_class(self, url):
+        """
+        :returns: The priority class of requests to url, or None if they aren't scheduled
+        """
+        return ENDPOINT_CLASSES.get(urls.endpoint_name(url))
+
+    @contextmanager
+    def slot(self, url):
+        """
+        Context manager waiting for a slot to send a request to url, and freeing it on exit.
+        """
+        priority_class = self.priority_class(url)
+        if priority_class is None:
+            yield
+            return
+        waiter = _Waiter(priority_class)
+        self._enqueue(waiter)
+        try:
+            waiter.event.wait()
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        try:
+            yield
+        finally:
+            self._release(priority_class)
+
+    @asynccontextmanager
+    async def async_slot(self, url):
+        """
+        Same as slot(), but waits without blocking the event loop.
+        """
+        priority_class = self.priority_class(url)
+        if priority_class is None:
+            yield
+            return
+        waiter = _AsyncWaiter(priority_class)
+        self._enqueue(waiter)
+        try:
+            await waiter.future
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        try:
+            yield
+        finally:
+            self._release(priority_class)
+
+    def stats(self):
+        """
+        :returns: dict of priority class to the number of its requests in flight ("running")
+            and waiting for a slot ("waiting")
+        """
+        with self._lock:
+            return {
+                priority_class: {
+                    "running": self._running[priority_class],
+                    "waiting": len(self._queues[priority_class]),
+                } for priority_class in PRIORITY_CLASSES
+            }
+
+    def _enqueue(self, waiter):
+        with self._lock:
+            self._queues[waiter.priority_class].append(waiter)
+            granted = self._dispatch()
+        for waiter in granted:
+            waiter.wake()
+
+    def _release(self, priority_class):
+        with self._lock:
+            self._running[priority_class] -= 1
+            self._total -= 1
+            granted = self._dispatch()
+        for waiter in granted:
+            waiter.wake()
+
+    def _abandon(self, waiter):
+        """
+        The caller stopped waiting (e.g. its task was cancelled): frees its place in the queue,
+        or its slot if it got one in the meantime.
+        """
+        with self._lock:
+            if not waiter.granted:
+                self._queues[waiter.priority_class].remove(waiter)
+                return
+        self._release(waiter.priority_class)
+
+    def _dispatch(self):
+        # Needs self._lock. Gives the free slots to the waiters, most urgent class first.
+        granted = []
+        for priority_class in PRIORITY_CLASSES:
+            queue = self._queues[priority_class]
+            while queue and self._has_slot(priority_class):
+                waiter = queue.popleft()
+                waiter.granted = True
+                self._running[priority_class] += 1
+                self._total += 1
+                granted.append(waiter)
+        return granted
+
+    def _has_slot(self, priority_class):
+        # Needs self._lock
+        if self._total >= self.max_concurrency or self._running[priority_class] >= self.limits[priority_class]:
+            return False
+        if priority_class == ORDERS:
+            return True
+        others = self._total - self._running[ORDERS]
+        return others < self.max_concurrency - self.reserved
+
+
+def request_scheduler(scheduler):
+    """
+    Builds the RequestScheduler of a client from its scheduler argument: a RequestScheduler or
+    True for the default one.
+    """
+    if scheduler is None or scheduler is False or isinstance(scheduler, RequestScheduler):
+        return scheduler or None
+    return RequestScheduler()
@@ -1,28 +1,131 @@
+import copy
 import json
 import urllib.parse
 import requests
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from . import urls
-from .account_information import Position, Account
+from .account_information import Position, Account, _build
 from .authentication import SessionManager
+from .quotes import (
+    QUOTE_CHUNK_SIZE,
+    QuoteBatcher,
+    _chunks,
+    _dedupe_symbols,
+    _merge_quote_results,
+    quote_cache,
+    quote_symbol,
+)
+from .option_chain import OptionChain
+from .portfolio import PortfolioFrame
+from .json_stream import iter_array_items
+from .quote_stream import QuotePoller
+from .metrics import client_metrics, instrumented
+from .retry import hedge_policy, retry_policy
+from .scheduler import request_scheduler
+from .throttle import rate_limiter
+from .transport import Transport, iter_bytes
+from .verified_ticket import VerifiedTicket
+
+
+class TransactionHistoryError(Exception):
+    """
+    Raised by iter_transaction_history_v2 when Schwab answers with an error status, which is
+    kept in status_code.
+    """
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
 
 class Schwab(SessionManager):
     def __init__(self, session_cache=None, **kwargs):
         """
         The Schwab class. Used to interact with the Schwab API.
 
-        :type session_cache: str
-        :param session_cache: Path to an optional session file, used to save/restore credentials
+        :type session_cache: str or SessionStore
+        :param session_cache: Path to an optional session file, used to save/restore credentials.
+            Paths ending in .db, .sqlite or .sqlite3 are stored in SQLite. Several processes can
+            share the same session_cache.
+
+        Connection pooling can be configured with the following keyword arguments:
+            transport (Transport) - Share the connection pools of another client. If set, the
+                        arguments below are ignored.
+            pool_connections (int) - Number of hosts to keep a connection pool for.
+            pool_maxsize (int) - Maximum number of keep-alive connections per host.
+            http2 (bool) - Multiplex requests over HTTP/2. Requires httpx[http2].
+            timeout (float) - Timeout in seconds for each request. Defaults to no timeout.
+
+        Bearer tokens are cached per scope until they are about to expire:
+            refresh_tokens (bool) - Renew the cached tokens in a background thread before they
+                        expire, so calls never wait on a token refresh.
+
+        Logging in launches a browser every time, unless it's given one that is kept running:
+            browser_pool (BrowserPool) - Log in using the (possibly shared) pool's browser.
+            warm_browser (bool) - Create a BrowserPool of size 1 for this instance.
+        The duration of each login is kept in login_timings.
+
+        Concurrent quote_v2 calls can be coalesced:
+            quote_batch_window (float) - Collect the symbols requested by quote_v2 calls for this
+                        many seconds (e.g. 0.005) and fetch them with a single request.
+            quote_cache (QuoteCache or float) - Cache the quotes returned by quote_v2 and
+                        quote_v2_batch. A number is the max_age in seconds of a new QuoteCache.
+
+        Requests can be throttled per endpoint, slowing down when the gateway answers 429 or 5xx:
+            rate_limit (AdaptiveRateLimiter or float) - Share a limiter with other clients, or
+                        the maximum requests per second to each endpoint of a new one.
+                        None (the default) or 0 doesn't throttle.
+
+        Read-only requests (quotes, orders, positions, ...) can be retried and hedged:
+            retry (RetryPolicy, bool or int) - Retry them after connection errors, timeouts,
+                        429 and 5xx. A number is the maximum number of attempts.
+            hedge (HedgePolicy or bool) - Send a second copy of the ones slower than usual
+                        and use whichever answers first.
+
+        When the client is shared by pollers and order placement, orders can go first:
+            scheduler (RequestScheduler or bool) - Limit the requests in flight per priority
+                        class (orders, order status, quotes, bulk reads), most urgent first.
+
+        Latency, status codes and bytes can be measured per endpoint and per operation:
+            metrics (Metrics or bool) - Share a Metrics with other clients, or create one. See
+                        Metrics for the hooks, OpenTelemetry spans and Prometheus export.
         """
         self.headless = kwargs.get("headless", True)
         self.browserType = kwargs.get("browserType", "firefox")
         self.session_cache = session_cache
-        super(Schwab, self).__init__()
-
-    def get_account_info(self):
+        transport = kwargs.get("transport") or Transport(
+            pool_connections=kwargs.get("pool_connections", 10),
+            pool_maxsize=kwargs.get("pool_maxsize", 10),
+            http2=kwargs.get("http2", False),
+            timeout=kwargs.get("timeout", None)
+        )
+        super(Schwab, self).__init__(
+            debug=kwargs.get("debug", False),
+            transport=transport,
+            refresh_tokens=kwargs.get("refresh_tokens", False),
+            browser_pool=kwargs.get("browser_pool"),
+            warm_browser=kwargs.get("warm_browser", False),
+            rate_limiter=rate_limiter(kwargs.get("rate_limit")),
+            retry_policy=retry_policy(kwargs.get("retry")),
+            hedge_policy=hedge_policy(kwargs.get("hedge")),
+            scheduler=request_scheduler(kwargs.get("scheduler")),
+            metrics=client_metrics(kwargs.get("metrics"))
+        )
+        quote_batch_window = kwargs.get("quote_batch_window")
+        self.quote_batcher = QuoteBatcher(self._quote_v2_batch, quote_batch_window) if quote_batch_window else None
+        self.quote_cache = quote_cache(kwargs.get("quote_cache"))
+        self._quote_pollers = dict()
+
+    @instrumented
+    def get_account_info(self, as_models=False):
         """
         Returns a dictionary of Account objects where the key is the account number
+
+        as_models (bool) - Return the accounts and positions as Account and Position objects
+                           (compact, read-only dictionaries) instead of plain dictionaries.
         """
 
         account_info = dict()
@@ -40,21 +143,23 @@ class Schwab(SessionManager):
                 if cookie.value.endswith('|'):
                     cookie.value += 'AllAccts'
                     self.session.cookies.set_cookie(cookie)
-        r = self.session.get(urls.positions_data())
+        r = self._request("GET", urls.positions_data(), session=self.session)
         response = json.loads(r.text)
         for account in response['Accounts']:
             positions = list()
             for security_group in account["SecurityGroupings"]:
                 for position in security_group["Positions"]:
                     positions.append(
-                        Position(
+                        _build(
+                            Position,
+                            as_models,
                             position["DefaultSymbol"],
                             position["Description"],
                             float(position["Quantity"]),
                             float(position["Cost"]),
                             float(position["MarketValue"]),
                             position["ItemIssueId"]
-                        )._as_dict()
+                        )
                     )
 
                     if not "ChildOptionPositions" in position:
@@ -63,64 +168,70 @@ class Schwab(SessionManager):
                     # Add call positions if they exist
                     for child_position in position["ChildOptionPositions"]:
                         positions.append(
-                            Position(
+                            _build(
+                                Position,
+                                as_models,
                                 child_position["DefaultSymbol"],
                                 child_position["Description"],
                                 float(child_position["Quantity"]),
                                 float(child_position["Cost"]),
                                 float(child_position["MarketValue"]),
                                 child_position["ItemIssueId"]
-                            )._as_dict()
+                            )
                         )
-            account_info[int(account["AccountId"])] = Account(
+            account_info[int(account["AccountId"])] = _build(
+                Account,
+                as_models,
                 account["AccountId"],
                 positions,
                 account["Totals"]["MarketValue"],
                 account["Totals"]["CashInvestments"],
                 account["Totals"]["AccountValue"],
                 account["Totals"]["Cost"],
-            )._as_dict()
+            )
 
         return account_info
 
-    def get_transaction_history_v2(self, account_id):
+    @instrumented
+    def get_transaction_history_v2(self, account_id, time_frame="All"):
         """
             account_id (int) - The account ID to place the trade on. If the ID is XXXX-XXXX,
                         we're looking for just XXXXXXXX.
+            time_frame (str) - Experimental: time frames other than "All" (e.g. "Last6Months")
+                        are the ones offered by the website and may not all be accepted.
 
             Returns a dictionary of transaction history entries for the provided account ID.
+            To keep a local copy up to date, see TransactionStore.
         """
 
-        data = {
-            "timeFrame": "All",
-            "selectedTransactionTypes": [
-                "Adjustments",
-                "AtmActivity",
-                "BillPay",
-                "CorporateActions",
-                "Checks",
-                "Deposits",
-                "DividendsAndCapitalGains",
-                "ElectronicTransfers",
-                "Fees",
-                "Interest",
-                "Misc",
-                "SecurityTransfers",
-                "Taxes",
-                "Trades",
-                "VisaDebitCard",
-                "Withdrawals"
-            ],
-            "exportType": "Json",
-            "selectedAccountId": str(account_id),
-            "sortColumn": "Date",
-            "sortDirection": "Descending"
-        }
-        r = requests.post(urls.transaction_history_v2(), json=data, headers=self.headers)
+        data = _transaction_history_v2_payload(account_id, time_frame)
+        r = self._request("POST", urls.transaction_history_v2(), json=data, headers=dict(self.headers))
         if r.status_code != 200:
             return [r.text], False
         return json.loads(r.text)
 
+    def iter_transaction_history_v2(self, account_id, time_frame="All"):
+        """
+            Same as get_transaction_history_v2(), but reads the export as it is downloaded and
+            yields its BrokerageTransactions one at a time, so the memory used stays the same
+            however long the history is.
+
+            Raises a TransactionHistoryError if Schwab returns an error.
+        """
+        data = _transaction_history_v2_payload(account_id, time_frame)
+        r = self._request("POST", urls.transaction_history_v2(), json=data, headers=dict(self.headers), stream=True)
+        try:
+            if r.status_code != 200:
+                if hasattr(r, "read"):
+                    # httpx only loads the text of a streamed response once it is read
+                    r.read()
+                raise TransactionHistoryError("Could not get the transaction history: {}".format(r.text), r.status_code)
+            for transaction in iter_array_items(iter_bytes(r), "BrokerageTransactions"):
+                yield transaction
+        finally:
+            r.close()
+
+    @instrumented
     def trade(self, ticker, side, qty, account_id, dry_run=True):
         """
             ticker (Str) - The symbol you want to trade,
@@ -153,7 +264,7 @@ class Schwab(SessionManager):
             "CostBasis":"FIFO",
             }
 
-        r = self.session.post(urls.order_verification(), data)
+        r = self._request("POST", urls.order_verification(), data=data, session=self.session)
 
         if r.status_code != 200:
             return [r.text], False
@@ -186,7 +297,7 @@ class Schwab(SessionManager):
             "Timing": "Day Only"
         }
 
-        r = self.session.post(urls.order_confirmation(), data)
+        r = self._request("POST", urls.order_confirmation(), data=data, session=self.session)
 
         if r.status_code != 200:
             messages.append(r.text)
@@ -198,6 +309,7 @@ class Schwab(SessionManager):
 
         return messages, False
 
+    @instrumented
     def trade_v2(self,
         ticker,
         side,
@@ -283,114 +395,44 @@ class Schwab(SessionManager):
             Returns messages (list of strings), is_success (boolean)
         """
 
-        if side == "Buy":
-            buySellCode = "49"
-        elif side == "Sell":
-            buySellCode = "50"
-        else:
-            raise Exception("side must be either Buy or Sell")
-
-        # Handling formating of limit_price to avoid error.
-        # Checking how many decimal places are in limit_price.
-        decimal_places = len(str(float(limit_price)).split('.')[1])
-        limit_price_warning = None
-        # Max 2 decimal places allowed for price >= $1 and 4 decimal places for price < $1.
-        if limit_price >= 1:
-            if decimal_places > 2:
-                limit_price = round(limit_price,2)
-                limit_price_warning = f"For limit_price >= 1, Only 2 decimal places allowed. Rounded price_limit to: {limit_price}"
-        else:
-            if decimal_places > 4:
-                limit_price = round(limit_price,4)
-                limit_price_warning = f"For limit_price < 1, Only 4 decimal places allowed. Rounded price_limit to: {limit_price}"
+        ticket = self.verify_v2(
+            ticker, side, qty, account_id, order_type, duration, limit_price, stop_price,
+            primary_security_type, valid_return_codes, costBasis)
+        if dry_run or not ticket.success:
+            return ticket.messages, ticket.success
+        return self.place(ticket, affirm_order)
 
-        self.update_token(token_type='update')
+    @instrumented
+    def verify_v2(self,
+        ticker,
+        side,
+        qty,
+        account_id,
+        order_type=49,
+        duration=48,
+        limit_price=0,
+        stop_price=0,
+        primary_security_type=46,
+        valid_return_codes = {0,10},
+        costBasis='FIFO'
+        ):
+        """
+        Verifies an order like trade_v2(dry_run=True) (see its docstring for the parameters),
+        but returns a VerifiedTicket that place() can submit later without verifying it again.
+        """
+        buySellCode = _buy_sell_code_v2(side)
+        limit_price, limit_price_warning = _format_limit_price(limit_price)
 
-        data = {
-            "UserContext": {
-                "AccountId":str(account_id),
-                "AccountColor":0
-            },
-            "OrderStrategy": {
-                "PrimarySecurityType":primary_security_type,
-                "CostBasisRequest": {
-                    "costBasisMethod":costBasis,
-                    "defaultCostBasisMethod":costBasis
-                },
-                "OrderType":str(order_type),
-                "LimitPrice":str(limit_price),
-                "StopPrice":str(stop_price),
-                "Duration":str(duration),
-                "AllNoneIn":False,
-                "DoNotReduceIn":False,
-                "OrderStrategyType":1,
-                "OrderLegs":[
-                    {
-                        "Quantity":str(qty),
-                        "LeavesQuantity":str(qty),
-                        "Instrument":{"Symbol":ticker},
-                        "SecurityType":primary_security_type,
-                        "Instruction":buySellCode
-                    }
-                    ]},
-            # OrderProcessingControl seems to map to verification vs actually placing an order.
-            "OrderProcessingControl":1
-        }
+        data = _trade_v2_payload(
+            ticker, buySellCode, qty, account_id, order_type, duration,
+            limit_price, stop_price, primary_security_type, costBasis)
 
         # Adding this header seems to be necessary.
-        self.headers['schwab-resource-version'] = '1.0'
-
-        r = requests.post(urls.order_verification_v2(), json=data, headers=self.headers)
-        if r.status_code != 200:
-            return [r.text], False
-
-        response = json.loads(r.text)
-
-        orderId = response['orderStrategy']['orderId']
-        firstOrderLeg = response['orderStrategy']['orderLegs'][0]
-        if "schwabSecurityId" in firstOrderLeg:
-            data["OrderStrategy"]["OrderLegs"][0]["Instrument"]["ItemIssueId"] = firstOrderLeg["schwabSecurityId"]
-
-        messages = list()
-        if limit_price_warning is not None:
-            messages.append(limit_price_warning)
-        for message in response["orderStrategy"]["orderMessages"]:
-            messages.append(message["message"])
-
-        # TODO: This needs to be fleshed out and clarified.
-        if response["orderStrategy"]["orderReturnCode"] not in valid_return_codes:
-            return messages, False
-
-        if dry_run:
-            return messages, True
-
-        # Make the same POST request, but for real this time.
-        data["UserContext"]["CustomerId"] = 0
-        data["OrderStrategy"]["OrderId"] = int(orderId)
-        data["OrderProcessingControl"] = 2
-        if affirm_order:
-            data["OrderStrategy"]["OrderAffrmIn"] = True
-        self.update_token(token_type='update')
-        r = requests.post(urls.order_verification_v2(), json=data, headers=self.headers)
-
-        if r.status_code != 200:
-            return [r.text], False
-
-        response = json.loads(r.text)
-
-        messages = list()
-        if limit_price_warning is not None:
-            messages.append(limit_price_warning)
-        if "orderMessages" in response["orderStrategy"] and response["orderStrategy"]["orderMessages"] is not None:
-            for message in response["orderStrategy"]["orderMessages"]:
-                messages.append(message["message"])
-
-        if response["orderStrategy"]["orderReturnCode"] in valid_return_codes:
-            return messages, True
-
-        return messages, False
-
+        headers = self._headers('update', **{'schwab-resource-version': '1.0'})
+        r = self._request("POST", urls.order_verification_v2(), json=data, headers=headers)
+        return _verified_ticket(data, r, valid_return_codes, limit_price_warning)
 
+    @instrumented
     def option_trade_v2(self,
         strategy,
         symbols,
@@ -486,100 +528,134 @@ class Schwab(SessionManager):
 
             Returns messages (list of strings), is_success (boolean)
         """
+        ticket = self.verify_option_v2(
+            strategy, symbols, instructions, quantities, account_id, order_type, duration,
+            limit_price, stop_price, valid_return_codes)
+        if dry_run or not ticket.success:
+            return ticket.messages, ticket.success
+        return self.place(ticket, affirm_order)
+
+    @instrumented
+    def verify_option_v2(self,
+        strategy,
+        symbols,
+        instructions,
+        quantities,
+        account_id,
+        order_type,
+        duration=48,
+        limit_price=0,
+        stop_price=0,
+        valid_return_codes = {0,10}
+        ):
+        """
+        Verifies an option order like option_trade_v2(dry_run=True) (see its docstring for the
+        parameters), but returns a VerifiedTicket that place() can submit later without
+        verifying it again.
+        """
         if not (len(quantities) == len(symbols) and len(symbols) == len(instructions)):
             raise ValueError("variables quantities, symbols and instructions must have the same length")
 
-        instruction_code = {
-            "BTO": "201",
-            "BTC": "202",
-            "STO": "203",
-            "STC": "204"
-        }
-        instruction_codes = [instruction_code[i] for i in instructions]
-
-        self.update_token(token_type='update')
+        instruction_codes = [_OPTION_INSTRUCTION_CODES[i] for i in instructions]
 
-        data = {
-              "UserContext": {
-                "AccountId": str(account_id),
-                "AccountColor": 0
-              },
-              "OrderStrategy": {
-                "PrimarySecurityType": 48,
-                "CostBasisRequest": None,
-                "OrderType": str(order_type),
-                "Duration": str(duration),
-                "LimitPrice": str(limit_price),
-                "StopPrice": str(stop_price),
-                "ReinvestDividend": False,
-                "MinimumQuantity": 0,
-                "AllNoneIn": False,
-                "DoNotReduceIn": False,
-                "Strategy": strategy,
-                "OrderStrategyType": 1,
-                "OrderLegs": [
-                    {
-                        "Quantity": str(qty),
-                        "LeavesQuantity": str(qty),
-                        "Instrument": {"Symbol": symbol},
-                        "SecurityType": 48,
-                        "Instruction": instruction
-                    } for qty, symbol, instruction in zip(quantities, symbols, instruction_codes)
-                    ]},
-            # OrderProcessingControl seems to map to verification vs actually placing an order.
-            "OrderProcessingControl": 1
-        }
+        data = _option_trade_v2_payload(
+            strategy, symbols, instruction_codes, quantities, account_id,
+            order_type, duration, limit_price, stop_price)
 
         # Adding this header seems to be necessary.
-        self.headers['schwab-resource-version'] = '1.0'
+        headers = self._headers('update', **{'schwab-resource-version': '1.0'})
+        r = self._request("POST", urls.order_verification_v2(), json=data, headers=headers)
+        return _verified_ticket(data, r, valid_return_codes)
 
-        r = requests.post(urls.order_verification_v2(), json=data, headers=self.headers)
-        if r.status_code != 200:
-            return [r.text], False
-
-        response = json.loads(r.text)
-
-        orderId = response['orderStrategy']['orderId']
-        for i in range(len(symbols)):
-            OrderLeg = response['orderStrategy']['orderLegs'][i]
-            if "schwabSecurityId" in OrderLeg:
-                data["OrderStrategy"]["OrderLegs"][i]["Instrument"]["ItemIssueId"] = OrderLeg["schwabSecurityId"]
-
-        messages = list()
-        for message in response["orderStrategy"]["orderMessages"]:
-            messages.append(message["message"])
-
-        # TODO: This needs to be fleshed out and clarified.
-        if response["orderStrategy"]["orderReturnCode"] not in valid_return_codes:
-            return messages, False
+    @instrumented
+    def place(self, ticket, affirm_order=False, valid_return_codes=None):
+        """
+        Places an order verified with verify_v2() or verify_option_v2(). Only the placing
+        request is sent.
 
-        if dry_run:
-            return messages, True
+        ticket (VerifiedTicket) - A successfully verified order.
+        affirm_order (bool) - See trade_v2().
+        valid_return_codes (set) - Defaults to the valid_return_codes used for verification.
 
-        # Make the same POST request, but for real this time.
-        data["UserContext"]["CustomerId"] = 0
-        data["OrderStrategy"]["OrderId"] = int(orderId)
-        data["OrderProcessingControl"] = 2
-        if affirm_order:
-            data["OrderStrategy"]["OrderAffrmIn"] = True
-        self.update_token(token_type='update')
-        r = requests.post(urls.order_verification_v2(), json=data, headers=self.headers)
+        Returns messages (list of strings), is_success (boolean)
+        """
+        data = _place_payload(ticket, affirm_order)
+        headers = self._headers('update', **{'schwab-resource-version': '1.0'})
+        r = self._request("POST", urls.order_verification_v2(), json=data, headers=headers)
+        return _placement_result(r, ticket, valid_return_codes)
 
-        if r.status_code != 200:
-            return [r.text], False
+    @instrumented
+    def verify_many(self, orders, max_workers=8, **kwargs):
+        """
+        Verifies many orders with verify_v2() in parallel, e.g. ahead of time so that only
+        place() is left to do when it's time to trade.
 
-        response = json.loads(r.text)
+        orders (list of tuples) - (account_id, ticker, side, qty) for each order.
+        max_workers (int) - Maximum number of verifications in flight at once.
+        kwargs - Passed to verify_v2 for every order (order_type, limit_price, ...).
 
-        messages = list()
-        if "orderMessages" in response["orderStrategy"] and response["orderStrategy"]["orderMessages"] is not None:
-            for message in response["orderStrategy"]["orderMessages"]:
-                messages.append(message["message"])
-
-        if response["orderStrategy"]["orderReturnCode"] in valid_return_codes:
-            return messages, True
+        Returns a list with, for each order, its VerifiedTicket or the exception raised while
+        verifying it.
+        """
+        orders = [tuple(order) for order in orders]
+        if not orders:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(orders))) as executor:
+            return list(executor.map(lambda order: self._verify_order(order, kwargs), orders))
+
+    def _verify_order(self, order, kwargs):
+        account_id, ticker, side, qty = order
+        try:
+            return self.verify_v2(ticker, side, qty, account_id, **kwargs)
+        except Exception as e:
+            return e
 
-        return messages, False
+    @instrumented
+    def trade_many(self, orders, max_workers=8, **kwargs):
+        """
+        Places (or verifies, with dry_run=True) many orders with trade_v2 at once, e.g. the same
+        trade across all accounts. Orders of different accounts are sent in parallel; the
+        orders of one account are sent one after the other, in the order given.
+
+            results = api.trade_many([(account_id, "AAPL", "Buy", 1) for account_id in accounts], dry_run=False)
+
+        orders (list of tuples) - (account_id, ticker, side, qty) for each order.
+        max_workers (int) - Maximum number of orders in flight at once.
+        kwargs - Passed to trade_v2 for every order (dry_run, order_type, limit_price, ...).
+                 As with trade_v2, dry_run defaults to True.
+
+        Returns a list with one dictionary per order, in the order of orders, with the keys:
+            account_id, ticker, side, qty - The order.
+            messages (list of str), success (bool) - What trade_v2 returned.
+            error (str) - The exception raised by trade_v2, or None.
+            started (float) - Seconds between the call to trade_many and the start of the order.
+            elapsed (float) - Seconds the order took.
+        """
+        orders = [tuple(order) for order in orders]
+        results = [None] * len(orders)
+        start = time.perf_counter()
+
+        def trade_account(indexes):
+            for i in indexes:
+                results[i] = self._timed_trade(orders[i], start, kwargs)
+
+        groups = _orders_by_account(orders)
+        if groups:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(groups))) as executor:
+                list(executor.map(trade_account, groups))
+        return results
+
+    def _timed_trade(self, order, start, kwargs):
+        account_id, ticker, side, qty = order
+        started = time.perf_counter()
+        try:
+            messages, success = self.trade_v2(ticker, side, qty, account_id, **kwargs)
+            error = None
+        except Exception as e:
+            messages, success, error = [], False, repr(e)
+        return _trade_result(order, messages, success, error, started - start, time.perf_counter() - started)
 
+    @instrumented
     def cancel_order_v2(
             self, account_id, order_id,
             # The fields below are experimental and should only be changed if you know what
@@ -597,27 +673,13 @@ class Schwab(SessionManager):
             Note: the order IDs listed in the v1 orders() are different
         instrument_type (int) - It is unclear what this means or when it should be different
         """
-        data = {
-            "TypeOfOrder": 0,
-            "OrderManagementSystem": order_management_system,
-            "Orders": [{
-                "OrderId": order_id,
-                "IsLiveOrder": True,
-                "InstrumentType": instrument_type,
-                "CancelOrderLegs": [{}],
-                }],
-            "ContingentIdToCancel": 0,
-            "OrderIdToCancel": 0,
-            "OrderProcessingControl": 1,
-            "ConfirmCancelOrderId": 0,
-            }
-        self.headers["schwab-client-account"] = account_id
-        self.headers["schwab-resource-version"] = '2.0'
+        data = _cancel_order_v2_payload(order_id, instrument_type, order_management_system)
+        extra = {"schwab-client-account": str(account_id), "schwab-resource-version": '2.0'}
         # Web interface uses bearer token retrieved from:
         # https://client.schwab.com/api/auth/authorize/scope/api
         # and it seems to be good for 1800s (30min)
-        self.update_token(token_type='api')
-        r1 = requests.post(urls.cancel_order_v2(), json=data, headers=self.headers)
+        headers = self._headers('api', **extra)
+        r1 = self._request("POST", urls.cancel_order_v2(), json=data, headers=headers)
         if r1.status_code not in (200, 202):
             return [r1.text], False
 
@@ -629,11 +691,9 @@ class Schwab(SessionManager):
 
         data['ConfirmCancelOrderId'] = cancel_order_id
         data['OrderProcessingControl'] = 2
-        # Web interface uses bearer token retrieved from:
-        # https://client.schwab.com/api/auth/authorize/scope/api
-        # and it seems to be good for 1800s (30min)
-        self.update_token(token_type='api')
-        r2 = requests.post(urls.cancel_order_v2(), json=data, headers=self.headers)
+        # The token is cached, so this only hits the network if it is about to expire.
+        headers = self._headers('api', **extra)
+        r2 = self._request("POST", urls.cancel_order_v2(), json=data, headers=headers)
         if r2.status_code not in (200, 202):
             return [r2.text], False
         try:
@@ -644,27 +704,133 @@ class Schwab(SessionManager):
             return [r2.text], False
         return response, False
 
-    def quote_v2(self, tickers):
+    @instrumented
+    def quote_v2(self, tickers, max_age=None):
         """
         quote_v2 takes a list of Tickers, and returns Quote information through the Schwab API.
+
+        If the instance was created with quote_batch_window, calls made from different threads
+        within that window are sent as a single request.
+
+        If the instance was created with quote_cache, quotes younger than max_age seconds
+        (defaults to the cache's max_age) are returned from the cache. Pass max_age=0 to
+        always fetch them. If fetching the other quotes fails, the error is returned as it is
+        without the cache, even if some quotes were cached.
         """
-        data = {
-            "Symbols":tickers,
-            "IsIra":False,
-            "AccountRegType":"S3"
-        }
+        if self.quote_cache is None:
+            return self._fetch_quotes(tickers)
+
+        symbols = _dedupe_symbols(tickers)
+        cached, missing, stale = self.quote_cache.lookup(symbols, max_age)
+        if stale:
+            threading.Thread(target=self._refresh_quotes, args=(stale,), daemon=True).start()
+        if missing:
+            result = self._fetch_quotes(missing)
+            if isinstance(result, tuple):
+                # Same error as without the cache, rather than quietly leaving symbols out
+                return result
+            else:
+                for quote in result:
+                    cached[quote_symbol(quote)] = quote
+        return [cached[symbol] for symbol in symbols if symbol in cached]
+
+    def _fetch_quotes(self, tickers):
+        if self.quote_batcher is not None:
+            return self.quote_batcher.quote(tickers)
+        return self._quote_v2(tickers)
+
+    def _refresh_quotes(self, symbols):
+        try:
+            self._quote_v2_batch(symbols)
+        finally:
+            self.quote_cache.refreshed(symbols)
 
-        # Adding this header seems to be necessary.
-        self.headers['schwab-resource-version'] = '1.0'
+    def _quote_v2(self, tickers):
+        data = _quote_v2_payload(tickers)
 
-        self.update_token(token_type='update')
-        r = requests.post(urls.ticker_quotes_v2(), json=data, headers=self.headers)
+        # Adding this header seems to be necessary.
+        headers = self._headers('update', **{'schwab-resource-version': '1.0'})
+        r = self._request("POST", urls.ticker_quotes_v2(), json=data, headers=headers)
         if r.status_code != 200:
             return [r.text], False
 
         response = json.loads(r.text)
+        if self.quote_cache is not None:
+            self.quote_cache.put(response["quotes"])
         return response["quotes"]
 
+    @instrumented
+    def quote_v2_batch(self, tickers, chunk_size=QUOTE_CHUNK_SIZE, max_workers=8, max_age=None):
+        """
+        Gets quotes for any number of tickers. The tickers are deduplicated and split into
+        requests of chunk_size symbols, which are sent in parallel.
+
+        tickers (list of str) - The symbols to quote. Case and surrounding whitespace are ignored.
+        chunk_size (int) - Number of symbols per request.
+        max_workers (int) - Maximum number of requests in flight at once.
+        max_age (float) - With quote_cache, only fetch the quotes older than this many seconds.
+
+        Returns quotes (dict of symbol to quote), failures (dict of symbol to error message).
+        A symbol is either in quotes or in failures.
+        """
+        if self.quote_cache is None:
+            return self._quote_v2_batch(tickers, chunk_size, max_workers)
+
+        cached, missing, stale = self.quote_cache.lookup(_dedupe_symbols(tickers), max_age)
+        if stale:
+            threading.Thread(target=self._refresh_quotes, args=(stale,), daemon=True).start()
+        quotes, failures = self._quote_v2_batch(missing, chunk_size, max_workers)
+        cached.update(quotes)
+        return cached, failures
+
+    def _quote_v2_batch(self, tickers, chunk_size=QUOTE_CHUNK_SIZE, max_workers=8):
+        symbols = _dedupe_symbols(tickers)
+        chunks = _chunks(symbols, chunk_size)
+        if len(chunks) <= 1:
+            results = [self._quote_chunk(chunk) for chunk in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+                results = list(executor.map(self._quote_chunk, chunks))
+        return _merge_quote_results(chunks, results)
+
+    def _quote_chunk(self, chunk):
+        try:
+            return self._quote_v2(chunk)
+        except Exception as e:
+            return e
+
+    def subscribe_quotes(self, symbols, interval=1.0, max_interval=None):
+        """
+        Generator yielding updates to the quotes of symbols, as a dictionary of symbol to the
+        fields of its quote that changed (the whole quote the first time):
+
+            for update in api.subscribe_quotes(["PFE", "AAPL"], interval=0.5):
+                print(update)
+
+        Every subscription of this instance with the same interval shares one poller, which
+        fetches the quotes of all their symbols together. Polling slows down to max_interval
+        (defaults to 4 * interval) while nothing changes. If the loop falls behind, the updates
+        it missed are merged into the next one instead of piling up.
+
+        symbols (list of str) - The symbols to follow.
+        interval (float) - Seconds between polls while quotes are changing.
+        max_interval (float) - Longest delay between polls.
+        """
+        poller = self._quote_poller(interval, max_interval)
+        subscription = poller.subscribe(symbols)
+        try:
+            while True:
+                yield subscription.get()
+        finally:
+            poller.unsubscribe(subscription)
+
+    def _quote_poller(self, interval, max_interval):
+        key = (interval, max_interval)
+        if key not in self._quote_pollers:
+            self._quote_pollers[key] = QuotePoller(self._quote_v2_batch, interval, max_interval)
+        return self._quote_pollers[key]
+
+    @instrumented
     def orders_v2(self, account_id=None):
         """
         orders_v2 returns a list of orders for a Schwab Account. It is unclear to me how to filter by specific account.
@@ -672,55 +838,33 @@ class Schwab(SessionManager):
         Currently, the query parameters are hard coded to return ALL orders, but this can be easily adjusted.
         """
 
-        self.update_token(token_type='api')
-        self.headers['schwab-resource-version'] = '2.0'
+        extra = {'schwab-resource-version': '2.0'}
         if account_id:
-            self.headers["schwab-client-account"] = account_id
-        r = requests.get(urls.orders_v2(), headers=self.headers)
+            extra["schwab-client-account"] = str(account_id)
+        headers = self._headers('api', **extra)
+        r = self._request("GET", urls.orders_v2(), headers=headers)
         if r.status_code != 200:
             return [r.text], False
 
         response = json.loads(r.text)
         return response["Orders"]
 
-    def get_account_info_v2(self):
-        account_info = dict()
-        self.update_token(token_type='api')
-        r = requests.get(urls.positions_v2(), headers=self.headers)
-        response = json.loads(r.text)
-        for account in response['accounts']:
-            positions = list()
-            valid_parse = True
-            for security_group in account["groupedPositions"]:
-                if security_group["groupName"] == "Cash":
-                    continue
-                for position in security_group["positions"]:
-                    if "symbol" not in position["symbolDetail"]:
-                        valid_parse = False
-                        break
-                    positions.append(
-                        Position(
-                            position["symbolDetail"]["symbol"],
-                            position["symbolDetail"]["description"],
-                            float(position["quantity"]),
-                            0 if "costDetail" not in position else float(position["costDetail"]["costBasisDetail"]["costBasis"]),
-                            0 if "priceDetail" not in position else float(position["priceDetail"]["marketValue"]),
-                            position["symbolDetail"]["schwabSecurityId"]
-                        )._as_dict()
-                    )
-            if not valid_parse:
-                continue
-            account_info[int(account["accountId"])] = Account(
-                account["accountId"],
-                positions,
-                account["totals"]["marketValue"],
-                account["totals"]["cashInvestments"],
-                account["totals"]["accountValue"],
-                account["totals"].get("costBasis", 0)
-            )._as_dict()
+    @instrumented
+    def get_account_info_v2(self, as_models=False, as_frame=False):
+        """
+        Returns a dictionary of accounts where the key is the account number, in the same
+        format as get_account_info(). With as_models, the accounts and positions are Account
+        and Position objects instead of plain dictionaries.
 
-        return account_info
+        With as_frame, returns a PortfolioFrame instead: the positions of all accounts as NumPy
+        columns, for totals per symbol or account without looping. Requires numpy.
+        """
+        headers = self._headers('api')
+        r = self._request("GET", urls.positions_v2(), headers=headers)
+        response = json.loads(r.text)
+        return _parse_account_info_v2(response, as_models, as_frame)
 
+    @instrumented
     def get_lot_info_v2(self, account_id, security_id):
         """
         Gets info on the lots for a given position.
@@ -759,15 +903,15 @@ class Schwab(SessionManager):
             'totalMarketValue': float
         }
         """
-        self.update_token("api")
-        self.headers["schwab-client-ids"] = str(account_id)
-        r = requests.get(
-            urls.lot_details_v2(), params={
-                "isLong": True, "itemissueid": security_id}, headers=self.headers)
+        headers = self._headers('api', **{"schwab-client-ids": str(account_id)})
+        r = self._request(
+            "GET", urls.lot_details_v2(), params={
+                "isLong": "True", "itemissueid": security_id}, headers=headers)
         is_success = r.status_code in [200, 207]
         return is_success, (is_success and json.loads(r.text) or r.text)
 
-    def get_options_chains_v2(self, ticker, greeks = False):
+    @instrumented
+    def get_options_chains_v2(self, ticker, greeks = False, as_chain = False):
         """
              Please do not abuse this API call. It is pulling all the option chains for a ticker.
              It's not reverse engineered to the point where you can narrow it down to a range of strike prices and expiration dates.
@@ -775,21 +919,300 @@ class Schwab(SessionManager):
 
              ticker (str) - ticker of the underlying security
              greeks (bool) - if greeks is true, you will also get the option greeks (Delta, Theta, Gamma etc... )
+             as_chain (bool) - if as_chain is true, return an OptionChain (NumPy columns with indexed
+                               strike, expiry and symbol lookups) instead of the raw JSON. Requires numpy.
         """
-        data = {
-            "Symbol":ticker,
-            "IncludeGreeks": "true" if greeks else "false"
-        }
-
-        full_url= urllib.parse.urljoin(urls.option_chains_v2(), '?' + urllib.parse.urlencode(data))
+        full_url = _option_chains_v2_url(ticker, greeks)
 
         # Adding this header seems to be necessary.
-        self.headers['schwab-resource-version'] = '1.0'
-
-        self.update_token(token_type='update')
-        r = requests.get(full_url, headers=self.headers)
+        headers = self._headers('update', **{'schwab-resource-version': '1.0'})
+        r = self._request("GET", full_url, headers=headers)
         if r.status_code != 200:
             return [r.text], False
 
         response = json.loads(r.text)
+        if as_chain:
+            return OptionChain(response)
         return response
+
+# The helpers below build the request bodies and parse the responses of the v2 API.
+# They are shared between Schwab and AsyncSchwab so both clients send exactly the same requests.
+
+_OPTION_INSTRUCTION_CODES = {
+    "BTO": "201",
+    "BTC": "202",
+    "STO": "203",
+    "STC": "204"
+}
+
+def _buy_sell_code_v2(side):
+    if side == "Buy":
+        return "49"
+    elif side == "Sell":
+        return "50"
+    raise Exception("side must be either Buy or Sell")
+
+def _format_limit_price(limit_price):
+    """
+    Handling formating of limit_price to avoid error.
+    Returns the (possibly rounded) limit price and a warning message, or None if it wasn't rounded.
+    """
+    # Checking how many decimal places are in limit_price.
+    decimal_places = len(str(float(limit_price)).split('.')[1])
+    limit_price_warning = None
+    # Max 2 decimal places allowed for price >= $1 and 4 decimal places for price < $1.
+    if limit_price >= 1:
+        if decimal_places > 2:
+            limit_price = round(limit_price,2)
+            limit_price_warning = f"For limit_price >= 1, Only 2 decimal places allowed. Rounded price_limit to: {limit_price}"
+    else:
+        if decimal_places > 4:
+            limit_price = round(limit_price,4)
+            limit_price_warning = f"For limit_price < 1, Only 4 decimal places allowed. Rounded price_limit to: {limit_price}"
+    return limit_price, limit_price_warning
+
+def _trade_v2_payload(ticker, buySellCode, qty, account_id, order_type, duration,
+                      limit_price, stop_price, primary_security_type, costBasis):
+    return {
+        "UserContext": {
+            "AccountId":str(account_id),
+            "AccountColor":0
+        },
+        "OrderStrategy": {
+            "PrimarySecurityType":primary_security_type,
+            "CostBasisRequest": {
+                "costBasisMethod":costBasis,
+                "defaultCostBasisMethod":costBasis
+            },
+            "OrderType":str(order_type),
+            "LimitPrice":str(limit_price),
+            "StopPrice":str(stop_price),
+            "Duration":str(duration),
+            "AllNoneIn":False,
+            "DoNotReduceIn":False,
+            "OrderStrategyType":1,
+            "OrderLegs":[
+                {
+                    "Quantity":str(qty),
+                    "LeavesQuantity":str(qty),
+                    "Instrument":{"Symbol":ticker},
+                    "SecurityType":primary_security_type,
+                    "Instruction":buySellCode
+                }
+                ]},
+        # OrderProcessingControl seems to map to verification vs actually placing an order.
+        "OrderProcessingControl":1
+    }
+
+def _option_trade_v2_payload(strategy, symbols, instruction_codes, quantities, account_id,
+                             order_type, duration, limit_price, stop_price):
+    return {
+          "UserContext": {
+            "AccountId": str(account_id),
+            "AccountColor": 0
+          },
+          "OrderStrategy": {
+            "PrimarySecurityType": 48,
+            "CostBasisRequest": None,
+            "OrderType": str(order_type),
+            "Duration": str(duration),
+            "LimitPrice": str(limit_price),
+            "StopPrice": str(stop_price),
+            "ReinvestDividend": False,
+            "MinimumQuantity": 0,
+            "AllNoneIn": False,
+            "DoNotReduceIn": False,
+            "Strategy": strategy,
+            "OrderStrategyType": 1,
+            "OrderLegs": [
+                {
+                    "Quantity": str(qty),
+                    "LeavesQuantity": str(qty),
+                    "Instrument": {"Symbol": symbol},
+                    "SecurityType": 48,
+                    "Instruction": instruction
+                } for qty, symbol, instruction in zip(quantities, symbols, instruction_codes)
+                ]},
+        # OrderProcessingControl seems to map to verification vs actually placing an order.
+        "OrderProcessingControl": 1
+    }
+
+def _apply_security_ids(data, response):
+    """
+    Copies the schwabSecurityId resolved during verification onto each leg of the order.
+    """
+    for leg, verified_leg in zip(data["OrderStrategy"]["OrderLegs"], response['orderStrategy']['orderLegs']):
+        if "schwabSecurityId" in verified_leg:
+            leg["Instrument"]["ItemIssueId"] = verified_leg["schwabSecurityId"]
+
+def _order_messages(response, limit_price_warning=None):
+    messages = list()
+    if limit_price_warning is not None:
+        messages.append(limit_price_warning)
+    if "orderMessages" in response["orderStrategy"] and response["orderStrategy"]["orderMessages"] is not None:
+        for message in response["orderStrategy"]["orderMessages"]:
+            messages.append(message["message"])
+    return messages
+
+def _verified_ticket(data, r, valid_return_codes, limit_price_warning=None):
+    """
+    Turns the response to a verification request into a VerifiedTicket.
+    """
+    if r.status_code != 200:
+        return VerifiedTicket(data, None, [r.text], False, limit_price_warning, valid_return_codes)
+
+    response = json.loads(r.text)
+
+    _apply_security_ids(data, response)
+    messages = _order_messages(response, limit_price_warning)
+    # TODO: This needs to be fleshed out and clarified.
+    success = response["orderStrategy"]["orderReturnCode"] in valid_return_codes
+    return VerifiedTicket(data, response, messages, success, limit_price_warning, valid_return_codes)
+
+def _place_payload(ticket, affirm_order):
+    """
+    Returns the payload that actually places a verified order: the same POST request, but for real
+    this time. The ticket's payload is left as is, so the ticket can be placed again after a failure.
+    """
+    if not ticket.success:
+        raise ValueError("Only successfully verified tickets can be placed: {}".format(ticket.messages))
+    data = copy.deepcopy(ticket.payload)
+    data["UserContext"]["CustomerId"] = 0
+    data["OrderStrategy"]["OrderId"] = int(ticket.order_id)
+    data["OrderProcessingControl"] = 2
+    if affirm_order:
+        data["OrderStrategy"]["OrderAffrmIn"] = True
+    return data
+
+def _placement_result(r, ticket, valid_return_codes=None):
+    if r.status_code != 200:
+        return [r.text], False
+
+    response = json.loads(r.text)
+
+    messages = _order_messages(response, ticket.limit_price_warning)
+    if valid_return_codes is None:
+        valid_return_codes = ticket.valid_return_codes
+    return messages, response["orderStrategy"]["orderReturnCode"] in valid_return_codes
+
+def _orders_by_account(orders):
+    """
+    Returns the indexes of orders grouped by account, each group in the original order.
+    """
+    groups = dict()
+    for i, order in enumerate(orders):
+        groups.setdefault(str(order[0]), []).append(i)
+    return list(groups.values())
+
+def _trade_result(order, messages, success, error, started, elapsed):
+    account_id, ticker, side, qty = order
+    return {
+        "account_id": account_id,
+        "ticker": ticker,
+        "side": side,
+        "qty": qty,
+        "messages": messages,
+        "success": success,
+        "error": error,
+        "started": started,
+        "elapsed": elapsed,
+    }
+
+def _cancel_order_v2_payload(order_id, instrument_type, order_management_system):
+    return {
+        "TypeOfOrder": 0,
+        "OrderManagementSystem": order_management_system,
+        "Orders": [{
+            "OrderId": order_id,
+            "IsLiveOrder": True,
+            "InstrumentType": instrument_type,
+            "CancelOrderLegs": [{}],
+            }],
+        "ContingentIdToCancel": 0,
+        "OrderIdToCancel": 0,
+        "OrderProcessingControl": 1,
+        "ConfirmCancelOrderId": 0,
+        }
+
+def _quote_v2_payload(tickers):
+    return {
+        "Symbols":tickers,
+        "IsIra":False,
+        "AccountRegType":"S3"
+    }
+
+def _transaction_history_v2_payload(account_id, time_frame="All"):
+    return {
+        "timeFrame": time_frame,
+        "selectedTransactionTypes": [
+            "Adjustments",
+            "AtmActivity",
+            "BillPay",
+            "CorporateActions",
+            "Checks",
+            "Deposits",
+            "DividendsAndCapitalGains",
+            "ElectronicTransfers",
+            "Fees",
+            "Interest",
+            "Misc",
+            "SecurityTransfers",
+            "Taxes",
+            "Trades",
+            "VisaDebitCard",
+            "Withdrawals"
+        ],
+        "exportType": "Json",
+        "selectedAccountId": str(account_id),
+        "sortColumn": "Date",
+        "sortDirection": "Descending"
+    }
+
+def _option_chains_v2_url(ticker, greeks):
+    data = {
+        "Symbol":ticker,
+        "IncludeGreeks": "true" if greeks else "false"
+    }
+    return urllib.parse.urljoin(urls.option_chains_v2(), '?' + urllib.parse.urlencode(data))
+
+def _holdings_v2(response):
+    """
+    Yields (account id, account fields, list of position fields) for each account of a
+    positions_v2 response, with the fields in the order of Account and Position.
+    """
+    for account in response['accounts']:
+        positions = list()
+        valid_parse = True
+        for security_group in account["groupedPositions"]:
+            if security_group["groupName"] == "Cash":
+                continue
+            for position in security_group["positions"]:
+                if "symbol" not in position["symbolDetail"]:
+                    valid_parse = False
+                    break
+                positions.append((
+                    position["symbolDetail"]["symbol"],
+                    position["symbolDetail"]["description"],
+                    float(position["quantity"]),
+                    0 if "costDetail" not in position else float(position["costDetail"]["costBasisDetail"]["costBasis"]),
+                    0 if "priceDetail" not in position else float(position["priceDetail"]["marketValue"]),
+                    position["symbolDetail"]["schwabSecurityId"]
+                ))
+        if not valid_parse:
+            continue
+        yield account["accountId"], (
+            account["totals"]["marketValue"],
+            account["totals"]["cashInvestments"],
+            account["totals"]["accountValue"],
+            account["totals"].get("costBasis", 0)
+        ), positions
+
+def _parse_account_info_v2(response, as_models=False, as_frame=False):
+    if as_frame:
+        return PortfolioFrame._from_records(_holdings_v2(response))
+    account_info = dict()
+    for account_id, account_fields, positions in _holdings_v2(response):
+        positions = [_build(Position, as_models, *fields) for fields in positions]
+        account_info[int(account_id)] = _build(Account, as_models, account_id, positions, *account_fields)
+
+    return account_info
@@ -0,0 +1,292 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from .async_schwab import AsyncSchwab
+from .browser_pool import BrowserPool
+from .schwab import Schwab
+
+
+def _file_name(key):
+    return re.sub(r"[^\w.-]", "_", str(key))
+
+
+class SessionPool:
+    client_class = Schwab
+    _key_lock_class = threading.Lock
+
+    def __init__(self, max_sessions=16, idle_timeout=None, session_dir=None, browser_pool=None, **kwargs):
+        """
+        Serves many Schwab logins from one process. Each set of credentials is registered under
+        a key and gets its own Schwab client, created and logged in the first time it's used.
+        All the clients share one browser (for logging in) and one set of connection pools:
+
+            pool = SessionPool(max_sessions=20, session_dir="sessions")
+            pool.add("alice", username, password, totp_secret)
+            pool.get("alice").quote_v2(["PFE"])
+            pool.call("alice", "orders_v2")
+
+        To bound memory, at most max_sessions clients are kept; the least recently used ones
+        are dropped beyond that, as well as the ones unused for idle_timeout seconds. A dropped
+        client is recreated the next time its key is used. With a session_dir (or a
+        session_cache per key), that only restores the saved session, without a new login.
+
+        :type max_sessions: int
+        :param max_sessions: Maximum number of clients kept at once
+
+        :type idle_timeout: float
+        :param idle_timeout: Drop the clients that haven't been used for this many seconds
+
+        :type session_dir: str
+        :param session_dir: Directory in which to save the session of each key, as <key>.json
+
+        :type browser_pool: BrowserPool
+        :param browser_pool: The browser used to log in. By default, the pool starts a
+            BrowserPool of size 1 when the first client is created, and closes it in close().
+
+        The other keyword arguments (transport, pool_maxsize, http2, refresh_tokens,
+        quote_cache, ...) are passed to every client. Clients share the transport of the first
+        one if no transport is given.
+        """
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.session_dir = session_dir
+        if session_dir is not None:
+            os.makedirs(session_dir, exist_ok=True)
+        self.browser_pool = browser_pool
+        self._owns_browser_pool = False
+        self.transport = kwargs.pop("transport", None)
+        self._owns_transport = self.transport is None
+        self.client_kwargs = kwargs
+        # key -> (username, password, totp_secret, session_cache)
+        self._credentials = dict()
+        # key -> (client, last use as time.monotonic()), least recently used first
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        # one lock per key, so that a key is only logged in once at a time
+        self._key_locks = dict()
+        self.evictions = 0
+
+    def add(self, key, username, password, totp_secret, session_cache=None):
+        """
+        Registers credentials under key. Nothing is done until the key is used. Adding a key
+        again replaces its credentials (and drops its current client).
+
+        :type session_cache: str or SessionStore
+        :param session_cache: Where to save the session of this key. Defaults to a file in
+            session_dir, if set.
+        """
+        if session_cache is None and self.session_dir is not None:
+            session_cache = os.path.join(self.session_dir, _file_name(key) + ".json")
+        with self._lock:
+            self._credentials[key] = (username, password, totp_secret, session_cache)
+            if key not in self._key_locks:
+                self._key_locks[key] = self._key_lock_class()
+        self._release(self._drop(key))
+
+    def remove(self, key):
+        """
+        Forgets the credentials of key and drops its client.
+        """
+        with self._lock:
+            self._credentials.pop(key, None)
+            self._key_locks.pop(key, None)
+        self._release(self._drop(key))
+
+    def keys(self):
+        return list(self._credentials)
+
+    def __contains__(self, key):
+        return key in self._credentials
+
+    def get(self, key):
+        """
+        :returns: The logged in client of key, creating it (and logging in) if needed
+        """
+        client = self._checkout(key)
+        if client is not None:
+            return client
+        with self._key_lock(key):
+            # Someone else may have logged in while we were waiting.
+            client = self._checkout(key)
+            if client is None:
+                username, password, totp_secret, session_cache = self._credentials_of(key)
+                client = self._new_client(session_cache)
+                client.login(username, password, totp_secret)
+                self._checkin(key, client)
+        return client
+
+    def call(self, key, method, *args, **kwargs):
+        """
+        Calls method (e.g. "quote_v2") on the client of key.
+        """
+        return getattr(self.get(key), method)(*args, **kwargs)
+
+    def evict_idle(self):
+        """
+        Drops the clients over max_sessions or unused for idle_timeout seconds. This also
+        happens whenever a new client is created.
+
+        :returns: Number of clients dropped
+        """
+        with self._lock:
+            evicted = self._evictable()
+        for client in evicted:
+            self._release(client)
+        return len(evicted)
+
+    def stats(self):
+        return {
+            "credentials": len(self._credentials),
+            "sessions": len(self._sessions),
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        """
+        Drops every client and closes the shared connection pools and browser, if the pool
+        created them.
+        """
+        for client in self._drop_all():
+            self._release(client)
+        if self._owns_transport and self.transport is not None:
+            self.transport.close()
+        self._close_browser_pool()
+
+    def _close_browser_pool(self):
+        if self._owns_browser_pool:
+            self.browser_pool.close()
+
+    def _key_lock(self, key):
+        with self._lock:
+            if key not in self._key_locks:
+                raise KeyError("Unknown key: {}".format(key))
+            return self._key_locks[key]
+
+    def _credentials_of(self, key):
+        with self._lock:
+            if key not in self._credentials:
+                raise KeyError("Unknown key: {}".format(key))
+            return self._credentials[key]
+
+    def _checkout(self, key):
+        with self._lock:
+            if key not in self._credentials:
+                raise KeyError("Unknown key: {}".format(key))
+            if key not in self._sessions:
+                return None
+            client, _ = self._sessions.pop(key)
+            self._sessions[key] = (client, time.monotonic())
+            return client
+
+    def _checkin(self, key, client):
+        with self._lock:
+            if key in self._credentials:
+                self._sessions[key] = (client, time.monotonic())
+                evicted = self._evictable()
+            else:
+                # removed while logging in
+                evicted = [client]
+        for client in evicted:
+            self._release(client)
+
+    def _evictable(self):
+        # Needs self._lock. The sessions are ordered by last use, so only the oldest ones
+        # need to be looked at.
+        evicted = []
+        now = time.monotonic()
+        while self._sessions:
+            key, (client, used) = next(iter(self._sessions.items()))
+            idle = self.idle_timeout is not None and now - used >= self.idle_timeout
+            if len(self._sessions) <= self.max_sessions and not idle:
+                break
+            del self._sessions[key]
+            evicted.append(client)
+        self.evictions += len(evicted)
+        return evicted
+
+    def _drop(self, key):
+        with self._lock:
+            client, _ = self._sessions.pop(key, (None, None))
+        return client
+
+    def _drop_all(self):
+        with self._lock:
+            clients = [client for client, _ in self._sessions.values()]
+            self._sessions.clear()
+        return clients
+
+    def _new_client(self, session_cache):
+        with self._lock:
+            if self.browser_pool is None:
+                self.browser_pool = BrowserPool(
+                    headless=self.client_kwargs.get("headless", True),
+                    browserType=self.client_kwargs.get("browserType", "firefox")
+                )
+                self._owns_browser_pool = True
+            kwargs = dict(self.client_kwargs, browser_pool=self.browser_pool, transport=self.transport)
+            client = self.client_class(session_cache, **kwargs)
+            self.transport = client.transport
+        return client
+
+    def _release(self, client):
+        """
+        Stops the background work of a dropped client. Its connection pools are shared, so
+        they stay open, and a caller still holding the client can keep using it.
+        """
+        if client is None:
+            return
+        client._stop_refresher.set()
+        for poller in client._quote_pollers.values():
+            poller.close()
+        # A caller still holding the client gets new pollers if it subscribes again
+        client._quote_pollers.clear()
+
+
+class AsyncSessionPool(SessionPool):
+    """
+    Same as SessionPool for AsyncSchwab clients; get(), call() and close() are coroutines:
+
+        pool = AsyncSessionPool(max_sessions=20, session_dir="sessions")
+        pool.add("alice", username, password, totp_secret)
+        quotes = await pool.call("alice", "quote_v2", ["PFE"])
+    """
+    client_class = AsyncSchwab
+    _key_lock_class = asyncio.Lock
+
+    async def get(self, key):
+        client = self._checkout(key)
+        if client is not None:
+            return client
+        async with self._key_lock(key):
+            client = self._checkout(key)
+            if client is None:
+                username, password, totp_secret, session_cache = self._credentials_of(key)
+                client = self._new_client(session_cache)
+                await client.login(username, password, totp_secret)
+                self._checkin(key, client)
+        return client
+
+    async def call(self, key, method, *args, **kwargs):
+        return await getattr(await self.get(key), method)(*args, **kwargs)
+
+    async def close(self):
+        for client in self._drop_all():
+            self._release(client)
+        if self._owns_transport and self.transport is not None:
+            await self.transport.aclose()
+        self._close_browser_pool()
+
+    def _release(self, client):
+        if client is None:
+            return
+        if client._async_refresher is not None:
+            client._async_refresher.cancel()
+        for task in client._quote_refreshes:
+            task.cancel()
+        for poller in client._quote_pollers.values():
+            poller.close()
+        client._quote_pollers.clear()
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locking on Windows; writes are still atomic.
+    fcntl = None
+
+
+class SessionStore:
+    """
+    Where a SessionManager keeps its cookies, headers and credential hashes between runs.
+
+    Subclasses implement _read() and _write(). The base class takes care of skipping writes
+    when nothing changed and of the advisory lock that lets several processes share one
+    session without each of them logging in.
+    """
+    def __init__(self, lock_path):
+        self.lock_path = lock_path
+        # digest of the session we last read or wrote
+        self.digest = None
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file = None
+
+    def load(self):
+        """
+        :rtype: dict
+        :returns: The stored session, or None if there isn't one
+        """
+        data = self._read()
+        if data is None:
+            return None
+        self.digest = _digest(data)
+        return json.loads(data)
+
+    def save(self, session):
+        """
+        Stores the session, unless it is identical to what was last read or written.
+
+        :rtype: boolean
+        :returns: True if the session was written
+        """
+        data = json.dumps(session, sort_keys=True)
+        digest = _digest(data)
+        if digest == self.digest:
+            return False
+        with self.lock():
+            self._write(data, digest)
+        self.digest = digest
+        return True
+
+    def changed(self):
+        """
+        :rtype: boolean
+        :returns: True if another process stored a different session since we last read or wrote it
+        """
+        data = self._read()
+        return data is not None and _digest(data) != self.digest
+
+    @contextmanager
+    def lock(self):
+        """
+        Holds an exclusive advisory lock shared by every process using this store. The lock is
+        re-entrant within a process.
+        """
+        with self._lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                self._lock_file = open(self.lock_path, 'a')
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and self._lock_file is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def _read(self):
+        raise NotImplementedError
+
+    def _write(self, data, digest):
+        raise NotImplementedError
+
+
+class FileSessionStore(SessionStore):
+    def __init__(self, path):
+        """
+        Stores the session as JSON in a single file. The file is replaced atomically, so
+        readers never need a lock and never see a partial write.
+
+        :type path: str
+        :param path: Path to the session file
+        """
+        super(FileSessionStore, self).__init__(path + '.lock')
+        self.path = path
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, data, digest):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.session-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path, key='default'):
+        """
+        Stores the session in a SQLite database (in WAL mode, so any number of processes can
+        read while one writes). Several sessions can share a database using different keys.
+
+        :type path: str
+        :param path: Path to the database file
+
+        :type key: str
+        :param key: Name of the session in the database
+        """
+        super(SQLiteSessionStore, self).__init__(path + '.lock')
+        self.path = path
+        self.key = key
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "key TEXT PRIMARY KEY, data TEXT NOT NULL, digest TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _read(self):
+        with self._connect() as db:
+            row = db.execute("SELECT data FROM sessions WHERE key = ?", (self.key,)).fetchone()
+        return row[0] if row else None
+
+    def changed(self):
+        # Compare digests without reading the whole session.
+        with self._connect() as db:
+            row = db.execute("SELECT digest FROM sessions WHERE key = ?", (self.key,)).fetchone()
+        return row is not None and row[0] != self.digest
+
+    def _write(self, data, digest):
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO sessions (key, data, digest, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET data = excluded.data, digest = excluded.digest, "
+                "updated_at = excluded.updated_at",
+                (self.key, data, digest, time.time())
+            )
+
+
+def session_store(session_cache):
+    """
+    Returns the SessionStore for the session_cache argument of Schwab: None, a SessionStore,
+    or a path. Paths ending in .db, .sqlite or .sqlite3 use SQLite, anything else a JSON file.
+    An empty path disables caching, like None.
+    """
+    if isinstance(session_cache, SessionStore):
+        return session_cache
+    if not session_cache:
+        return None
+    if str(session_cache).endswith(('.db', '.sqlite', '.sqlite3')):
+        return SQLiteSessionStore(str(session_cache))
+    return FileSessionStore(str(session_cache))
+
+
+def _digest(data):
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
@@ -0,0 +1,234 @@
+import asyncio
+import threading
+import time
+import urllib.parse
+
+from . import urls
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        """
+        Allows `rate` requests per second on average, and bursts of up to `burst` requests.
+        Safe to share between threads; acquire_async() can be used from coroutines.
+
+        :type rate: float
+        :param rate: Requests per second
+
+        :type burst: int
+        :param burst: Size of the bucket. Defaults to rate (one second worth of requests).
+        """
+        _check_rate("rate", rate)
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        # number of callers waiting for a token
+        self.waiting = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a request is allowed.
+        """
+        wait = self._take()
+        if wait <= 0:
+            return
+        self._wait(1)
+        try:
+            while wait > 0:
+                time.sleep(wait)
+                wait = self._take()
+        finally:
+            self._wait(-1)
+
+    async def acquire_async(self):
+        wait = self._take()
+        if wait <= 0:
+            return
+        self._wait(1)
+        try:
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self._take()
+        finally:
+            self._wait(-1)
+
+    def _wait(self, change):
+        with self._lock:
+            self.waiting += change
+
+    def _take(self):
+        """
+        Takes a token if there is one.
+
+        :returns: 0 if a token was taken, otherwise how long to wait for one in seconds
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+# Responses telling the client to slow down
+THROTTLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class _AdaptiveBucket(TokenBucket):
+    def __init__(self, rate, burst, min_rate):
+        super().__init__(rate, burst)
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.requests = 0
+        self.throttled = 0
+        self._last_decrease = 0
+
+    def stats(self):
+        return {
+            "rate": self.rate,
+            "max_rate": self.max_rate,
+            "waiting": self.waiting,
+            "requests": self.requests,
+            "throttled": self.throttled,
+        }
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, rate=10, burst=None, min_rate=0.5, decrease=0.5, increase=0.05,
+                 host_rate=None, rates=None):
+        """
+        Token buckets for every request sent by a client: one per endpoint (the function of
+        urls.py the URL comes from) and optionally one per host. Each bucket starts at its
+        maximum rate, is cut by `decrease` whenever the gateway answers 429 or 5xx (at most
+        once a second, and waiting for Retry-After if given), and grows back by `increase`
+        times its maximum rate with every other response:
+
+            limiter = AdaptiveRateLimiter(rate=10, rates={"ticker_quotes_v2": 20})
+            api = Schwab(rate_limit=limiter)
+            ...
+            limiter.stats()["ticker_quotes_v2"]   # rate, max_rate, waiting, requests, throttled
+
+        Safe to share between clients (including AsyncSchwab ones), which then share the limits.
+
+        :type rate: float
+        :param rate: Maximum requests per second to each endpoint
+
+        :type burst: int
+        :param burst: Size of each bucket. Defaults to one second worth of requests.
+
+        :type min_rate: float
+        :param min_rate: The rate is never cut below this many requests per second
+
+        :type decrease: float
+        :param decrease: Factor applied to the rate after a 429 or 5xx response
+
+        :type increase: float
+        :param increase: Fraction of the maximum rate given back after each successful response
+
+        :type host_rate: float
+        :param host_rate: Maximum requests per second to each host, across its endpoints
+
+        :type rates: dict
+        :param rates: Maximum rate of specific endpoints (e.g. {"ticker_quotes_v2": 20})
+
+        Every rate must be positive; to turn rate limiting off, pass rate_limit=None to the client.
+        """
+        _check_rate("rate", rate)
+        _check_rate("min_rate", min_rate)
+        if host_rate is not None:
+            _check_rate("host_rate", host_rate)
+        for endpoint, endpoint_rate in (rates or {}).items():
+            _check_rate("rates[{!r}]".format(endpoint), endpoint_rate)
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.decrease = decrease
+        self.increase = increase
+        self.host_rate = host_rate
+        self.rates = dict(rates or {})
+        self._buckets = dict()
+        self._lock = threading.Lock()
+
+    def acquire(self, url):
+        """
+        Blocks until a request to url is allowed.
+        """
+        for bucket in self._buckets_for(url):
+            bucket.acquire()
+
+    async def acquire_async(self, url):
+        for bucket in self._buckets_for(url):
+            await bucket.acquire_async()
+
+    def record(self, url, status_code, headers=None):
+        """
+        Adjusts the rates of url's buckets to the response it got.
+        """
+        for bucket in self._buckets_for(url):
+            with bucket._lock:
+                bucket.requests += 1
+                if status_code in THROTTLE_STATUS_CODES:
+                    self._throttle(bucket, _retry_after(headers))
+                else:
+                    bucket.rate = min(bucket.max_rate, bucket.rate + bucket.max_rate * self.increase)
+
+    def stats(self):
+        """
+        :returns: dict of endpoint (or "host:" + host) to the rate, max_rate, number of
+            waiting callers, requests and throttled responses of its bucket
+        """
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {name: bucket.stats() for name, bucket in buckets.items()}
+
+    def _throttle(self, bucket, retry_after):
+        # Needs bucket._lock
+        bucket.throttled += 1
+        now = time.monotonic()
+        # Requests already in flight when the gateway pushed back shouldn't cut the rate again.
+        if now - bucket._last_decrease >= 1:
+            bucket._last_decrease = now
+            bucket.rate = max(bucket.min_rate, bucket.rate * self.decrease)
+        if retry_after:
+            # Owing tokens makes everyone wait until the gateway is ready again.
+            bucket.tokens = min(bucket.tokens, 1 - retry_after * bucket.rate)
+
+    def _buckets_for(self, url):
+        names = [urls.endpoint_name(url)]
+        if self.host_rate is not None:
+            names.append("host:" + urllib.parse.urlsplit(url).netloc)
+        with self._lock:
+            buckets = []
+            for name in names:
+                if name not in self._buckets:
+                    rate = self.host_rate if name.startswith("host:") else self.rates.get(name, self.rate)
+                    self._buckets[name] = _AdaptiveBucket(rate, self.burst, self.min_rate)
+                buckets.append(self._buckets[name])
+            return buckets
+
+
+def _check_rate(name, rate):
+    if not rate > 0:
+        raise ValueError("{} must be a positive number of requests per second, not {!r}".format(name, rate))
+
+
+def _retry_after(headers):
+    try:
+        return max(0.0, float(headers.get("retry-after")))
+    except (AttributeError, TypeError, ValueError):
+        # Missing, or an HTTP date, which the gateway doesn't seem to send
+        return 0
+
+
+def rate_limiter(rate_limit):
+    """
+    Builds the AdaptiveRateLimiter of a client from its rate_limit argument. None, 0 and False
+    turn rate limiting off.
+    """
+    if not rate_limit or isinstance(rate_limit, AdaptiveRateLimiter):
+        return rate_limit or None
+    return AdaptiveRateLimiter(rate=rate_limit)
@@ -0,0 +1,316 @@
+import datetime
+import hashlib
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from .schwab import TransactionHistoryError
+
+
+# Experimental: asking for a shorter time frame than "All" once we have most of the history.
+# If Schwab rejects it, the sync falls back to "All".
+RECENT_TIME_FRAME = "Last6Months"
+RECENT_TIME_FRAME_DAYS = 150
+
+_COLUMNS = ("date", "action", "symbol", "description", "quantity", "price", "fees", "amount")
+
+# What identifies a transaction when the export doesn't give it an id. The description, fees
+# and status of a pending transaction may change once it settles, so they are left out.
+_IDENTITY_COLUMNS = ("date", "action", "symbol", "quantity", "price", "amount")
+_ID_FIELDS = ("TransactionId", "Id")
+
+# Version 1 keys rows on _row_hash instead of a hash of the whole transaction.
+_SCHEMA_VERSION = 1
+
+
+def _parse_date(value):
+    """
+    Converts the MM/DD/YYYY dates of the export (sometimes "MM/DD/YYYY as of MM/DD/YYYY") to
+    YYYY-MM-DD, which sorts correctly in SQLite.
+    """
+    try:
+        return datetime.datetime.strptime(str(value).split()[0], "%m/%d/%Y").date().isoformat()
+    except (ValueError, IndexError):
+        return None
+
+
+def _parse_number(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace("$", "").replace(",", ""))
+    except ValueError:
+        return None
+
+
+def _row(transaction):
+    return {
+        "date": _parse_date(transaction.get("Date")),
+        "action": transaction.get("Action"),
+        "symbol": transaction.get("Symbol") or None,
+        "description": transaction.get("Description"),
+        "quantity": _parse_number(transaction.get("Quantity")),
+        "price": _parse_number(transaction.get("Price")),
+        "fees": _parse_number(transaction.get("Fees & Comm")),
+        "amount": _parse_number(transaction.get("Amount")),
+    }
+
+
+def _row_hash(transaction, row):
+    for field in _ID_FIELDS:
+        if transaction.get(field) not in (None, ""):
+            key = "id:{}".format(transaction[field])
+            break
+    else:
+        key = json.dumps([row[column] for column in _IDENTITY_COLUMNS])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _rekey(db):
+    """
+    Moves the rows of a database written before _SCHEMA_VERSION 1 to the keys of _row_hash.
+    """
+    occurrences = dict()
+    updates = []
+    for rowid, account_id, raw in db.execute("SELECT rowid, account_id, raw FROM transactions ORDER BY rowid"):
+        transaction = json.loads(raw)
+        row_hash = _row_hash(transaction, _row(transaction))
+        occurrence = occurrences.get((account_id, row_hash), 0)
+        occurrences[(account_id, row_hash)] = occurrence + 1
+        updates.append((row_hash, occurrence, rowid))
+    # The old keys are hashes of the whole transaction, so they can't collide with the new ones
+    db.executemany("UPDATE transactions SET row_hash = ?, occurrence = ? WHERE rowid = ?", updates)
+
+
+class TransactionStore:
+    def __init__(self, path):
+        """
+        Keeps the transaction history of accounts in a SQLite database, indexed by date, symbol
+        and action, and brings it up to date without reprocessing what is already stored:
+
+            store = TransactionStore("transactions.db")
+            store.sync(api, account_id)
+            store.query(account_id, symbol="PFE", start="2024-01-01")
+
+        Each account has a high-water mark: the date of its newest stored transaction. A sync
+        only merges the transactions from that date on, so merging the same export twice
+        never creates duplicates. Transactions are identified by their id if the export has
+        one, otherwise by their date, action, symbol, quantity, price and amount (identical
+        transactions on the same day are told apart by their number of occurrences). A
+        transaction merged again with other details, e.g. once it has settled, is updated.
+
+        :type path: str
+        :param path: Path to the database file
+        """
+        self.path = path
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS transactions ("
+                "account_id TEXT NOT NULL, row_hash TEXT NOT NULL, occurrence INTEGER NOT NULL, "
+                "date TEXT, action TEXT, symbol TEXT, description TEXT, quantity REAL, price REAL, "
+                "fees REAL, amount REAL, raw TEXT NOT NULL, "
+                "PRIMARY KEY (account_id, row_hash, occurrence))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS transactions_date ON transactions (account_id, date)")
+            db.execute("CREATE INDEX IF NOT EXISTS transactions_symbol ON transactions (account_id, symbol, date)")
+            db.execute("CREATE INDEX IF NOT EXISTS transactions_action ON transactions (account_id, action, date)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state ("
+                "account_id TEXT PRIMARY KEY, high_water_mark TEXT, synced_at REAL NOT NULL)"
+            )
+            if db.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+                _rekey(db)
+                db.execute("PRAGMA user_version = {}".format(_SCHEMA_VERSION))
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def high_water_mark(self, account_id):
+        """
+        :returns: The date (YYYY-MM-DD) of the newest stored transaction of the account, or None
+        """
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT high_water_mark FROM sync_state WHERE account_id = ?", (str(account_id),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def sync(self, api, account_id):
+        """
+        Fetches the account's transactions with api (a logged in Schwab) and stores the new ones.
+        The export is streamed, so memory use doesn't grow with the length of the history.
+        If Schwab rejects the shorter RECENT_TIME_FRAME, the whole history is fetched instead.
+
+        :returns: Number of transactions added
+        """
+        time_frame = self._time_frame(account_id)
+        try:
+            return self.merge(account_id, api.iter_transaction_history_v2(account_id, time_frame=time_frame))
+        except TransactionHistoryError as e:
+            if time_frame == "All" or not _time_frame_rejected(e):
+                raise
+        return self.merge(account_id, api.iter_transaction_history_v2(account_id))
+
+    async def sync_async(self, api, account_id):
+        """
+        Same as sync() with an AsyncSchwab.
+        """
+        time_frame = self._time_frame(account_id)
+        try:
+            return await self.merge_async(account_id, api.iter_transaction_history_v2(account_id, time_frame=time_frame))
+        except TransactionHistoryError as e:
+            if time_frame == "All" or not _time_frame_rejected(e):
+                raise
+        return await self.merge_async(account_id, api.iter_transaction_history_v2(account_id))
+
+    def merge(self, account_id, transactions, batch_size=1000):
+        """
+        Stores the transactions (the BrokerageTransactions of get_transaction_history_v2, or
+        any iterable of them) dated on or after the account's high-water mark. Merging the same
+        transactions again only updates the ones whose details changed.
+
+        The transactions are written in batches of batch_size as they are read. The high-water
+        mark only moves once all of them are stored, so an interrupted merge is redone on the
+        next sync.
+
+        :returns: Number of transactions added
+        """
+        merger = _Merger(self, account_id, batch_size)
+        for transaction in transactions:
+            merger.add(transaction)
+        return merger.finish()
+
+    async def merge_async(self, account_id, transactions, batch_size=1000):
+        """
+        Same as merge() for an async iterable of transactions.
+        """
+        merger = _Merger(self, account_id, batch_size)
+        async for transaction in transactions:
+            merger.add(transaction)
+        return merger.finish()
+
+    def _upsert(self, rows):
+        """
+        Inserts the rows, or updates the stored ones with the same key.
+
+        :returns: Number of rows inserted
+        """
+        if not rows:
+            return 0
+        with self._connect() as db:
+            before = db.total_changes
+            db.executemany(
+                "INSERT OR IGNORE INTO transactions (account_id, row_hash, occurrence, {}, raw) "
+                "VALUES (?, ?, ?, {}, ?)".format(", ".join(_COLUMNS), ", ".join("?" * len(_COLUMNS))),
+                rows
+            )
+            inserted = db.total_changes - before
+            db.executemany(
+                "UPDATE transactions SET {}, raw = ? "
+                "WHERE account_id = ? AND row_hash = ? AND occurrence = ? AND raw != ?".format(
+                    ", ".join("{} = ?".format(column) for column in _COLUMNS)
+                ),
+                [row[3:] + row[:3] + row[-1:] for row in rows]
+            )
+            return inserted
+
+    def _set_high_water_mark(self, account_id, high_water_mark):
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO sync_state (account_id, high_water_mark, synced_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(account_id) DO UPDATE SET high_water_mark = excluded.high_water_mark, "
+                "synced_at = excluded.synced_at",
+                (account_id, high_water_mark, time.time())
+            )
+
+    def query(self, account_id=None, symbol=None, start=None, end=None, action=None):
+        """
+        Returns the stored transactions matching every given filter, newest first, as
+        dictionaries with the columns date, action, symbol, description, quantity, price,
+        fees, amount, account_id and raw (the transaction as exported by Schwab).
+
+        start and end are inclusive YYYY-MM-DD dates (or datetime.date).
+        """
+        conditions = []
+        params = []
+        for column, value in (("account_id", account_id), ("symbol", symbol), ("action", action)):
+            if value is not None:
+                conditions.append("{} = ?".format(column))
+                params.append(str(value))
+        if start is not None:
+            conditions.append("date >= ?")
+            params.append(str(start))
+        if end is not None:
+            conditions.append("date <= ?")
+            params.append(str(end))
+        sql = "SELECT account_id, {}, raw FROM transactions".format(", ".join(_COLUMNS))
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY date DESC"
+        with self._connect() as db:
+            rows = db.execute(sql, params).fetchall()
+        transactions = []
+        for row in rows:
+            transaction = dict(row)
+            transaction["raw"] = json.loads(transaction["raw"])
+            transactions.append(transaction)
+        return transactions
+
+    def _time_frame(self, account_id):
+        high_water_mark = self.high_water_mark(account_id)
+        if high_water_mark is None:
+            return "All"
+        age = datetime.date.today() - datetime.date.fromisoformat(high_water_mark)
+        return RECENT_TIME_FRAME if age.days <= RECENT_TIME_FRAME_DAYS else "All"
+
+
+def _time_frame_rejected(error):
+    # A client error other than an expired session or throttling means the time frame itself
+    # was refused.
+    return 400 <= error.status_code < 500 and error.status_code not in (401, 403, 429)
+
+
+class _Merger:
+    def __init__(self, store, account_id, batch_size):
+        self.store = store
+        self.account_id = str(account_id)
+        self.batch_size = batch_size
+        self.high_water_mark = store.high_water_mark(self.account_id)
+        self.newest = self.high_water_mark
+        # Identical transactions always have the same date, so counting occurrences per hash
+        # gives the same numbers whatever part of the history is merged.
+        self.occurrences = dict()
+        self.rows = []
+        self.added = 0
+
+    def add(self, transaction):
+        row = _row(transaction)
+        if self.high_water_mark is not None and (row["date"] is None or row["date"] < self.high_water_mark):
+            return
+        raw = json.dumps(transaction, sort_keys=True)
+        row_hash = _row_hash(transaction, row)
+        occurrence = self.occurrences.get(row_hash, 0)
+        self.occurrences[row_hash] = occurrence + 1
+        self.rows.append((self.account_id, row_hash, occurrence) + tuple(row[column] for column in _COLUMNS) + (raw,))
+        if row["date"] is not None and (self.newest is None or row["date"] > self.newest):
+            self.newest = row["date"]
+        if len(self.rows) >= self.batch_size:
+            self.added += self.store._upsert(self.rows)
+            self.rows = []
+
+    def finish(self):
+        self.added += self.store._upsert(self.rows)
+        self.rows = []
+        self.store._set_high_water_mark(self.account_id, self.newest)
+        return self.added
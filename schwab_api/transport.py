@@ -0,0 +1,155 @@
+import http.cookiejar
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class _RejectAllCookies(http.cookiejar.DefaultCookiePolicy):
+    """
+    The gateway (v2) calls authenticate with a bearer token only, so they never send or keep cookies.
+    """
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+class Transport:
+    def __init__(self, pool_connections=10, pool_maxsize=10, http2=False, timeout=None):
+        """
+        Owns the keep-alive connection pools used for every request made by Schwab and
+        AsyncSchwab. A single Transport can be shared by any number of clients, in which case
+        they also share their connections (cookies always stay with each client's session).
+
+        :type pool_connections: int
+        :param pool_connections: Number of hosts to keep a connection pool for
+
+        :type pool_maxsize: int
+        :param pool_maxsize: Maximum number of connections kept alive per host
+
+        :type http2: boolean
+        :param http2: Multiplex requests over HTTP/2 connections. Requires httpx[http2]
+            (pip install schwab-api[http2])
+
+        :type timeout: float
+        :param timeout: Timeout in seconds for each request, or None to wait forever
+        """
+        if http2 and httpx is None:
+            raise ImportError("http2 requires httpx; install it with `pip install schwab-api[http2]`")
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.http2 = http2
+        self.timeout = timeout
+
+        self._adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self._anonymous = requests.Session()
+        self._anonymous.cookies.set_policy(_RejectAllCookies())
+        self._mount(self._anonymous)
+
+        # httpx pools, created on first use
+        self._pool = None
+        self._async_pool = None
+        self._clients = weakref.WeakKeyDictionary()
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def request(self, method, url, session=None, stream=False, **kwargs):
+        """
+        Sends a request over the pooled connections.
+
+        :type session: requests.Session
+        :param session: The session whose cookies should be sent with (and updated by) the
+            request. If None, the request is sent without cookies.
+
+        :type stream: boolean
+        :param stream: Don't read the body yet; read it in chunks with iter_bytes() and close
+            the response when done.
+
+        :returns: A requests.Response, or an httpx.Response if http2 is enabled. Both
+            expose status_code, text, content, headers and json().
+        """
+        if session is None:
+            session = self._anonymous
+
+        if self.http2:
+            client = self._client(session)
+            if stream:
+                return client.send(client.build_request(method, url, **kwargs), stream=True)
+            return client.request(method, url, **kwargs)
+
+        if session.get_adapter("https://") is not self._adapter:
+            self._mount(session)
+        kwargs.setdefault("timeout", self.timeout)
+        return session.request(method, url, stream=stream, **kwargs)
+
+    async def async_request(self, method, url, session=None, stream=False, **kwargs):
+        """
+        Same as request(), but non-blocking. Always uses httpx; read streamed responses with
+        aiter_bytes() and close them with aclose().
+        """
+        if session is None:
+            session = self._anonymous
+        client = self._async_client(session)
+        if stream:
+            return await client.send(client.build_request(method, url, **kwargs), stream=True)
+        return await client.request(method, url, **kwargs)
+
+    def close(self):
+        self._adapter.close()
+        if self._pool is not None:
+            self._pool.close()
+
+    async def aclose(self):
+        if self._async_pool is not None:
+            await self._async_pool.aclose()
+
+    def _mount(self, session):
+        session.mount("https://", self._adapter)
+        session.mount("http://", self._adapter)
+
+    def _limits(self):
+        return httpx.Limits(
+            max_connections=self.pool_connections * self.pool_maxsize,
+            max_keepalive_connections=self.pool_connections * self.pool_maxsize
+        )
+
+    def _client(self, session):
+        if self._pool is None:
+            self._pool = httpx.HTTPTransport(http2=self.http2, limits=self._limits())
+        client = self._clients.get(session)
+        if client is None:
+            # Clients are cheap; the connections live in the shared pool.
+            client = httpx.Client(transport=self._pool, timeout=self.timeout, follow_redirects=True)
+            self._clients[session] = client
+        # The cookie jar is replaced on every login, so make sure the client uses the current one.
+        if client.cookies.jar is not session.cookies:
+            client.cookies = session.cookies
+        return client
+
+    def _async_client(self, session):
+        if httpx is None:
+            raise ImportError("AsyncSchwab requires httpx; install it with `pip install schwab-api[async]`")
+        if self._async_pool is None:
+            self._async_pool = httpx.AsyncHTTPTransport(http2=self.http2, limits=self._limits())
+        client = self._async_clients.get(session)
+        if client is None:
+            client = httpx.AsyncClient(transport=self._async_pool, timeout=self.timeout, follow_redirects=True)
+            self._async_clients[session] = client
+        if client.cookies.jar is not session.cookies:
+            client.cookies = session.cookies
+        return client
+
+
+def iter_bytes(response, chunk_size=65536):
+    """
+    Reads the body of a response returned by Transport.request(stream=True) in chunks.
+    """
+    if hasattr(response, "iter_content"):
+        return response.iter_content(chunk_size)
+    return response.iter_bytes(chunk_size)
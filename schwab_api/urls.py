@@ -1,3 +1,4 @@
+import urllib.parse
 
 def homepage():
     return "https://www.schwab.com/"
@@ -8,6 +9,9 @@ def account_summary():
 def trade_ticket():
     return "https://client.schwab.com/app/trade/tom/trade?ShowUN=YES"
 
+def bearer_token(token_type):
+    return f"https://client.schwab.com/api/auth/authorize/scope/{token_type}"
+
 # New API
 def order_verification_v2():
     return "https://ausgateway.schwab.com/api/is.TradeOrderManagementWeb/v1/TradeOrderManagementWebPort/orders"
@@ -45,3 +49,22 @@ def order_verification():
 
 def order_confirmation():
     return "https://client.schwab.com/api/ts/stamp/confirmorder"
+
+
+def endpoint_name(url):
+    """
+    Returns the name of the function of this module that builds url (e.g. "orders_v2"), or
+    the host of url if it isn't one of them. Used to keep limits and statistics per endpoint.
+    """
+    path = url.split("?", 1)[0]
+    if path.startswith(bearer_token("")):
+        return "bearer_token"
+    return _ENDPOINT_NAMES.get(path) or urllib.parse.urlsplit(url).netloc
+
+_ENDPOINT_NAMES = {
+    endpoint().split("?", 1)[0]: endpoint.__name__ for endpoint in (
+        homepage, account_summary, trade_ticket, order_verification_v2, account_info_v2,
+        positions_v2, ticker_quotes_v2, orders_v2, cancel_order_v2, transaction_history_v2,
+        lot_details_v2, option_chains_v2, positions_data, order_verification, order_confirmation
+    )
+}
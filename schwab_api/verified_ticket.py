@@ -0,0 +1,49 @@
+import time
+
+
+class VerifiedTicket:
+    def __init__(self, payload, response, messages, success, limit_price_warning=None, valid_return_codes=None):
+        """
+        An order verified by Schwab, as returned by verify_v2() and verify_option_v2(). If
+        success is True, place(ticket) places it with a single request, without verifying it
+        again, so orders can be verified ahead of time:
+
+            ticket = api.verify_v2("AAPL", "Buy", 1, account_id)
+            ...
+            messages, success = api.place(ticket)
+
+        Attributes:
+            account_id (str) - The account of the order.
+            order_id (int) - The orderId Schwab gave the order, or None if verification failed.
+            security_ids (list) - The schwabSecurityId Schwab resolved for each leg.
+            messages (list of str) - The warnings returned by the verification (or the error).
+            return_code (int) - The orderReturnCode of the verification.
+            success (bool) - Whether return_code is one of the valid_return_codes.
+            verified_at (float) - When the order was verified (time.time()). Schwab checked
+                        the order against the market and the account at that time, so old
+                        tickets are better verified again.
+
+        The ticket itself is not modified when placed.
+        """
+        self.payload = payload
+        self.messages = messages
+        self.success = success
+        self.limit_price_warning = limit_price_warning
+        self.valid_return_codes = valid_return_codes
+        self.verified_at = time.time()
+        self.account_id = payload["UserContext"]["AccountId"]
+        strategy = (response or {}).get("orderStrategy") or {}
+        self.order_id = strategy.get("orderId")
+        self.return_code = strategy.get("orderReturnCode")
+        self.security_ids = [leg.get("schwabSecurityId") for leg in strategy.get("orderLegs") or []]
+
+    @property
+    def age(self):
+        """
+        Seconds since the order was verified.
+        """
+        return time.time() - self.verified_at
+
+    def __repr__(self):
+        return "VerifiedTicket(account_id={}, order_id={}, success={}, messages={})".format(
+            self.account_id, self.order_id, self.success, self.messages)
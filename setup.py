@@ -19,6 +19,11 @@ setuptools.setup(
     download_url="https://github.com/itsjafer/schwab-api/tarball/master",
     keywords=["schwab", "python3", "api", "unofficial", "schwab-api", "schwab charles api"],
     install_requires=["playwright", "playwright-stealth", "pyotp", "python-vipaccess"],
+    extras_require={
+        "async": ["httpx"],
+        "http2": ["httpx[http2]"],
+        "options": ["numpy"],
+    },
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Developers",
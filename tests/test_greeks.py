@@ -0,0 +1,54 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from schwab_api.greeks import implied_volatility, option_price
+
+SPOT = 2000.0
+STRIKES = np.arange(1000, 3001, 5.0)
+
+
+@pytest.mark.parametrize("days", [1, 7, 30, 90, 365])
+@pytest.mark.parametrize("vol", [0.05, 0.15, 0.3, 0.8, 2.0])
+@pytest.mark.parametrize("is_call", [True, False])
+def test_round_trip(days, vol, is_call):
+    t = days / 365
+    price = option_price(SPOT, STRIKES, t, vol, is_call, rate=0.05)
+    solved = implied_volatility(price, SPOT, STRIKES, t, is_call, rate=0.05)
+    known = np.isfinite(solved)
+    # Only prices lost in rounding errors (far from the money) may be left unsolved
+    assert known[np.abs(STRIKES - SPOT) <= 3 * vol * np.sqrt(t) * SPOT].all()
+    assert np.abs(solved[known] - vol)[price[known] > 1e-300].max() < 2e-4
+
+
+def test_round_trip_vol_smile():
+    # The vol of example/benchmark_greeks.py
+    vol = 0.2 + 0.1 * np.abs(STRIKES - SPOT) / 500
+    for days in (7, 30):
+        for is_call in (True, False):
+            price = option_price(SPOT, STRIKES, days / 365, vol, is_call, rate=0.05)
+            solved = implied_volatility(price, SPOT, STRIKES, days / 365, is_call, rate=0.05)
+            known = np.isfinite(solved) & (price > 1e-300)
+            assert np.abs(solved[known] - vol[known]).max() < 2e-4
+
+
+def test_deep_in_and_out_of_the_money():
+    strikes = np.array([1500.0, 1550.0, 1600.0])
+    vol = 0.2 + 0.1 * np.abs(strikes - SPOT) / 500
+    for is_call in (True, False):
+        price = option_price(SPOT, strikes, 7 / 365, vol, is_call, rate=0.05)
+        solved = implied_volatility(price, SPOT, strikes, 7 / 365, is_call, rate=0.05)
+        np.testing.assert_allclose(solved, vol, atol=1e-5)
+
+
+def test_scalar():
+    price = option_price(100, 100, 0.5, 0.25, True)
+    solved = implied_volatility(float(price), 100, 100, 0.5, True)
+    assert solved.shape == ()
+    assert abs(float(solved) - 0.25) < 1e-6
+
+
+def test_invalid_prices():
+    # below intrinsic value, above the underlying, missing, expired
+    solved = implied_volatility([5.0, 150.0, np.nan, 1.0], 100, [90, 100, 100, 100], [0.5, 0.5, 0.5, 0], True)
+    assert np.isnan(solved).all()